@@ -4,15 +4,46 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
 from datetime import timedelta
 import os
+import sqlite3
 from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from utils.sharding import ShardedSession, configure_shards
 
 load_dotenv()
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': ShardedSession})
 jwt = JWTManager()
 
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite only enforces foreign keys (and their ON DELETE CASCADE) on
+    connections that ask for it."""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+class BiteBudgetFlask(Flask):
+    def async_to_sync(self, func):
+        """Run async views on the worker's shared event loop (see utils.aio)
+        instead of starting a new event loop for every request."""
+        from utils.aio import worker_loop
+        
+        def run(*args, **kwargs):
+            return worker_loop.run(func(*args, **kwargs), timeout=self.config['ASYNC_VIEW_TIMEOUT'])
+        return run
+
 def create_app():
-    app = Flask(__name__)
+    from utils.json_provider import BiteBudgetJSONProvider
+    from utils.compression import init_compression
+    from utils.pubsub import init_pubsub
+    from utils.admission import init_admission, admission_metrics, parse_limits, default_state_dir
+    from commands import register_commands
+    
+    app = BiteBudgetFlask(__name__)
+    app.json = BiteBudgetJSONProvider(app)
     
     # Configuration
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
@@ -28,12 +59,89 @@ def create_app():
     
     app.config['SQLALCHEMY_DATABASE_URI'] = database_url
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Optional per-user shards for receipts and budgets (utils.sharding);
+    # comma-separated URLs, listing DATABASE_URL to keep existing data as a shard
+    configure_shards(app, os.environ.get('SHARD_DATABASE_URLS', '').split(','))
     app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'jwt-secret-change-in-production')
     app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
     
+    
+    # Async pricing views: how long a request may wait on the worker's event loop
+    app.config['ASYNC_VIEW_TIMEOUT'] = float(os.environ.get('ASYNC_VIEW_TIMEOUT', 30))
+    # Simulated store API round-trip for the mock price sources
+    app.config['MOCK_PRICE_LATENCY_MS'] = int(os.environ.get('MOCK_PRICE_LATENCY_MS', 0))
+    
+    # Price index: minimum distinct users behind each published price
+    app.config['PRICE_INDEX_MIN_USERS'] = int(os.environ.get('PRICE_INDEX_MIN_USERS', 3))
+    
+    # Server-sent price stream (utils.pubsub); SSE_REDIS_URL shares events across processes
+    app.config['SSE_HEARTBEAT_SECONDS'] = float(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+    app.config['SSE_MAX_STREAM_SECONDS'] = int(os.environ.get('SSE_MAX_STREAM_SECONDS', 3600))
+    app.config['SSE_REPLAY_SIZE'] = int(os.environ.get('SSE_REPLAY_SIZE', 100))
+    app.config['SSE_REPLAY_SECONDS'] = int(os.environ.get('SSE_REPLAY_SECONDS', 300))
+    app.config['SSE_REDIS_URL'] = os.environ.get('SSE_REDIS_URL', '')
+    # Streams served by gunicorn hold a request thread each, so cap them below GUNICORN_THREADS.
+    # SSE_STREAM_URL (public base URL of run_stream.py, which needs SSE_REDIS_URL) moves
+    # them to the async stream server; gunicorn starts it on SSE_STREAM_PORT
+    app.config['SSE_MAX_STREAMS'] = int(os.environ.get('SSE_MAX_STREAMS') or max(int(os.environ.get('GUNICORN_THREADS', 32)) // 4, 1))
+    app.config['SSE_STREAM_URL'] = os.environ.get('SSE_STREAM_URL', '')
+    app.config['SSE_STREAM_PORT'] = int(os.environ.get('SSE_STREAM_PORT', 5001))
+    app.config['SSE_TICKET_SECONDS'] = int(os.environ.get('SSE_TICKET_SECONDS', 60))
+    
+    # Cold archive (models.archive): receipts older than ARCHIVE_AFTER_DAYS move to
+    # per-user Parquet files; keep it above the 365 days the dashboard reads
+    app.config['ARCHIVE_DIR'] = os.environ.get('ARCHIVE_DIR') or os.path.join(app.instance_path, 'archive')
+    app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 730))
+    app.config['ARCHIVE_COMPRESSION'] = os.environ.get('ARCHIVE_COMPRESSION', 'zstd')
+    
+    # Admission control for expensive routes (utils.admission), shared by the
+    # host's workers: <class>=<concurrency>:<queue> and <class>=<per-user rate/s>:<burst>.
+    # Keep the sum of concurrency + queue below GUNICORN_WORKERS * GUNICORN_THREADS.
+    app.config['ADMISSION_ENABLED'] = os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+    app.config['ADMISSION_LIMITS'] = parse_limits(
+        os.environ.get('ADMISSION_LIMITS', ''), {'analytics': (4, 8), 'pricing': (8, 8), 'scan': (2, 4)}
+    )
+    app.config['ADMISSION_RATES'] = parse_limits(
+        os.environ.get('ADMISSION_RATES', ''), {'analytics': (5, 20), 'pricing': (5, 20), 'scan': (0.5, 5)}, cast=float
+    )
+    app.config['ADMISSION_QUEUE_TIMEOUT'] = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 5))
+    app.config['ADMISSION_STATE_DIR'] = os.environ.get('ADMISSION_STATE_DIR') or default_state_dir()
+    
+    # Catalog imports (services.catalog_import): rows per upsert transaction;
+    # POST /api/products/import needs CATALOG_IMPORT_TOKEN (unset: disabled)
+    app.config['CATALOG_IMPORT_BATCH_SIZE'] = int(os.environ.get('CATALOG_IMPORT_BATCH_SIZE', 5000))
+    app.config['CATALOG_IMPORT_TOKEN'] = os.environ.get('CATALOG_IMPORT_TOKEN', '')
+    
+    # Item category classifier (services.categorizer): model file and the
+    # confidence below which an item stays 'Other'
+    app.config['CATEGORY_MODEL_PATH'] = os.environ.get('CATEGORY_MODEL_PATH') or os.path.join(app.instance_path, 'category_model.npz')
+    app.config['CATEGORY_MIN_CONFIDENCE'] = float(os.environ.get('CATEGORY_MIN_CONFIDENCE', 0.5))
+    
+    # Rendered report charts (services.reports), one directory per user
+    app.config['REPORT_CACHE_DIR'] = os.environ.get('REPORT_CACHE_DIR') or os.path.join(app.instance_path, 'reports')
+    
+    # Bulk deletes (services.purge): receipts (with their items) per transaction
+    app.config['PURGE_CHUNK_SIZE'] = int(os.environ.get('PURGE_CHUNK_SIZE', 500))
+    
+    # Background jobs (run_worker.py)
+    app.config['JOB_WORKER_PROCESSES'] = int(os.environ.get('JOB_WORKER_PROCESSES', 2))
+    app.config['JOB_POLL_INTERVAL'] = float(os.environ.get('JOB_POLL_INTERVAL', 1.0))
+    app.config['JOB_LOCK_TIMEOUT'] = int(os.environ.get('JOB_LOCK_TIMEOUT', 300))
+    app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+    app.config['JOB_RETRY_BASE_SECONDS'] = float(os.environ.get('JOB_RETRY_BASE_SECONDS', 10))
+    app.config['JOB_RETENTION_DAYS'] = int(os.environ.get('JOB_RETENTION_DAYS', 7))
+    
+    # Response compression (gzip, or brotli when installed)
+    app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+    app.config['COMPRESS_BR_LEVEL'] = int(os.environ.get('COMPRESS_BR_LEVEL', 4))
+    
     # Initialize extensions
     db.init_app(app)
     jwt.init_app(app)
+    init_compression(app)
+    init_pubsub(app)
+    init_admission(app)
     
     # Configure CORS for both local development and production
     # Allow all origins for now to ensure frontend works
@@ -46,6 +154,7 @@ def create_app():
     from routes.budget import budget_bp
     from routes.products import products_bp
     from routes.realtime_pricing import realtime_pricing_bp
+    from routes.jobs import jobs_bp
     
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(receipts_bp, url_prefix='/api/receipts')
@@ -53,30 +162,45 @@ def create_app():
     app.register_blueprint(budget_bp, url_prefix='/api/budget')
     app.register_blueprint(products_bp, url_prefix='/api/products')
     app.register_blueprint(realtime_pricing_bp, url_prefix='/api')
+    app.register_blueprint(jobs_bp, url_prefix='/api/jobs')
     
     # Health check endpoint
     @app.route('/api/health')
     def health_check():
         return jsonify({'status': 'healthy', 'message': 'BiteBudget API is running'}), 200
     
+    @app.route('/api/metrics')
+    def metrics():
+        return jsonify({'admission': admission_metrics()}), 200
+    
     @app.route('/')
     def index():
         return jsonify({'message': 'BiteBudget V2 API', 'version': '1.0.0'}), 200
     
-    # Create tables
+    register_commands(app)
+    
+    # Tables and migrations are not touched here, so worker boot does no
+    # database work: run `flask init-db` (done by run.py and the production
+    # image before gunicorn starts) to create or upgrade the schema.
+    
+    return app
+
+def ensure_sqlite_directory(db_uri):
+    """Create the directory of a file-based SQLite database."""
+    if 'sqlite:///' in db_uri:
+        db_path = db_uri.replace('sqlite:///', '')
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+def init_database(app):
+    """Create missing tables and apply pending migrations (development server)."""
+    from migrations import upgrade_all
     with app.app_context():
         try:
-            # Ensure directory exists for SQLite
             db_uri = app.config['SQLALCHEMY_DATABASE_URI']
-            if 'sqlite:///' in db_uri:
-                db_path = db_uri.replace('sqlite:///', '')
-                db_dir = os.path.dirname(db_path)
-                if db_dir:
-                    os.makedirs(db_dir, exist_ok=True)
-            db.create_all()
+            upgrade_all()
             print(f"Database initialized successfully at: {db_uri}")
         except Exception as e:
             print(f"Database initialization error: {e}")
             # Continue anyway - let the app try to work
-    
-    return app
@@ -0,0 +1,61 @@
+"""Benchmark the basket optimizer.
+
+Usage (from backend/):
+    python benchmarks/bench_basket_optimizer.py [--items 200] [--stores 10] [--runs 20]
+
+Target: under 50 ms per optimization for 200 items x 10 stores.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.basket_optimizer import optimize_basket, EXACT_MAX_STORES
+
+
+def run(items, stores, runs, trip_cost, max_stores):
+    rng = np.random.default_rng(42)
+    base = rng.uniform(10, 150, size=items)
+    prices = np.round(base[:, None] * rng.uniform(0.8, 1.2, size=(items, stores)), 2)
+    quantities = rng.integers(1, 4, size=items)
+
+    optimize_basket(prices, quantities, trip_cost, max_stores)  # warm-up
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        plan = optimize_basket(prices, quantities, trip_cost, max_stores)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings.sort()
+    print(f"{items} items x {stores} stores, trip_cost={trip_cost}, max_stores={max_stores}: "
+          f"method={plan['method']} stores={len(plan['stores'])} "
+          f"median={timings[len(timings) // 2]:.2f} ms max={timings[-1]:.2f} ms "
+          f"total={plan['total_cost']:.2f} single_store={plan['best_single_store_cost']:.2f}")
+    return timings[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=200)
+    parser.add_argument('--stores', type=int, default=10)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--trip-cost', type=float, default=30.0)
+    parser.add_argument('--max-stores', type=int, default=3)
+    args = parser.parse_args()
+
+    median = run(args.items, args.stores, args.runs, args.trip_cost, args.max_stores)
+    run(args.items, args.stores, args.runs, args.trip_cost, None)
+    run(args.items, EXACT_MAX_STORES + 8, args.runs, args.trip_cost, args.max_stores)
+
+    if median > 50:
+        print(f"FAIL: median {median:.2f} ms exceeds the 50 ms budget")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Benchmark: item search latency as other users' items pile up.
+
+Seeds users with --items receipt items each (ten per receipt, names of
+three words from a small grocery vocabulary), and every time the user
+count reaches one of --steps times a set of searches by the first user.
+The searching user's history never changes, so a latency that holds
+steady as users are added means the search only reads that user's part
+of the index.
+
+Usage (from backend/):
+    python benchmarks/bench_item_search.py [--steps 1,5,20] [--items 100000] [--runs 20] [--db /tmp/bench_search.db]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORDS = ['leche', 'pan', 'aceite', 'oliva', 'arroz', 'frijol', 'queso', 'jamon', 'huevo', 'tortilla',
+         'manzana', 'platano', 'jabon', 'cafe', 'azucar', 'sal', 'atun', 'pasta', 'salsa', 'yogurt',
+         'cereal', 'galletas', 'refresco', 'agua', 'cerveza', 'pollo', 'carne', 'pescado', 'papel', 'detergente']
+QUERIES = [('leche', 'relevance'), ('leche', 'recent'), ('aceite oliva', 'relevance'), ('pla', 'relevance'),
+           ('jabon detergente cafe', 'relevance'), ('zzz', 'relevance')]
+ITEMS_PER_RECEIPT = 10
+
+
+def add_user(app, index, items, rng):
+    from app import db
+    from models import User, Receipt, ReceiptItem
+    from models.stores import resolve_store_id
+    from utils.sharding import using_user_shard
+
+    with app.app_context():
+        user = User(username=f'search{index}', email=f'search{index}@example.com')
+        user.set_password('bench-password')
+        db.session.add(user)
+        store_id = resolve_store_id('Bench Mart')
+        db.session.commit()
+
+        now = datetime.now()
+        with using_user_shard(user.id):
+            for start in range(0, items, 50000):
+                count = min(50000, items - start) // ITEMS_PER_RECEIPT
+                receipts = db.session.execute(db.insert(Receipt).returning(Receipt.id), [{
+                    'user_id': user.id, 'store_id': store_id, 'total_amount_cents': 5000, 'currency': 'MXN',
+                    'purchase_date': now - timedelta(minutes=rng.randrange(0, 2 * 365 * 24 * 60))
+                } for _ in range(count)]).scalars().all()
+                db.session.execute(db.insert(ReceiptItem), [{
+                    'receipt_id': receipt_id, 'quantity': 1, 'unit_price_cents': 500, 'total_price_cents': 500,
+                    'product_name': ' '.join(rng.sample(WORDS, 3)) + f' {rng.randint(1, 999)}g'
+                } for receipt_id in receipts for _ in range(ITEMS_PER_RECEIPT)])
+            db.session.commit()
+        return user.id
+
+
+def time_searches(app, user_id, runs):
+    from models.search import search_items
+    from utils.sharding import using_user_shard
+
+    timings = {}
+    with app.app_context(), using_user_shard(user_id):
+        for query, sort in QUERIES:
+            search_items(user_id, query, sort=sort)
+            started = time.perf_counter()
+            for _ in range(runs):
+                search_items(user_id, query, sort=sort)
+            timings[(query, sort)] = (time.perf_counter() - started) / runs * 1000
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--steps', default='1,5,20')
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--db', default='/tmp/bench_search.db')
+    args = parser.parse_args()
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    os.environ['DATABASE_URL'] = f'sqlite:///{args.db}'
+    from app import create_app, init_database
+    app = create_app()
+    init_database(app)
+
+    steps = [int(value) for value in args.steps.split(',')]
+    rng = random.Random(42)
+    results, users = {}, []
+    for step in steps:
+        started = time.perf_counter()
+        while len(users) < step:
+            users.append(add_user(app, len(users), args.items, rng))
+        print(f'{step} users x {args.items} items seeded in {time.perf_counter() - started:.1f}s')
+        results[step] = time_searches(app, users[0], args.runs)
+
+    print(f'\n{"query":28} {"sort":>9}' + ''.join(f' {f"{step} users":>10}' for step in steps) + '   (ms)')
+    for query, sort in QUERIES:
+        print(f'{query:28} {sort:>9}' + ''.join(f' {results[step][(query, sort)]:10.2f}' for step in steps))
+
+
+if __name__ == '__main__':
+    main()
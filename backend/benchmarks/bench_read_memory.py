@@ -0,0 +1,126 @@
+"""Peak memory per request for the read-only receipt, analytics and budget
+endpoints, on one user with many receipts.
+
+Usage (from backend/):
+    python benchmarks/bench_read_memory.py [--receipts 100000] [--items 3] [--db /tmp/bench_read.db]
+
+The database is seeded once (reused while --receipts/--items match) and
+each endpoint is requested with tracemalloc tracing; the body is consumed
+chunk by chunk, as a server would send it, and the reported peak is the
+Python heap allocated above the pre-request baseline. Times include the
+tracing overhead.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ENDPOINTS = [
+    '/api/receipts/',
+    '/api/analytics/spending-trends',
+    '/api/analytics/shopping-patterns',
+    '/api/analytics/category-breakdown',
+    '/api/analytics/top-products',
+    '/api/analytics/sustainability-score',
+    '/api/analytics/budget-analysis',
+    '/api/analytics/budget-forecast',
+    '/api/budget/',
+    '/api/budget/summary',
+    '/api/analytics/dashboard',
+]
+
+STORES = ['Walmart', 'Chedraui', 'Soriana', 'Costco', 'Oxxo']
+PRODUCTS = [('Organic Bananas', 'Fruits'), ('Whole Milk', 'Dairy'), ('Chicken Breast', 'Meat'),
+            ('Local Farm Eggs', 'Dairy'), ('Rice 1kg', 'Pantry'), ('Bread', 'Bakery')]
+
+
+def seed(app, receipts, items_per_receipt):
+    from app import db
+    from migrations import upgrade_schema
+    from models import User, Receipt, ReceiptItem, Budget
+    from models.stores import resolve_store_id
+
+    with app.app_context():
+        upgrade_schema(log=lambda message: None)
+        user = User.query.filter_by(username='bench').first()
+        if user and Receipt.query.filter_by(user_id=user.id).count() == receipts:
+            return
+        db.drop_all()
+        upgrade_schema(log=lambda message: None)
+        user = User(username='bench', email='bench@example.com')
+        user.set_password('bench-password')
+        db.session.add(user)
+        store_ids = [resolve_store_id(name) for name in STORES]
+        db.session.commit()
+
+        rng = random.Random(42)
+        now = datetime.now()
+        batch = 10000
+        for start in range(0, receipts, batch):
+            receipt_rows, item_rows = [], []
+            for receipt_id in range(start + 1, min(start + batch, receipts) + 1):
+                total_cents = 0
+                for _ in range(items_per_receipt):
+                    name, category = rng.choice(PRODUCTS)
+                    cents = rng.randrange(1000, 20000)
+                    total_cents += cents
+                    item_rows.append({'receipt_id': receipt_id, 'product_name': name, 'category': category,
+                                      'quantity': 1, 'unit_price_cents': cents, 'total_price_cents': cents})
+                receipt_rows.append({
+                    'id': receipt_id,
+                    'user_id': user.id,
+                    'store_id': rng.choice(store_ids),
+                    'total_amount_cents': total_cents,
+                    'currency': 'MXN',
+                    'purchase_date': now - timedelta(minutes=rng.randrange(0, 2 * 365 * 24 * 60)),
+                })
+            db.session.execute(db.insert(Receipt), receipt_rows)
+            db.session.execute(db.insert(ReceiptItem), item_rows)
+        for category in ('General', 'Dairy', 'Meat'):
+            db.session.add(Budget(user_id=user.id, name=category, category=category, period='monthly',
+                                  total_budget=5000, spent_amount=0,
+                                  start_date=now - timedelta(days=10), end_date=now + timedelta(days=20)))
+        db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--receipts', type=int, default=100000)
+    parser.add_argument('--items', type=int, default=3)
+    parser.add_argument('--db', default='/tmp/bench_read.db')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = f'sqlite:///{args.db}'
+    from app import create_app
+    app = create_app()
+
+    started = time.perf_counter()
+    seed(app, args.receipts, args.items)
+    print(f'{args.receipts} receipts x {args.items} items ready in {time.perf_counter() - started:.1f}s\n')
+
+    client = app.test_client()
+    token = client.post('/api/auth/login', json={'username': 'bench', 'password': 'bench-password'}).get_json()['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    tracemalloc.start()
+    print(f'{"endpoint":40} {"status":>6} {"body MB":>8} {"peak MB":>9} {"time s":>8}')
+    for endpoint in ENDPOINTS:
+        baseline = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        response = client.get(endpoint, headers=headers)
+        size = sum(len(chunk) for chunk in response.iter_encoded())
+        response.close()
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        print(f'{endpoint:40} {response.status_code:>6} {size / 2**20:8.1f} {peak / 2**20:9.1f} {elapsed:8.2f}')
+        del response
+
+
+if __name__ == '__main__':
+    main()
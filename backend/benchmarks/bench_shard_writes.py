@@ -0,0 +1,133 @@
+"""Benchmark: concurrent POST /api/receipts/ throughput by shard count.
+
+For each shard count a fresh set of SQLite files is created under --dir
+(the first shard is the main database), --users users are registered
+(spread evenly over the shards) and --writers processes create receipts
+through the test client for --seconds. Every process writes for its own
+slice of users, so with one shard all writers queue on one write lock and
+with N shards on N locks.
+
+    python benchmarks/bench_shard_writes.py [--shards 1,2,4] [--writers 8]
+        [--users 32] [--seconds 10] [--items 5] [--dir /var/tmp/bitebudget-shards]
+
+Use a directory on a real disk: on tmpfs commits are nearly free and the
+write lock is never the bottleneck.
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def configure(directory, shards):
+    main = f'sqlite:///{directory}/main.db'
+    os.environ['DATABASE_URL'] = main
+    os.environ['SHARD_DATABASE_URLS'] = ','.join(
+        [main] + [f'sqlite:///{directory}/shard{index}.db' for index in range(1, shards)]
+    ) if shards > 1 else ''
+
+
+def receipt_payload(items):
+    return {
+        'store_name': 'Bench Mart',
+        'total_amount': 2.5 * items,
+        'purchase_date': '2026-10-01T12:00:00',
+        'items': [
+            {'product_name': f'Item {index}', 'unit_price': 2.5, 'total_price': 2.5, 'category': 'Pantry'}
+            for index in range(items)
+        ]
+    }
+
+
+def writer(tokens, seconds, items, ready, go, results):
+    from app import create_app
+    client = create_app().test_client()
+    payload = receipt_payload(items)
+    headers = [{'Authorization': f'Bearer {token}'} for token in tokens]
+
+    ready.put(True)
+    go.wait()
+    deadline = time.time() + seconds
+    latencies, errors, index = [], 0, 0
+    while time.time() < deadline:
+        started = time.perf_counter()
+        response = client.post('/api/receipts/', json=payload, headers=headers[index % len(headers)])
+        latencies.append(time.perf_counter() - started)
+        errors += response.status_code != 201
+        index += 1
+    results.put((len(latencies) - errors, errors, latencies))
+
+
+def run(directory, shards, writers, users, seconds, items):
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, '*.db*')):
+        os.remove(path)
+    configure(directory, shards)
+
+    from app import create_app, init_database
+    app = create_app()
+    init_database(app)
+    client = app.test_client()
+    tokens = []
+    for index in range(users):
+        response = client.post('/api/auth/register', json={
+            'username': f'bench{index}', 'email': f'bench{index}@example.com', 'password': 'bench-password'
+        })
+        tokens.append(response.get_json()['access_token'])
+
+    context = multiprocessing.get_context('spawn')
+    ready, go, results = context.Queue(), context.Event(), context.Queue()
+    processes = [
+        context.Process(target=writer, args=(tokens[index::writers], seconds, items, ready, go, results))
+        for index in range(writers)
+    ]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.get()
+    go.set()
+    outcomes = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    created = sum(outcome[0] for outcome in outcomes)
+    errors = sum(outcome[1] for outcome in outcomes)
+    latencies = sorted(latency for outcome in outcomes for latency in outcome[2])
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0
+    return created / seconds, errors, p95
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shards', default='1,2,4')
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--users', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--items', type=int, default=5)
+    parser.add_argument('--dir', default='/var/tmp/bitebudget-shards')
+    args = parser.parse_args()
+
+    print(f"{'shards':>6} {'writers':>7} {'receipts/s':>11} {'errors':>7} {'p95 ms':>8}")
+    for shards in (int(value) for value in args.shards.split(',')):
+        # A fresh interpreter per shard count, so each run builds its own app and engines
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        process = context.Process(target=_run_into, args=(
+            results, args.dir, shards, args.writers, args.users, args.seconds, args.items
+        ))
+        process.start()
+        throughput, errors, p95 = results.get()
+        process.join()
+        print(f"{shards:>6} {args.writers:>7} {throughput:>11.1f} {errors:>7} {p95:>8.1f}")
+
+
+def _run_into(results, *args):
+    results.put(run(*args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Load test: concurrent /api/compare-prices requests against one worker.
+
+Start a single worker with a simulated store API latency, then run:
+
+    MOCK_PRICE_LATENCY_MS=200 GUNICORN_WORKERS=1 gunicorn -c gunicorn.conf.py run:app
+    python benchmarks/load_compare_prices.py [--url http://localhost:5000] \\
+        [--requests 400] [--concurrency 50] [--products 5]
+
+Each request fans out to (products x stores) concurrent lookups on the
+worker's event loop, so with one worker the throughput should scale with
+--concurrency (up to GUNICORN_THREADS) instead of being capped at
+1 / latency requests per second.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import aiohttp
+import numpy as np
+
+PRODUCTS = ['milk', 'bread', 'eggs', 'chicken', 'rice', 'coca-cola', 'bananas']
+
+
+async def get_token(session, url):
+    username = f'load-{uuid.uuid4().hex[:8]}'
+    payload = {'username': username, 'email': f'{username}@example.com', 'password': 'load-test-pass'}
+    async with session.post(f'{url}/api/auth/register', json=payload) as response:
+        body = await response.json()
+    return body['access_token']
+
+
+async def run(url, total, concurrency, products):
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        token = await get_token(session, url)
+        headers = {'Authorization': f'Bearer {token}'}
+        payload = {'products': (PRODUCTS * products)[:products]}
+        latencies, errors = [], 0
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                async with session.post(f'{url}/api/compare-prices', json=payload, headers=headers) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    print(f'{total} requests, concurrency {concurrency}, {products} products/request')
+    print(f'  throughput: {total / elapsed:.1f} req/s  errors: {errors}')
+    print(f'  latency ms: p50 {np.percentile(latencies, 50):.1f}  '
+          f'p95 {np.percentile(latencies, 95):.1f}  max {latencies.max():.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--products', type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.url.rstrip('/'), args.requests, args.concurrency, args.products))
+
+
+if __name__ == '__main__':
+    main()
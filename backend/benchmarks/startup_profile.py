@@ -0,0 +1,98 @@
+"""Startup profile: import cost of building the app, with a budget.
+
+Usage (from backend/):
+    python benchmarks/startup_profile.py [--budget-ms 300] [--top 15]
+
+Runs ``python -X importtime`` on ``from run import app`` in a fresh
+interpreter and prints the most expensive imports. It then forks a
+worker the way gunicorn does with ``preload_app`` and times how long the
+worker takes to answer its first ``/api/health`` request.
+
+Exits non-zero when that worker takes longer than the budget to become
+ready, or when a heavy dependency (numpy, pandas, sklearn, OCR, plotting,
+aiohttp) is imported at start-up instead of on first use. Without
+preloading, a worker pays the full app build time instead (also printed).
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFERRED_MODULES = ('numpy', 'pandas', 'sklearn', 'cv2', 'pytesseract', 'matplotlib', 'aiohttp', 'pyarrow')
+
+PROBE = """
+import os, time
+started = time.perf_counter()
+from run import app
+print('build_ms', (time.perf_counter() - started) * 1000)
+
+read_end, write_end = os.pipe()
+started = time.perf_counter()
+pid = os.fork()
+if pid == 0:
+    from app import db
+    with app.app_context():
+        db.engine.dispose(close=False)
+    app.test_client().get('/api/health')
+    os.write(write_end, b'1')
+    os._exit(0)
+os.read(read_end, 1)
+print('worker_ready_ms', (time.perf_counter() - started) * 1000)
+os.waitpid(pid, 0)
+"""
+
+
+def run_probe(*flags):
+    return subprocess.run(
+        [sys.executable, *flags, '-c', PROBE],
+        cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+    )
+
+
+def profile():
+    # Timings come from a plain run; -X importtime inflates them
+    result = run_probe()
+    timings = dict(line.split() for line in result.stdout.splitlines())
+
+    imports = []
+    for line in run_probe('-X', 'importtime').stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        imports.append((int(fields[1]), int(fields[0]), fields[2][1:].rstrip()))
+    return float(timings['build_ms']), float(timings['worker_ready_ms']), imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=300)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    build_ms, ready_ms, imports = profile()
+    # Modules imported directly by run.py/app.py and their direct imports
+    shallow = sorted((entry for entry in imports if len(entry[2]) - len(entry[2].lstrip()) <= 4), reverse=True)
+
+    print(f'{"cumulative ms":>14} {"self ms":>8}  module')
+    for cumulative_us, self_us, name in shallow[:args.top]:
+        print(f'{cumulative_us / 1000:14.1f} {self_us / 1000:8.1f}  {name.rstrip()}')
+
+    loaded = {name.strip() for _, _, name in imports}
+    eager = sorted(module for module in DEFERRED_MODULES if module in loaded)
+
+    print(f'\napp build (master, or worker without preload): {build_ms:.0f} ms')
+    print(f'preloaded worker ready: {ready_ms:.0f} ms (budget {args.budget_ms:.0f} ms)')
+    failures = []
+    if ready_ms > args.budget_ms:
+        failures.append(f'worker took {ready_ms:.0f} ms to become ready')
+    if eager:
+        failures.append(f'imported at start-up: {", ".join(eager)}')
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
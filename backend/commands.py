@@ -0,0 +1,147 @@
+"""Flask CLI commands (``flask --app run <command>``)."""
+import click
+
+
+def register_commands(app):
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create missing tables and apply pending schema migrations."""
+        from migrations import upgrade_all
+        db_uri = app.config['SQLALCHEMY_DATABASE_URI']
+        upgrade_all(log=click.echo)
+        click.echo(f"Database ready at: {db_uri}")
+
+    @app.cli.command('check-migrations')
+    def check_migrations_command():
+        """Upgrade a throwaway database in the original schema, with sample
+        rows, to the latest schema and check the rows survive."""
+        from migrations import check_upgrade
+        problems = check_upgrade(log=click.echo)
+        for problem in problems:
+            click.echo(f"  {problem}", err=True)
+        if problems:
+            raise click.ClickException(f"{len(problems)} problem(s) upgrading the original schema")
+        click.echo("Migrations upgrade the original schema cleanly")
+
+    @app.cli.command('rollover-budgets')
+    def rollover_budgets_command():
+        """Start the next period of every recurring budget that has ended."""
+        from services.budget_periods import rollover_budgets
+        created = rollover_budgets()
+        click.echo(f"Created {created} budget period(s)")
+
+    @app.cli.command('build-price-index')
+    @click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+                  help='Only rebuild weeks from this date on (default: full rebuild).')
+    @click.option('--min-users', type=int, default=None, help='Minimum distinct users per entry.')
+    def build_price_index_command(since, min_users):
+        """Aggregate all users' receipt prices into the weekly price index."""
+        import time
+        from services.price_index import build_price_index
+        started = time.perf_counter()
+        rows = build_price_index(
+            since=since.date() if since else None,
+            min_users=min_users or app.config['PRICE_INDEX_MIN_USERS']
+        )
+        click.echo(f"Wrote {rows} price index rows in {time.perf_counter() - started:.1f}s")
+
+    @app.cli.command('archive-receipts')
+    @click.option('--older-than-days', type=int, default=None,
+                  help='Archive horizon in days (default: ARCHIVE_AFTER_DAYS).')
+    def archive_receipts_command(older_than_days):
+        """Move old receipts out of the hot tables into per-user Parquet files."""
+        from models.archive import archive_receipts
+        counts = archive_receipts(after_days=older_than_days, log=click.echo)
+        click.echo(f"Archived {counts['receipts']} receipt(s) of {counts['users']} user(s) "
+                   f"purchased before {counts['cutoff']:%Y-%m-%d}")
+
+    @app.cli.command('import-catalog')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default=None,
+                  help='Catalog format (default: from the file name or its content).')
+    @click.option('--store', default=None, help='Store the prices come from, for rows without one.')
+    @click.option('--batch-size', type=int, default=None, help='Rows per transaction (default: CATALOG_IMPORT_BATCH_SIZE).')
+    def import_catalog_command(path, fmt, store, batch_size):
+        """Upsert products and their prices from a CSV or NDJSON catalog (gzip ok)."""
+        from services.catalog_import import import_catalog, catalog_format, CatalogFormatError
+        with click.open_file(path, 'rb') as stream:
+            try:
+                report = import_catalog(stream, fmt or catalog_format(path), store=store,
+                                        batch_size=batch_size, log=click.echo)
+            except CatalogFormatError as e:
+                raise click.ClickException(str(e))
+        for error in report['errors']:
+            click.echo(f"Skipped line {error['line']}: {error['error']}", err=True)
+        click.echo(f"Imported {report['rows']} rows ({report['products']} product upserts, "
+                   f"{report['observations']} prices, {report['skipped']} skipped) "
+                   f"in {report['seconds']:.1f}s, {report['rows_per_second']} rows/s")
+
+    @app.cli.command('train-categorizer')
+    def train_categorizer_command():
+        """Train the item category classifier from categorized items and products."""
+        from services.categorizer import train_category_model
+        try:
+            train_category_model(log=click.echo)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+    @app.cli.command('reclassify-items')
+    @click.option('--chunk-size', type=int, default=None, help='Items per transaction.')
+    def reclassify_items_command(chunk_size):
+        """Classify existing 'Other' items with the trained category model."""
+        from services.categorizer import reclassify_items, RECLASSIFY_CHUNK_SIZE
+        try:
+            changed = reclassify_items(chunk_size=chunk_size or RECLASSIFY_CHUNK_SIZE, log=click.echo)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"Reclassified {changed} item(s)")
+
+    @app.cli.command('store-alias')
+    @click.argument('alias')
+    @click.argument('store')
+    def store_alias_command(alias, store):
+        """Resolve receipts from ALIAS (e.g. "Bodega Aurrera") to the existing STORE."""
+        from models.stores import add_store_alias
+        try:
+            store_id = add_store_alias(alias, store)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        click.echo(f"{alias!r} now resolves to store {store_id}")
+
+    @app.cli.command('purge-account')
+    @click.argument('user_id', type=int)
+    @click.confirmation_option(prompt='Delete this user and all of their data?')
+    def purge_account_command(user_id):
+        """Delete a user with their receipts, budgets, archive and jobs."""
+        from services.purge import purge_account
+        counts = purge_account(user_id)
+        click.echo(f"Deleted user {user_id}: {counts['receipts']} receipt(s), {counts['budgets']} budget(s)")
+
+    @app.cli.command('enqueue-job')
+    @click.argument('kind')
+    @click.option('--payload', default='{}', help='Job arguments as a JSON object.')
+    @click.option('--key', default=None, help='Idempotency key (e.g. the date for a daily job).')
+    def enqueue_job_command(kind, payload, key):
+        """Queue a background job for run_worker.py."""
+        import json
+        from services.jobs import enqueue
+        job, created = enqueue(kind, json.loads(payload), idempotency_key=key)
+        click.echo(f"{'Queued' if created else 'Already queued'}: job {job.id} ({job.status})")
+
+    @app.cli.command('shard-move-user')
+    @click.argument('user_id', type=int)
+    @click.argument('shard', type=int)
+    def shard_move_user_command(user_id, shard):
+        """Move one user's receipts and budgets to another shard."""
+        from utils.sharding import move_user
+        rows = move_user(user_id, shard)
+        click.echo(f"Moved {rows} row(s) of user {user_id} to shard {shard}")
+
+    @app.cli.command('shard-rebalance')
+    def shard_rebalance_command():
+        """Even out users across shards (e.g. after adding one), then delete
+        rows left behind on shards their users no longer live on."""
+        from utils.sharding import rebalance, purge_strays, shard_ids
+        moved = rebalance(log=click.echo)
+        strays = sum(purge_strays(shard) for shard in shard_ids())
+        click.echo(f"Moved {moved} user(s); purged stray rows of {strays} user(s)")
@@ -0,0 +1,70 @@
+"""Gunicorn settings for the async-capable deployment.
+
+Each worker process runs threaded (gthread) request handling plus one
+shared event loop (utils.aio): sync blueprints behave as before, while
+async pricing views from all of a worker's threads are multiplexed on
+that loop and its pooled aiohttp connections, so a slow store API ties
+up a thread but not the worker. A /api/price-stream connection served
+here parks one thread for its whole life, so at most SSE_MAX_STREAMS
+(default a quarter of GUNICORN_THREADS) are open per worker and the rest
+get 503. With SSE_STREAM_URL set, the master also starts run_stream.py,
+which serves the streams from one event loop, and the API redirects
+clients to it.
+
+    gunicorn -c gunicorn.conf.py run:app
+
+Unless JOB_WORKER_EMBEDDED=false, the master also starts run_worker.py so
+a single container serves requests and runs background jobs.
+
+The app is preloaded in the master, together with the heavy modules in
+GUNICORN_WARM_IMPORTS, so workers fork ready to serve and share those
+pages copy-on-write instead of importing them again.
+"""
+import importlib
+import os
+import subprocess
+import sys
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('GUNICORN_WORKERS', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+keepalive = 5
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+warm_imports = [name for name in os.environ.get('GUNICORN_WARM_IMPORTS', 'numpy,sklearn.feature_extraction.text').split(',') if name]
+
+
+def on_starting(server):
+    if preload_app:
+        for name in warm_imports:
+            importlib.import_module(name)
+
+
+def post_fork(server, worker):
+    # Never share the master's pooled database connections with a worker
+    if preload_app:
+        from app import db
+        from run import app
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+
+def when_ready(server):
+    if os.environ.get('JOB_WORKER_EMBEDDED', 'true').lower() == 'true':
+        worker_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'run_worker.py')
+        server.job_worker = subprocess.Popen([sys.executable, worker_script])
+        server.log.info(f"Started job worker (pid {server.job_worker.pid})")
+
+    if os.environ.get('SSE_STREAM_URL'):
+        stream_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'run_stream.py')
+        server.stream_server = subprocess.Popen([sys.executable, stream_script])
+        server.log.info(f"Started price stream server (pid {server.stream_server.pid})")
+
+
+def on_exit(server):
+    for child in (getattr(server, 'job_worker', None), getattr(server, 'stream_server', None)):
+        if child and child.poll() is None:
+            child.terminate()
+            child.wait(timeout=60)
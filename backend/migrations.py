@@ -0,0 +1,700 @@
+"""Schema migrations for existing databases.
+
+``db.create_all()`` only creates missing tables; it never alters existing
+ones. Changes to existing tables are registered here as numbered
+migrations and applied once, in order, by ``upgrade_schema()`` (run by
+``flask init-db``). A fresh database is created directly at the latest
+schema and stamped with every migration.
+"""
+import os
+import tempfile
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+from sqlalchemy import (
+    create_engine, insert, inspect, text, false, MetaData, Table, Column, Index, ForeignKey, Integer, Float, String, DateTime, Boolean, Text
+)
+from sqlalchemy.schema import CreateTable, AddConstraint
+
+from app import db
+from utils.sharding import declare_shard_foreign_keys
+
+MIGRATIONS = []
+
+
+class SchemaMigration(db.Model):
+    __tablename__ = 'schema_migration'
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+def migration(version, description):
+    def decorator(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return fn
+    return decorator
+
+
+def upgrade_schema(engine=None, log=print):
+    """Create missing tables, apply pending migrations and create missing indexes."""
+    from utils.sharding import shard_schema
+    import models.search  # noqa: F401 -- creates the item search index with receipt_item
+
+    engine = engine or db.engine
+    with shard_schema() if engine is not db.engine else nullcontext():
+        fresh = not inspect(engine).has_table('user')
+        db.Model.metadata.create_all(engine)
+
+        with engine.begin() as conn:
+            applied = set(conn.execute(text('SELECT version FROM schema_migration')).scalars())
+
+        for version, description, fn in MIGRATIONS:
+            if version in applied:
+                continue
+            with _migration_transaction(engine) as conn:
+                if not fresh:
+                    log(f"Applying migration {version}: {description}")
+                    fn(conn)
+                conn.execute(
+                    SchemaMigration.__table__.insert(),
+                    {'version': version, 'description': description, 'applied_at': datetime.utcnow()}
+                )
+
+        with engine.begin() as conn:
+            for table in db.Model.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(conn, checkfirst=True)
+
+
+@contextmanager
+def _migration_transaction(engine):
+    """A transaction with foreign keys unenforced on SQLite, where dropping
+    a table being rebuilt would otherwise cascade into (or be refused by)
+    the rows referencing it. The pragma only takes effect outside a
+    transaction, so it is set before the transaction begins."""
+    with engine.connect() as conn:
+        sqlite = conn.dialect.name == 'sqlite'
+        if sqlite:
+            conn.exec_driver_sql('PRAGMA foreign_keys=OFF')
+            conn.commit()
+        try:
+            with conn.begin():
+                yield conn
+        finally:
+            if sqlite:
+                conn.exec_driver_sql('PRAGMA foreign_keys=ON')
+                conn.commit()
+
+
+def upgrade_all(log=print):
+    """Upgrade the main database and every shard database (utils.sharding),
+    then link the price tracker's chains to their stores."""
+    from flask import current_app
+    from app import ensure_sqlite_directory
+    from utils.sharding import sharding_enabled, shard_ids, shard_url, shard_engine
+
+    ensure_sqlite_directory(current_app.config['SQLALCHEMY_DATABASE_URI'])
+    upgrade_schema(log=log)
+    if sharding_enabled():
+        for shard in shard_ids():
+            engine = shard_engine(shard)
+            if engine is db.engine:
+                continue
+            ensure_sqlite_directory(shard_url(shard))
+            upgrade_schema(engine, log=log)
+
+    from models.stores import link_tracked_stores
+    from routes.realtime_pricing import PRICE_TRACKING_STORES
+    link_tracked_stores(PRICE_TRACKING_STORES)
+
+
+def rebuild_table(conn, table, column_sql=None):
+    """Recreate a table as ``table`` defines it, copying its rows.
+
+    ``table`` is a frozen definition (see ``frozen_tables``), never a
+    model's table: the DDL is compiled from it, so it must not change
+    when the models do. Columns missing from the old table are filled
+    from ``column_sql`` (SQL expressions over the old columns) or left to
+    their server default. On SQLite this is the only way to change column
+    types or constraints; it follows SQLite's create/copy/drop/rename procedure so
+    references from other tables keep pointing at ``table``.
+    """
+    _require_frozen(table)
+    column_sql = column_sql or {}
+    inspector = inspect(conn)
+    old_columns = {column['name'] for column in inspector.get_columns(table.name)}
+
+    for index in inspector.get_indexes(table.name):
+        conn.execute(text(f'DROP INDEX IF EXISTS "{index["name"]}"'))
+
+    new_name = f'_new_{table.name}'
+    quoted_name = conn.dialect.identifier_preparer.format_table(table)
+    ddl = str(CreateTable(table).compile(dialect=conn.dialect))
+    conn.execute(text(ddl.replace(f'CREATE TABLE {quoted_name}', f'CREATE TABLE "{new_name}"', 1)))
+
+    targets, sources = [], []
+    for column in table.columns:
+        if column.name in column_sql:
+            sources.append(column_sql[column.name])
+        elif column.name in old_columns:
+            sources.append(f'"{column.name}"')
+        else:
+            continue
+        targets.append(f'"{column.name}"')
+
+    conn.execute(text(
+        f'INSERT INTO "{new_name}" ({", ".join(targets)}) '
+        f'SELECT {", ".join(sources)} FROM "{table.name}"'
+    ))
+    conn.execute(text(f'DROP TABLE "{table.name}"'))
+    conn.execute(text(f'ALTER TABLE "{new_name}" RENAME TO "{table.name}"'))
+
+    for index in table.indexes:
+        index.create(conn)
+
+
+def add_column(conn, table_name, column):
+    """Add ``column`` (a ``Column`` of its own) to an existing table if it is missing."""
+    if column.table is not None:
+        _require_frozen(column.table)
+    existing = {column['name'] for column in inspect(conn).get_columns(table_name)}
+    if column.name in existing:
+        return
+    Table(table_name, MetaData(), column)
+    spec = conn.dialect.ddl_compiler(conn.dialect, None).get_column_specification(column)
+    conn.execute(text(f'ALTER TABLE "{table_name}" ADD COLUMN {spec}'))
+
+
+def _require_frozen(table):
+    if table.metadata is db.Model.metadata:
+        raise ValueError(f'{table.name}: migrations take a frozen table definition, not the model\'s table')
+
+
+def frozen_tables(metadata):
+    """Complete the table definitions of one migration step.
+
+    A migration that rebuilds a table describes it as that step leaves it,
+    in a ``MetaData`` of its own, instead of using the model: the model is
+    the latest schema, and a migration must build the same table however
+    many later changes are still to be applied after it. Tables the
+    definitions reference get id-only stand-ins so their foreign keys
+    compile, and foreign keys from sharded tables to global ones are left
+    out of shard databases, as for the models.
+    """
+    for table in list(metadata.tables.values()):
+        for foreign_key in table.foreign_keys:
+            name, column_name = foreign_key.target_fullname.split('.')
+            if name not in metadata.tables:
+                Table(name, metadata, Column(column_name, Integer, primary_key=True))
+    declare_shard_foreign_keys(metadata)
+    return metadata
+
+
+def _money_columns(conn, table, columns, currency=False):
+    """Replace float money columns with integer-cents columns."""
+    existing = {column['name'] for column in inspect(conn).get_columns(table.name)}
+    column_sql = {
+        f'{name}_cents': f'CAST(ROUND(COALESCE("{name}", 0) * 100) AS INTEGER)'
+        for name in columns if name in existing
+    }
+    if currency:
+        column_sql['currency'] = "'MXN'"
+
+    if conn.dialect.name == 'sqlite':
+        rebuild_table(conn, table, column_sql)
+        return
+
+    for name, expression in column_sql.items():
+        column_type = 'VARCHAR(3)' if name == 'currency' else 'INTEGER'
+        conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{name}" {column_type}'))
+        conn.execute(text(f'UPDATE "{table.name}" SET "{name}" = {expression}'))
+        conn.execute(text(f'ALTER TABLE "{table.name}" ALTER COLUMN "{name}" SET NOT NULL'))
+    for name in columns:
+        if name in existing:
+            conn.execute(text(f'ALTER TABLE "{table.name}" DROP COLUMN "{name}"'))
+
+
+# The tables as they were before the first migration
+_SCHEMA_0 = MetaData()
+Table(
+    'user', _SCHEMA_0,
+    Column('id', Integer, primary_key=True),
+    Column('username', String(80), unique=True, nullable=False),
+    Column('email', String(120), unique=True, nullable=False),
+    Column('password_hash', String(128), nullable=False),
+    Column('created_at', DateTime),
+)
+Table(
+    'receipt', _SCHEMA_0,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('store_name', String(200), nullable=False),
+    Column('total_amount', Float, nullable=False),
+    Column('purchase_date', DateTime, nullable=False),
+    Column('created_at', DateTime),
+    Column('image_path', String(500)),
+)
+Table(
+    'receipt_item', _SCHEMA_0,
+    Column('id', Integer, primary_key=True),
+    Column('receipt_id', Integer, ForeignKey('receipt.id'), nullable=False),
+    Column('product_name', String(200), nullable=False),
+    Column('quantity', Integer),
+    Column('unit_price', Float, nullable=False),
+    Column('total_price', Float, nullable=False),
+    Column('category', String(100)),
+)
+Table(
+    'budget', _SCHEMA_0,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('name', String(200), nullable=False),
+    Column('total_budget', Float, nullable=False),
+    Column('spent_amount', Float),
+    Column('category', String(100)),
+    Column('period', String(50)),
+    Column('start_date', DateTime, nullable=False),
+    Column('end_date', DateTime, nullable=False),
+    Column('created_at', DateTime),
+)
+Table(
+    'product', _SCHEMA_0,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(200), nullable=False),
+    Column('category', String(100)),
+    Column('average_price', Float),
+    Column('price_history', Text),
+    Column('sustainability_score', Integer),
+    Column('created_at', DateTime),
+)
+frozen_tables(_SCHEMA_0)
+
+
+# The tables as migration 1 leaves them
+_SCHEMA_1 = MetaData()
+Table(
+    'receipt', _SCHEMA_1,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('store_name', String(200), nullable=False),
+    Column('total_amount_cents', Integer, nullable=False),
+    Column('currency', String(3), nullable=False),
+    Column('purchase_date', DateTime, nullable=False),
+    Column('created_at', DateTime),
+    Column('image_path', String(500)),
+)
+Table(
+    'receipt_item', _SCHEMA_1,
+    Column('id', Integer, primary_key=True),
+    Column('receipt_id', Integer, ForeignKey('receipt.id'), nullable=False),
+    Column('product_name', String(200), nullable=False),
+    Column('quantity', Integer),
+    Column('unit_price_cents', Integer, nullable=False),
+    Column('total_price_cents', Integer, nullable=False),
+    Column('category', String(100)),
+)
+Table(
+    'budget', _SCHEMA_1,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('name', String(200), nullable=False),
+    Column('total_budget_cents', Integer, nullable=False),
+    Column('spent_amount_cents', Integer, nullable=False),
+    Column('currency', String(3), nullable=False),
+    Column('category', String(100)),
+    Column('period', String(50)),
+    Column('start_date', DateTime, nullable=False),
+    Column('end_date', DateTime, nullable=False),
+    Column('created_at', DateTime),
+)
+frozen_tables(_SCHEMA_1)
+
+
+@migration(1, 'Store money as integer cents with a currency column')
+def _money_to_cents(conn):
+    tables = _SCHEMA_1.tables
+    _money_columns(conn, tables['receipt'], ['total_amount'], currency=True)
+    _money_columns(conn, tables['receipt_item'], ['unit_price', 'total_price'])
+    _money_columns(conn, tables['budget'], ['total_budget', 'spent_amount'], currency=True)
+
+
+@migration(2, 'Recurring budgets')
+def _recurring_budgets(conn):
+    add_column(conn, 'budget', Column('is_recurring', Boolean, nullable=False, server_default=false()))
+    add_column(conn, 'budget', Column('recurrence_anchor', DateTime))
+    add_column(conn, 'budget', Column('rolled_over', Boolean, nullable=False, server_default=false()))
+
+
+@migration(3, 'Pin every user to a receipt/budget shard')
+def _user_shard(conn):
+    add_column(conn, 'user', Column('shard', Integer, nullable=False, server_default='0'))
+
+
+@migration(4, 'Receipt fingerprints and idempotency keys')
+def _receipt_fingerprints(conn):
+    from models.fingerprints import backfill_fingerprints
+
+    add_column(conn, 'receipt', Column('fingerprint', String(32)))
+    add_column(conn, 'receipt', Column('idempotency_key', String(200)))
+    backfill_fingerprints(conn)
+
+
+# The receipt table as migration 5 leaves it
+_SCHEMA_5 = MetaData()
+Table(
+    'receipt', _SCHEMA_5,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('store_id', Integer, ForeignKey('store.id'), nullable=False),
+    Column('total_amount_cents', Integer, nullable=False),
+    Column('currency', String(3), nullable=False),
+    Column('purchase_date', DateTime, nullable=False),
+    Column('created_at', DateTime),
+    Column('image_path', String(500)),
+    Column('fingerprint', String(32)),
+    Column('idempotency_key', String(200)),
+    Index('ux_receipt_user_fingerprint', 'user_id', 'fingerprint', unique=True),
+    Index('ux_receipt_user_idempotency_key', 'user_id', 'idempotency_key', unique=True),
+    Index('ix_receipt_user_store', 'user_id', 'store_id'),
+)
+frozen_tables(_SCHEMA_5)
+
+
+@migration(5, 'Store table referenced by receipts')
+def _receipt_stores(conn):
+    from models.stores import resolve_store
+
+    receipts = _SCHEMA_5.tables['receipt']
+    names = list(conn.execute(text('SELECT DISTINCT store_name FROM receipt')).scalars())
+    if conn.engine is db.engine:
+        store_ids = {name: resolve_store(conn, name) for name in names}
+    else:
+        # A shard: the stores are created in the main database
+        with db.engine.begin() as main:
+            store_ids = {name: resolve_store(main, name) for name in names}
+
+    conn.execute(text('CREATE TABLE _store_map (name VARCHAR(200) PRIMARY KEY, store_id INTEGER NOT NULL)'))
+    if store_ids:
+        conn.execute(text('INSERT INTO _store_map (name, store_id) VALUES (:name, :store_id)'),
+                     [{'name': name, 'store_id': store_id} for name, store_id in store_ids.items()])
+    store_sql = '(SELECT store_id FROM _store_map WHERE _store_map.name = "receipt"."store_name")'
+
+    if conn.dialect.name == 'sqlite':
+        rebuild_table(conn, receipts, {'store_id': store_sql})
+    else:
+        conn.execute(text('ALTER TABLE "receipt" ADD COLUMN "store_id" INTEGER'))
+        conn.execute(text(f'UPDATE "receipt" SET "store_id" = {store_sql}'))
+        conn.execute(text('ALTER TABLE "receipt" ALTER COLUMN "store_id" SET NOT NULL'))
+        conn.execute(text('ALTER TABLE "receipt" DROP COLUMN "store_name"'))
+        if conn.engine is db.engine:
+            conn.execute(text(
+                'ALTER TABLE "receipt" ADD CONSTRAINT "receipt_store_id_fkey" '
+                'FOREIGN KEY ("store_id") REFERENCES "store" ("id")'
+            ))
+    conn.execute(text('DROP TABLE _store_map'))
+
+
+# The tables migration 6 rebuilds, as it leaves them
+_SCHEMA_6 = MetaData()
+Table(
+    'receipt', _SCHEMA_6,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id', ondelete='CASCADE'), nullable=False),
+    Column('store_id', Integer, ForeignKey('store.id'), nullable=False),
+    Column('total_amount_cents', Integer, nullable=False),
+    Column('currency', String(3), nullable=False),
+    Column('purchase_date', DateTime, nullable=False),
+    Column('created_at', DateTime),
+    Column('image_path', String(500)),
+    Column('fingerprint', String(32)),
+    Column('idempotency_key', String(200)),
+    Index('ux_receipt_user_fingerprint', 'user_id', 'fingerprint', unique=True),
+    Index('ux_receipt_user_idempotency_key', 'user_id', 'idempotency_key', unique=True),
+    Index('ix_receipt_user_store', 'user_id', 'store_id'),
+)
+Table(
+    'receipt_item', _SCHEMA_6,
+    Column('id', Integer, primary_key=True),
+    Column('receipt_id', Integer, ForeignKey('receipt.id', ondelete='CASCADE'), nullable=False, index=True),
+    Column('product_name', String(200), nullable=False),
+    Column('quantity', Integer),
+    Column('unit_price_cents', Integer, nullable=False),
+    Column('total_price_cents', Integer, nullable=False),
+    Column('category', String(100)),
+)
+Table(
+    'budget', _SCHEMA_6,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id', ondelete='CASCADE'), nullable=False),
+    Column('name', String(200), nullable=False),
+    Column('total_budget_cents', Integer, nullable=False),
+    Column('spent_amount_cents', Integer, nullable=False),
+    Column('currency', String(3), nullable=False),
+    Column('category', String(100)),
+    Column('period', String(50)),
+    Column('start_date', DateTime, nullable=False),
+    Column('end_date', DateTime, nullable=False),
+    Column('is_recurring', Boolean, nullable=False, server_default=false()),
+    Column('recurrence_anchor', DateTime),
+    Column('rolled_over', Boolean, nullable=False, server_default=false()),
+    Column('created_at', DateTime),
+    Index('ix_budget_user_dates', 'user_id', 'start_date', 'end_date'),
+    Index('ix_budget_rollover_due', 'is_recurring', 'rolled_over', 'end_date'),
+)
+Table(
+    'job', _SCHEMA_6,
+    Column('id', Integer, primary_key=True),
+    Column('kind', String(50), nullable=False),
+    Column('payload', Text, nullable=False),
+    Column('status', String(20), nullable=False),
+    Column('user_id', Integer, ForeignKey('user.id', ondelete='CASCADE'), nullable=True, index=True),
+    Column('idempotency_key', String(200), unique=True, nullable=True),
+    Column('attempts', Integer, nullable=False),
+    Column('max_attempts', Integer, nullable=False),
+    Column('run_after', DateTime, nullable=False),
+    Column('locked_by', String(100)),
+    Column('locked_at', DateTime),
+    Column('result', Text),
+    Column('error', Text),
+    Column('created_at', DateTime),
+    Column('finished_at', DateTime),
+    Index('ix_job_claim', 'status', 'run_after'),
+)
+Table(
+    'store_alias', _SCHEMA_6,
+    Column('id', Integer, primary_key=True),
+    Column('store_id', Integer, ForeignKey('store.id', ondelete='CASCADE'), nullable=False, index=True),
+    Column('alias', String(200), unique=True, nullable=False),
+)
+frozen_tables(_SCHEMA_6)
+
+
+@migration(6, 'Cascading deletes for users, receipts and stores')
+def _cascading_deletes(conn):
+    from utils.sharding import created_here
+
+    tables = [_SCHEMA_6.tables[name] for name in ('receipt', 'receipt_item', 'budget', 'job', 'store_alias')]
+    if conn.dialect.name == 'sqlite':
+        # Also drops the user and store foreign keys older shard databases were created with
+        for table in tables:
+            rebuild_table(conn, table)
+        return
+
+    for table in tables:
+        for constraint in table.foreign_key_constraints:
+            column_name = constraint.column_keys[0]
+            conn.execute(text(f'ALTER TABLE "{table.name}" DROP CONSTRAINT IF EXISTS "{table.name}_{column_name}_fkey"'))
+            if created_here(constraint):
+                conn.execute(AddConstraint(constraint))
+
+
+@migration(7, 'Product name keys and price observations')
+def _product_name_keys(conn):
+    from services.catalog_import import backfill_name_keys
+
+    add_column(conn, 'product', Column('name_key', String(200)))
+    add_column(conn, 'product', Column('price_count', Integer, nullable=False, server_default='0'))
+    backfill_name_keys(conn)
+
+
+@migration(8, 'Full-text search over receipt items')
+def _item_search(conn):
+    from models.search import create_search_index
+
+    create_search_index(conn)
+
+
+# The user table as migration 9 leaves it
+_SCHEMA_9 = MetaData()
+Table(
+    'user', _SCHEMA_9,
+    Column('id', Integer, primary_key=True),
+    Column('username', String(80), unique=True, nullable=False),
+    Column('email', String(120), unique=True, nullable=False),
+    Column('password_hash', String(128), nullable=False),
+    Column('created_at', DateTime),
+    Column('shard', Integer, nullable=False, server_default='0'),
+    sqlite_autoincrement=True,
+)
+frozen_tables(_SCHEMA_9)
+
+
+@migration(9, 'Never reuse user ids')
+def _user_autoincrement(conn):
+    # PostgreSQL sequences never hand out an id twice
+    if conn.dialect.name == 'sqlite':
+        rebuild_table(conn, _SCHEMA_9.tables['user'])
+
+
+@migration(10, 'Scope the item search index to each user')
+def _item_search_owner(conn):
+    from models.search import create_search_index
+
+    # Replaces the name-only index of migration 8
+    create_search_index(conn)
+
+
+# The tables migration 11 rebuilds, as it leaves them
+_SCHEMA_11 = MetaData()
+Table(
+    'receipt', _SCHEMA_11,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('user.id', ondelete='CASCADE'), nullable=False),
+    Column('store_id', Integer, ForeignKey('store.id'), nullable=False),
+    Column('total_amount_cents', Integer, nullable=False),
+    Column('currency', String(3), nullable=False),
+    Column('purchase_date', DateTime, nullable=False),
+    Column('created_at', DateTime),
+    Column('image_path', String(500)),
+    Column('fingerprint', String(32)),
+    Column('idempotency_key', String(200)),
+    Index('ux_receipt_user_fingerprint', 'user_id', 'fingerprint', unique=True),
+    Index('ux_receipt_user_idempotency_key', 'user_id', 'idempotency_key', unique=True),
+    Index('ix_receipt_user_store', 'user_id', 'store_id'),
+    sqlite_autoincrement=True,
+)
+Table(
+    'receipt_item', _SCHEMA_11,
+    Column('id', Integer, primary_key=True),
+    Column('receipt_id', Integer, ForeignKey('receipt.id', ondelete='CASCADE'), nullable=False, index=True),
+    Column('product_name', String(200), nullable=False),
+    Column('quantity', Integer),
+    Column('unit_price_cents', Integer, nullable=False),
+    Column('total_price_cents', Integer, nullable=False),
+    Column('category', String(100)),
+    sqlite_autoincrement=True,
+)
+frozen_tables(_SCHEMA_11)
+
+
+@migration(11, 'Never reuse receipt or item ids')
+def _receipt_autoincrement(conn):
+    from models.archive import max_archived_ids
+    from models.search import create_search_index, drop_search_index
+
+    if conn.dialect.name != 'sqlite':
+        return
+    # Its triggers name both tables, which SQLite will not rename under them
+    drop_search_index(conn)
+    rebuild_table(conn, _SCHEMA_11.tables['receipt'])
+    rebuild_table(conn, _SCHEMA_11.tables['receipt_item'])
+    # Archived rows left the tables, but their ids stay taken
+    for name, newest in zip(('receipt', 'receipt_item'), max_archived_ids()):
+        conn.execute(text('DELETE FROM sqlite_sequence WHERE name = :name AND seq < :newest'),
+                     {'name': name, 'newest': newest})
+        conn.execute(text(
+            'INSERT INTO sqlite_sequence (name, seq) SELECT :name, :newest '
+            'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)'
+        ), {'name': name, 'newest': newest})
+    create_search_index(conn)
+
+
+def _baseline_rows():
+    """A few rows in every table of the original schema, for ``check_upgrade``."""
+    created = datetime(2024, 1, 1, 9, 30)
+    users = [{'id': user_id, 'username': f'user{user_id}', 'email': f'user{user_id}@example.com',
+              'password_hash': '-', 'created_at': created} for user_id in (1, 2)]
+    receipts, items = [], []
+    for receipt_id, (user_id, store_name, day) in enumerate([
+        (1, 'Walmart Centro', 3), (1, 'Soriana', 4), (1, 'Walmart Centro', 5), (2, 'Oxxo 123', 3)
+    ], start=1):
+        lines = [('Leche Entera 1L', 2, 23.5, 'Dairy'), ('Pan Integral', 1, 41.9, None)]
+        receipts.append({'id': receipt_id, 'user_id': user_id, 'store_name': store_name,
+                         'total_amount': round(sum(quantity * price for _, quantity, price, _ in lines), 2),
+                         'purchase_date': datetime(2024, 1, day, 18, 0), 'created_at': created})
+        items.extend({'receipt_id': receipt_id, 'product_name': name, 'quantity': quantity, 'unit_price': price,
+                      'total_price': quantity * price, 'category': category}
+                     for name, quantity, price, category in lines)
+    budgets = [{'id': user_id, 'user_id': user_id, 'name': 'Groceries', 'total_budget': 1500.75,
+                'spent_amount': 210.1, 'category': None, 'period': 'monthly', 'start_date': datetime(2024, 1, 1),
+                'end_date': datetime(2024, 1, 31), 'created_at': created} for user_id in (1, 2)]
+    products = [{'id': 1, 'name': 'Leche Entera 1L', 'category': 'Dairy', 'average_price': 23.5,
+                 'price_history': '[{"price": 23.5, "date": "2024-01-03T18:00:00"}]', 'created_at': created}]
+    return {'user': users, 'receipt': receipts, 'receipt_item': items, 'budget': budgets, 'product': products}
+
+
+def check_upgrade(log=print):
+    """Upgrade a throwaway SQLite database in the original schema, with a few
+    rows in every table, to the latest schema and check the rows came through.
+
+    Returns the problems found (none: the migrations work from the start).
+    """
+    from app import create_app
+    from models.search import search_items
+
+    rows = _baseline_rows()
+    with tempfile.TemporaryDirectory() as directory:
+        url = f'sqlite:///{directory}/baseline.db'
+        engine = create_engine(url)
+        _SCHEMA_0.create_all(engine)
+        with engine.begin() as conn:
+            for name, table_rows in rows.items():
+                conn.execute(insert(_SCHEMA_0.tables[name]), table_rows)
+        engine.dispose()
+
+        # A second app, for the throwaway database alone
+        saved = {name: os.environ.get(name) for name in ('DATABASE_URL', 'SHARD_DATABASE_URLS')}
+        os.environ.update(DATABASE_URL=url, SHARD_DATABASE_URLS='')
+        try:
+            app = create_app()
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+        problems = []
+        with app.app_context():
+            try:
+                upgrade_schema(log=log)
+                with db.engine.connect() as conn:
+                    problems.extend(_upgrade_problems(conn, rows))
+                if not search_items(1, 'leche'):
+                    problems.append('item search finds nothing after the upgrade')
+            except Exception as e:
+                problems.append(f'upgrade failed: {e}')
+            finally:
+                db.session.remove()
+                db.engine.dispose()
+        return problems
+
+
+def _upgrade_problems(conn, rows):
+    from models.stores import store_key
+
+    problems = []
+    applied = set(conn.execute(text('SELECT version FROM schema_migration')).scalars())
+    missing = [version for version, _, _ in MIGRATIONS if version not in applied]
+    if missing:
+        problems.append(f'migrations not applied: {missing}')
+    for name, table_rows in rows.items():
+        count = conn.execute(text(f'SELECT count(*) FROM "{name}"')).scalar()
+        if count != len(table_rows):
+            problems.append(f'{name}: {count} rows after the upgrade, {len(table_rows)} before')
+
+    upgraded = {row.id: row for row in conn.execute(text(
+        'SELECT receipt.id, receipt.total_amount_cents, receipt.fingerprint, store.key AS store_key '
+        'FROM receipt JOIN store ON store.id = receipt.store_id'
+    ))}
+    for receipt in rows['receipt']:
+        row = upgraded.get(receipt['id'])
+        if row is None:
+            problems.append(f"receipt {receipt['id']} lost its store")
+        elif row.total_amount_cents != round(receipt['total_amount'] * 100) or row.fingerprint is None \
+                or row.store_key != store_key(receipt['store_name']):
+            problems.append(f"receipt {receipt['id']} was not carried over: {tuple(row)}")
+    item_cents = sorted(conn.execute(text('SELECT total_price_cents FROM receipt_item')).scalars())
+    if item_cents != sorted(round(item['total_price'] * 100) for item in rows['receipt_item']):
+        problems.append(f'item amounts changed: {item_cents}')
+    budget_cents = conn.execute(text('SELECT total_budget_cents, spent_amount_cents FROM budget')).all()
+    if sorted(map(tuple, budget_cents)) != sorted((round(budget['total_budget'] * 100), round(budget['spent_amount'] * 100))
+                                                  for budget in rows['budget']):
+        problems.append(f'budget amounts changed: {budget_cents}')
+    if conn.dialect.name == 'sqlite':
+        broken = conn.exec_driver_sql('PRAGMA foreign_key_check').all()
+        if broken:
+            problems.append(f'rows with broken foreign keys: {broken}')
+    return problems
@@ -1,17 +1,44 @@
+import json
 from app import db
 from datetime import datetime
+from sqlalchemy.ext.hybrid import hybrid_property
 from werkzeug.security import generate_password_hash, check_password_hash
+from utils.money import DEFAULT_CURRENCY, to_cents, from_cents
+from utils.sharding import scope_bind, declare_shard_foreign_keys
+
+def money_property(cents_attr):
+    """Expose an integer-cents column as a decimal amount.
+    
+    Reads return floats, writes accept numbers or numeric strings, and in
+    SQL expressions the property evaluates to ``cents / 100.0``.
+    """
+    def fget(self):
+        return from_cents(getattr(self, cents_attr))
+    
+    def fset(self, value):
+        setattr(self, cents_attr, to_cents(value))
+    
+    def expr(cls):
+        return getattr(cls, cents_attr) / 100.0
+    
+    return hybrid_property(fget, fset, expr=expr)
 
 class User(db.Model):
+    # Never reuse the id of a deleted account on SQLite, whose tokens may still be around
+    __table_args__ = {'sqlite_autoincrement': True}
+    
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(128), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Shard holding the user's receipts and budgets (utils.sharding)
+    shard = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
-    # Relationships
-    receipts = db.relationship('Receipt', backref='user', lazy=True)
-    budgets = db.relationship('Budget', backref='user', lazy=True)
+    # Relationships; rows are removed by the database's ON DELETE CASCADE
+    # (see services.purge for deleting an account across shards)
+    receipts = db.relationship('Receipt', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    budgets = db.relationship('Budget', backref='user', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
     
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -27,37 +54,87 @@ class User(db.Model):
             'created_at': self.created_at.isoformat()
         }
 
+class Store(db.Model):
+    """A store receipts are grouped by.
+    
+    Store names on incoming receipts are resolved to a store through its
+    ``key`` and its aliases (see ``models.stores``); ``tracker_id`` links
+    it to the price tracker's store of the same chain.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    key = db.Column(db.String(200), unique=True, nullable=False)  # normalized name without branch number
+    tracker_id = db.Column(db.String(50), unique=True)  # PRICE_TRACKING_STORES id
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    aliases = db.relationship('StoreAlias', backref='store', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'tracker_id': self.tracker_id,
+            'aliases': [alias.alias for alias in self.aliases]
+        }
+
+class StoreAlias(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    store_id = db.Column(db.Integer, db.ForeignKey('store.id', ondelete='CASCADE'), nullable=False, index=True)
+    alias = db.Column(db.String(200), unique=True, nullable=False)  # normalized spelling
+
 class Receipt(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    store_name = db.Column(db.String(200), nullable=False)
-    total_amount = db.Column(db.Float, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    store_id = db.Column(db.Integer, db.ForeignKey('store.id'), nullable=False)
+    total_amount_cents = db.Column(db.Integer, nullable=False)
+    currency = db.Column(db.String(3), nullable=False, default=DEFAULT_CURRENCY)
     purchase_date = db.Column(db.DateTime, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     image_path = db.Column(db.String(500))
+    # Duplicate detection (models.fingerprints): content hash and client Idempotency-Key
+    fingerprint = db.Column(db.String(32))
+    idempotency_key = db.Column(db.String(200))
+    
+    # Archived receipts (models.archive) keep their ids, so SQLite must never hand them out again
+    __table_args__ = (
+        db.Index('ux_receipt_user_fingerprint', 'user_id', 'fingerprint', unique=True),
+        db.Index('ux_receipt_user_idempotency_key', 'user_id', 'idempotency_key', unique=True),
+        db.Index('ix_receipt_user_store', 'user_id', 'store_id'),
+        {'sqlite_autoincrement': True},
+    )
     
     # Relationships
-    items = db.relationship('ReceiptItem', backref='receipt', lazy=True, cascade='all, delete-orphan')
+    items = db.relationship('ReceiptItem', backref='receipt', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+    
+    total_amount = money_property('total_amount_cents')
     
     def to_dict(self):
+        from models.stores import store_name
         return {
             'id': self.id,
-            'store_name': self.store_name,
+            'store_name': store_name(self.store_id),
             'total_amount': self.total_amount,
+            'currency': self.currency,
             'purchase_date': self.purchase_date.isoformat(),
             'created_at': self.created_at.isoformat(),
             'items': [item.to_dict() for item in self.items]
         }
 
 class ReceiptItem(db.Model):
+    # Archived items keep their ids too
+    __table_args__ = {'sqlite_autoincrement': True}
+    
     id = db.Column(db.Integer, primary_key=True)
-    receipt_id = db.Column(db.Integer, db.ForeignKey('receipt.id'), nullable=False)
+    receipt_id = db.Column(db.Integer, db.ForeignKey('receipt.id', ondelete='CASCADE'), nullable=False, index=True)
     product_name = db.Column(db.String(200), nullable=False)
     quantity = db.Column(db.Integer, default=1)
-    unit_price = db.Column(db.Float, nullable=False)
-    total_price = db.Column(db.Float, nullable=False)
+    unit_price_cents = db.Column(db.Integer, nullable=False)
+    total_price_cents = db.Column(db.Integer, nullable=False)
     category = db.Column(db.String(100))
     
+    unit_price = money_property('unit_price_cents')
+    total_price = money_property('total_price_cents')
+    
     def to_dict(self):
         return {
             'id': self.id,
@@ -69,37 +146,58 @@ class ReceiptItem(db.Model):
         }
 
 class Budget(db.Model):
+    __table_args__ = (
+        db.Index('ix_budget_user_dates', 'user_id', 'start_date', 'end_date'),
+        db.Index('ix_budget_rollover_due', 'is_recurring', 'rolled_over', 'end_date'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     name = db.Column(db.String(200), nullable=False)
-    total_budget = db.Column(db.Float, nullable=False)
-    spent_amount = db.Column(db.Float, default=0.0)
+    total_budget_cents = db.Column(db.Integer, nullable=False)
+    spent_amount_cents = db.Column(db.Integer, nullable=False, default=0)
+    currency = db.Column(db.String(3), nullable=False, default=DEFAULT_CURRENCY)
     category = db.Column(db.String(100))
     period = db.Column(db.String(50), default='monthly')  # weekly, monthly, yearly
     start_date = db.Column(db.DateTime, nullable=False)
     end_date = db.Column(db.DateTime, nullable=False)
+    is_recurring = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    recurrence_anchor = db.Column(db.DateTime)  # start of the first period of a recurring series
+    rolled_over = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    total_budget = money_property('total_budget_cents')
+    spent_amount = money_property('spent_amount_cents')
+    
     def to_dict(self):
         return {
             'id': self.id,
             'name': self.name,
             'total_budget': self.total_budget,
-            'spent_amount': self.spent_amount,
-            'remaining_budget': self.total_budget - self.spent_amount,
+            'spent_amount': from_cents(self.spent_amount_cents or 0),
+            'remaining_budget': from_cents(self.total_budget_cents - (self.spent_amount_cents or 0)),
+            'currency': self.currency,
             'category': self.category,
             'period': self.period,
+            'is_recurring': self.is_recurring,
             'start_date': self.start_date.isoformat(),
             'end_date': self.end_date.isoformat(),
             'created_at': self.created_at.isoformat()
         }
 
 class Product(db.Model):
+    __table_args__ = (
+        # Catalog imports upsert on it (services.catalog_import)
+        db.Index('ux_product_name_key_category', 'name_key', 'category', unique=True),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
-    category = db.Column(db.String(100))
+    name_key = db.Column(db.String(200))  # normalized name; NULL on pre-import duplicates
+    category = db.Column(db.String(100), index=True)
     average_price = db.Column(db.Float)
-    price_history = db.Column(db.Text)  # JSON string of price history
+    price_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # prices behind average_price
+    price_history = db.Column(db.Text)  # legacy JSON history, superseded by ProductPriceObservation
     sustainability_score = db.Column(db.Integer, default=0)  # 0-100
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
@@ -112,3 +210,139 @@ class Product(db.Model):
             'sustainability_score': self.sustainability_score,
             'created_at': self.created_at.isoformat()
         }
+
+class ProductPriceObservation(db.Model):
+    """One catalog price of a product, appended by every catalog import."""
+    __table_args__ = (
+        db.Index('ix_product_price_observation_product_time', 'product_id', 'observed_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), nullable=False)
+    store_id = db.Column(db.Integer, db.ForeignKey('store.id'))
+    price_cents = db.Column(db.Integer, nullable=False)
+    currency = db.Column(db.String(3), nullable=False, default=DEFAULT_CURRENCY)
+    observed_at = db.Column(db.DateTime, nullable=False)
+    
+    price = money_property('price_cents')
+    
+    def to_dict(self):
+        return {
+            'product_id': self.product_id,
+            'store_id': self.store_id,
+            'price': self.price,
+            'currency': self.currency,
+            'observed_at': self.observed_at.isoformat()
+        }
+
+class PriceIndex(db.Model):
+    """Anonymized weekly price statistics per (product, store).
+    
+    Rebuilt by the price index job from all users' receipt items; only
+    groups observed by enough distinct users are kept, and no user ids
+    are stored.
+    """
+    __table_args__ = (
+        db.UniqueConstraint('product_key', 'store_key', 'week_start', name='uq_price_index_product_store_week'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    product_key = db.Column(db.String(200), nullable=False)  # normalized product name
+    store_key = db.Column(db.String(200), nullable=False)  # normalized store name
+    product_name = db.Column(db.String(200), nullable=False)
+    store_name = db.Column(db.String(200), nullable=False)
+    week_start = db.Column(db.Date, nullable=False, index=True)  # Monday
+    median_cents = db.Column(db.Integer, nullable=False)
+    p25_cents = db.Column(db.Integer, nullable=False)
+    p75_cents = db.Column(db.Integer, nullable=False)
+    sample_count = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'product_name': self.product_name,
+            'store_name': self.store_name,
+            'week_start': self.week_start.isoformat(),
+            'median_price': from_cents(self.median_cents),
+            'p25_price': from_cents(self.p25_cents),
+            'p75_price': from_cents(self.p75_cents),
+            'sample_count': self.sample_count
+        }
+
+class Job(db.Model):
+    """A unit of background work, claimed and run by ``run_worker.py``.
+    
+    ``idempotency_key`` is namespaced by user and kind (see
+    services.jobs.enqueue), so resubmitting the same request returns the
+    existing job instead of queuing a duplicate.
+    """
+    __table_args__ = (
+        db.Index('ix_job_claim', 'status', 'run_after'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed, cancelled
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=True, index=True)
+    idempotency_key = db.Column(db.String(200), unique=True, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    result = db.Column(db.Text)  # JSON
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_after': self.run_after.isoformat(),
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class DataVersion(db.Model):
+    """Change counter per cache scope, e.g. ``user:42`` or ``catalog``.
+
+    Bumped in the same transaction as every write to the scope, so a
+    single primary-key lookup tells whether cached responses are stale.
+    With sharding on, ``user:`` rows live on the user's shard next to the
+    data they version.
+    """
+    scope = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+declare_shard_foreign_keys(db.Model.metadata)
+
+CATALOG_SCOPE = 'catalog'
+STORES_SCOPE = 'stores'
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+def get_data_version(scope):
+    version = db.session.execute(
+        db.select(DataVersion.version).where(DataVersion.scope == scope),
+        bind_arguments={'bind': scope_bind(scope)}
+    ).scalar()
+    return version or 0
+
+def bump_data_version(scope):
+    bind_arguments = {'bind': scope_bind(scope)}
+    result = db.session.execute(
+        db.update(DataVersion)
+        .where(DataVersion.scope == scope)
+        .values(version=DataVersion.version + 1),
+        bind_arguments=bind_arguments
+    )
+    if result.rowcount == 0:
+        db.session.execute(db.insert(DataVersion).values(scope=scope, version=1), bind_arguments=bind_arguments)
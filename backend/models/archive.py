@@ -0,0 +1,435 @@
+"""Cold storage for old receipts in per-user Parquet files.
+
+``archive_receipts`` (the ``archive_receipts`` job) moves receipts
+purchased more than ``ARCHIVE_AFTER_DAYS`` ago, with their items, out of
+the hot tables into ``<ARCHIVE_DIR>/user-<id>/``. Every batch becomes one
+zstd-compressed part in ``receipts/`` and one in ``items/`` (items carry
+their receipt's purchase date and store), sorted newest first like the
+receipt listing. Part names start with the batch's first and last
+purchase day, so readers skip parts outside a date range without opening
+them; the parts they do read are memory-mapped and scanned batch by
+batch.
+
+The readers below return the same tuples as the hot-table queries, and
+``models.rows``, ``models.serializers``, the analytics endpoints, the
+forecast and the price index merge them in. A user without an archive
+costs one ``os.path.isdir`` per read.
+
+Receipts already in the archive are skipped when archiving, so a run
+that stopped between writing a part and deleting its rows can simply be
+repeated. Archived rows keep their ids, which is why ``receipt`` and
+``receipt_item`` are AUTOINCREMENT on SQLite: otherwise SQLite hands the
+highest id out again once its row has moved here.
+"""
+import heapq
+import os
+import shutil
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, delete, or_, and_
+
+from models import Receipt, ReceiptItem, db
+from utils.money import from_cents
+
+RECEIPT_FIELDS = ('id', 'store_id', 'total_amount_cents', 'currency', 'purchase_date', 'created_at', 'image_path',
+                  'fingerprint')
+# The first seven match models.serializers.ITEM_COLUMNS
+ITEM_FIELDS = ('receipt_id', 'id', 'product_name', 'quantity', 'unit_price_cents', 'total_price_cents',
+               'category', 'purchase_date', 'store_id')
+
+READ_BATCH_SIZE = 10000
+
+
+def _schemas():
+    import pyarrow as pa
+    timestamp = pa.timestamp('us')
+    receipts = pa.schema([
+        ('id', pa.int64()), ('store_id', pa.int64()), ('total_amount_cents', pa.int64()),
+        ('currency', pa.string()), ('purchase_date', timestamp), ('created_at', timestamp),
+        ('image_path', pa.string()), ('fingerprint', pa.string())
+    ])
+    items = pa.schema([
+        ('receipt_id', pa.int64()), ('id', pa.int64()), ('product_name', pa.string()),
+        ('quantity', pa.int64()), ('unit_price_cents', pa.int64()), ('total_price_cents', pa.int64()),
+        ('category', pa.string()), ('purchase_date', timestamp), ('store_id', pa.int64())
+    ])
+    return receipts, items
+
+
+def user_archive_dir(user_id):
+    return os.path.join(current_app.config['ARCHIVE_DIR'], f'user-{int(user_id)}')
+
+
+def has_archive(user_id):
+    return os.path.isdir(user_archive_dir(user_id))
+
+
+def archived_user_ids():
+    root = current_app.config['ARCHIVE_DIR']
+    if not os.path.isdir(root):
+        return []
+    return sorted(int(name[5:]) for name in os.listdir(root) if name.startswith('user-'))
+
+
+def _parts(user_id, since=None, until=None):
+    """Part names whose purchase-day range overlaps ``[since, until]``."""
+    directory = os.path.join(user_archive_dir(user_id), 'receipts')
+    if not os.path.isdir(directory):
+        return []
+    parts = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.parquet'):
+            continue
+        first_day, last_day = name.split('-')[:2]
+        if since is not None and last_day < since.strftime('%Y%m%d'):
+            continue
+        if until is not None and first_day > until.strftime('%Y%m%d'):
+            continue
+        parts.append(name)
+    return parts
+
+
+def _part_path(user_id, kind, part):
+    return os.path.join(user_archive_dir(user_id), kind, part)
+
+
+def _batches(path, columns):
+    import pyarrow.parquet as pq
+    return pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=READ_BATCH_SIZE, columns=list(columns))
+
+
+def _rows(path, columns, since=None, until=None):
+    """Yield tuples of ``columns`` from one part, optionally filtered on purchase date."""
+    import pyarrow.compute as pc
+    read = list(columns) if 'purchase_date' in columns or (since is None and until is None) \
+        else list(columns) + ['purchase_date']
+    for batch in _batches(path, read):
+        if since is not None:
+            batch = batch.filter(pc.greater_equal(batch.column('purchase_date'), since))
+        if until is not None:
+            batch = batch.filter(pc.less_equal(batch.column('purchase_date'), until))
+        yield from zip(*(batch.column(name).to_pylist() for name in columns))
+
+
+def _table(user_id, kind, part, columns, since=None, until=None):
+    import pyarrow.parquet as pq
+    filters = []
+    if since is not None:
+        filters.append(('purchase_date', '>=', since))
+    if until is not None:
+        filters.append(('purchase_date', '<=', until))
+    return pq.read_table(_part_path(user_id, kind, part), columns=list(columns),
+                         filters=filters or None, memory_map=True)
+
+
+# -- Readers ---------------------------------------------------------------
+
+def archived_receipts(user_id, receipt_id=None):
+    """Yield archived receipts newest first, shaped like ``iter_receipts`` rows."""
+    from models.serializers import item_row
+    from models.stores import store_name
+    if not has_archive(user_id):
+        return
+
+    def part_receipts(part):
+        receipts = _rows(_part_path(user_id, 'receipts', part), RECEIPT_FIELDS[:6])
+        items = _rows(_part_path(user_id, 'items', part), ITEM_FIELDS[:8])
+        item = next(items, None)
+        for id, store_id, total_amount_cents, currency, purchase_date, created_at in receipts:
+            # Skip items whose receipt was deleted while this part was being rewritten
+            while item is not None and (item[7], item[0]) > (purchase_date, id):
+                item = next(items, None)
+            receipt_items = []
+            while item is not None and item[0] == id:
+                receipt_items.append(item_row(item[:7]))
+                item = next(items, None)
+            if receipt_id is not None and id != receipt_id:
+                continue
+            yield {
+                'id': id,
+                'store_name': store_name(store_id),
+                'total_amount': from_cents(total_amount_cents),
+                'currency': currency,
+                'purchase_date': purchase_date,
+                'created_at': created_at,
+                'items': receipt_items
+            }
+
+    yield from heapq.merge(
+        *(part_receipts(part) for part in _parts(user_id)),
+        key=lambda receipt: (receipt['purchase_date'], receipt['id']), reverse=True
+    )
+
+
+def archived_receipt_summaries(user_id, since=None, until=None):
+    """(id, store_id, total_amount_cents, purchase_date) rows in the date range."""
+    if not has_archive(user_id):
+        return
+    for part in _parts(user_id, since, until):
+        yield from _rows(_part_path(user_id, 'receipts', part),
+                         ('id', 'store_id', 'total_amount_cents', 'purchase_date'), since, until)
+
+
+def archived_fingerprints(user_id, since, until):
+    """``{fingerprint: receipt id}`` of archived receipts purchased in the range."""
+    if not has_archive(user_id):
+        return {}
+    return {
+        fingerprint: id
+        for part in _parts(user_id, since, until)
+        for fingerprint, id in _rows(_part_path(user_id, 'receipts', part), ('fingerprint', 'id'), since, until)
+        if fingerprint is not None
+    }
+
+
+def _item_groups(user_id, keys, aggregates):
+    if not has_archive(user_id):
+        return
+    columns = sorted(set(keys) | {column for column, _ in aggregates})
+    for part in _parts(user_id):
+        table = _table(user_id, 'items', part, columns)
+        grouped = table.group_by(list(keys), use_threads=False).aggregate(list(aggregates))
+        names = list(keys) + [f'{column}_{function}' for column, function in aggregates]
+        yield from zip(*(grouped.column(name).to_pylist() for name in names))
+
+
+def archived_product_rollups(user_id):
+    """(product_name, category, spent cents, quantity, item count) per part and group."""
+    yield from _item_groups(user_id, ('product_name', 'category'), (
+        ('total_price_cents', 'sum'), ('quantity', 'sum'), ('id', 'count')
+    ))
+
+
+def archived_category_totals(user_id):
+    """(category, spent cents, item count) per part and category."""
+    yield from _item_groups(user_id, ('category',), (('total_price_cents', 'sum'), ('id', 'count')))
+
+
+def archived_product_totals(user_id):
+    """(product_name, spent cents, quantity, item count) per part and product."""
+    yield from _item_groups(user_id, ('product_name',), (
+        ('total_price_cents', 'sum'), ('quantity', 'sum'), ('id', 'count')
+    ))
+
+
+def archived_daily_category_spend(user_id, since, until):
+    """(date, lowercased category, spent cents) for items purchased in the range."""
+    if not has_archive(user_id):
+        return
+    for part in _parts(user_id, since, until):
+        for category, purchase_date, cents in _rows(
+            _part_path(user_id, 'items', part), ('category', 'purchase_date', 'total_price_cents'), since, until
+        ):
+            yield purchase_date.date(), category.lower() if category else category, cents
+
+
+def archived_observations(since=None):
+    """Yield ``(user_id, batch)`` record batches of every user's archived items
+    with ``product_name``, ``store_id``, ``purchase_date`` and
+    ``unit_price_cents`` (positive prices only), for the price index."""
+    import pyarrow.compute as pc
+    columns = ('product_name', 'store_id', 'purchase_date', 'unit_price_cents')
+    for user_id in archived_user_ids():
+        for part in _parts(user_id, since):
+            for batch in _batches(_part_path(user_id, 'items', part), columns):
+                mask = pc.greater(batch.column('unit_price_cents'), 0)
+                if since is not None:
+                    mask = pc.and_(mask, pc.greater_equal(batch.column('purchase_date'), since))
+                batch = batch.filter(mask)
+                if batch.num_rows:
+                    yield user_id, batch
+
+
+# -- Writing ---------------------------------------------------------------
+
+def _write_part(user_id, receipt_rows, item_rows):
+    """Write one receipts part and its items part; returns the part name."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    receipt_schema, item_schema = _schemas()
+    dates = [row[4] for row in receipt_rows]
+    part = f'{min(dates):%Y%m%d}-{max(dates):%Y%m%d}-{uuid.uuid4().hex[:12]}.parquet'
+    compression = current_app.config['ARCHIVE_COMPRESSION']
+
+    written = []
+    for kind, schema, rows in (('items', item_schema, item_rows), ('receipts', receipt_schema, receipt_rows)):
+        directory = os.path.join(user_archive_dir(user_id), kind)
+        os.makedirs(directory, exist_ok=True)
+        table = pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(
+            zip(*rows) if rows else [[] for _ in schema], schema
+        )], schema=schema)
+        temporary = os.path.join(directory, f'.{part}.tmp')
+        pq.write_table(table, temporary, compression=compression)
+        written.append((temporary, os.path.join(directory, part)))
+    # Items first: a receipts part is only ever visible with its items
+    for temporary, final in written:
+        os.replace(temporary, final)
+    return part
+
+
+def _archived_ids(user_id):
+    ids = set()
+    for part in _parts(user_id):
+        for batch in _batches(_part_path(user_id, 'receipts', part), ('id',)):
+            ids.update(batch.column('id').to_pylist())
+    return ids
+
+
+def max_archived_ids():
+    """The highest receipt id and item id in any archive (0 if none)."""
+    import pyarrow.compute as pc
+
+    newest = {'receipts': 0, 'items': 0}
+    for user_id in archived_user_ids():
+        for part in _parts(user_id):
+            for kind in newest:
+                for batch in _batches(_part_path(user_id, kind, part), ('id',)):
+                    newest[kind] = max(newest[kind], pc.max(batch.column('id')).as_py() or 0)
+    return newest['receipts'], newest['items']
+
+
+def archive_user(user_id, cutoff, batch_size=20000):
+    """Move a user's receipts purchased before ``cutoff`` into the archive.
+
+    Receipts are read newest first in keyset-paginated batches; each batch
+    is written as one part and then deleted from the hot tables. Returns
+    the number of receipts archived.
+    """
+    from models import bump_data_version, user_scope
+
+    already = _archived_ids(user_id)
+    receipt_columns = [getattr(Receipt, name) for name in RECEIPT_FIELDS]
+    item_columns = [getattr(ReceiptItem, name) for name in ITEM_FIELDS[:7]] + [Receipt.purchase_date, Receipt.store_id]
+    order = (Receipt.purchase_date.desc(), Receipt.id.desc())
+
+    archived = 0
+    after = None
+    while True:
+        query = select(*receipt_columns).where(Receipt.user_id == user_id, Receipt.purchase_date < cutoff)
+        if after is not None:
+            query = query.where(or_(
+                Receipt.purchase_date < after[0],
+                and_(Receipt.purchase_date == after[0], Receipt.id < after[1])
+            ))
+        batch = db.session.execute(query.order_by(*order).limit(batch_size)).all()
+        if not batch:
+            break
+        after = (batch[-1].purchase_date, batch[-1].id)
+
+        ids = {row.id for row in batch}
+        fresh = [tuple(row) for row in batch if row.id not in already]
+        if fresh:
+            fresh_ids = {row[0] for row in fresh}
+            item_rows = [
+                tuple(row) for row in db.session.execute(
+                    select(*item_columns).join(Receipt).where(
+                        Receipt.user_id == user_id,
+                        Receipt.purchase_date >= batch[-1].purchase_date,
+                        Receipt.purchase_date <= batch[0].purchase_date
+                    ).order_by(*order, ReceiptItem.id)
+                )
+                if row.receipt_id in fresh_ids
+            ]
+            _write_part(user_id, fresh, item_rows)
+        if ids:
+            for start in range(0, len(ids), 500):
+                chunk = list(ids)[start:start + 500]
+                db.session.execute(delete(ReceiptItem).where(ReceiptItem.receipt_id.in_(chunk)))
+                db.session.execute(delete(Receipt).where(Receipt.id.in_(chunk)))
+            # Cached payloads were built from the hot rows; make clients revalidate
+            bump_data_version(user_scope(user_id))
+            db.session.commit()
+            archived += len(ids)
+    return archived
+
+
+def archive_receipts(now=None, after_days=None, log=None):
+    """Archive every user's receipts older than ``after_days`` (default
+    ``ARCHIVE_AFTER_DAYS``), shard by shard. Returns the counts."""
+    from utils.sharding import shard_ids, using_shard
+
+    after_days = after_days if after_days is not None else current_app.config['ARCHIVE_AFTER_DAYS']
+    cutoff = (now or datetime.now()) - timedelta(days=after_days)
+    users = receipts = 0
+    for shard in shard_ids():
+        with using_shard(shard):
+            user_ids = db.session.execute(
+                select(Receipt.user_id).where(Receipt.purchase_date < cutoff).distinct()
+            ).scalars().all()
+            for user_id in user_ids:
+                count = archive_user(user_id, cutoff)
+                if count:
+                    users += 1
+                    receipts += count
+                    if log:
+                        log(f"Archived {count} receipt(s) of user {user_id}")
+    return {'users': users, 'receipts': receipts, 'cutoff': cutoff}
+
+
+def _rewrite_part(user_id, part, receipts, items):
+    """Replace a part with the given remaining rows, removing it when none are left."""
+    import pyarrow.parquet as pq
+
+    if receipts.num_rows == 0:
+        os.remove(_part_path(user_id, 'receipts', part))
+        os.remove(_part_path(user_id, 'items', part))
+    else:
+        compression = current_app.config['ARCHIVE_COMPRESSION']
+        for kind, table in (('items', items), ('receipts', receipts)):
+            temporary = _part_path(user_id, kind, f'.{part}.tmp')
+            pq.write_table(table, temporary, compression=compression)
+            os.replace(temporary, _part_path(user_id, kind, part))
+    if not _parts(user_id):
+        delete_archive(user_id)
+
+
+def delete_archived_receipt(user_id, receipt_id):
+    """Rewrite the part holding an archived receipt without it; True if found."""
+    import pyarrow.compute as pc
+
+    for part in _parts(user_id):
+        receipts = _table(user_id, 'receipts', part, RECEIPT_FIELDS)
+        if not pc.any(pc.equal(receipts.column('id'), receipt_id)).as_py():
+            continue
+        items = _table(user_id, 'items', part, ITEM_FIELDS)
+        receipts = receipts.filter(pc.not_equal(receipts.column('id'), receipt_id))
+        items = items.filter(pc.not_equal(items.column('receipt_id'), receipt_id))
+        _rewrite_part(user_id, part, receipts, items)
+        return True
+    return False
+
+
+def delete_archived_range(user_id, since=None, until=None):
+    """Remove archived receipts purchased from ``since`` up to, not
+    including, ``until`` (None: unbounded); returns how many were removed."""
+    import pyarrow.compute as pc
+
+    def outside(table):
+        keep = None
+        if since is not None:
+            keep = pc.less(table.column('purchase_date'), since)
+        if until is not None:
+            after = pc.greater_equal(table.column('purchase_date'), until)
+            keep = after if keep is None else pc.or_(keep, after)
+        return keep
+
+    removed = 0
+    for part in _parts(user_id, since, until):
+        receipts = _table(user_id, 'receipts', part, RECEIPT_FIELDS)
+        keep = outside(receipts)
+        remaining = receipts.filter(keep) if keep is not None else receipts.slice(0, 0)
+        if remaining.num_rows == receipts.num_rows:
+            continue
+        items = _table(user_id, 'items', part, ITEM_FIELDS)
+        keep = outside(items)
+        items = items.filter(keep) if keep is not None else items.slice(0, 0)
+        _rewrite_part(user_id, part, remaining, items)
+        removed += receipts.num_rows - remaining.num_rows
+    return removed
+
+
+def delete_archive(user_id):
+    shutil.rmtree(user_archive_dir(user_id), ignore_errors=True)
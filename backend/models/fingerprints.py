@@ -0,0 +1,78 @@
+"""Content fingerprints for duplicate receipt detection.
+
+A receipt's fingerprint hashes its store, purchase time, total, currency
+and items (in any order), with names normalized the way product matching
+does. ``receipt(user_id, fingerprint)`` is unique, so resubmitting the
+same receipt finds the original in one indexed lookup; receipts that
+were already duplicated before fingerprints existed keep a NULL one.
+"""
+import hashlib
+
+from sqlalchemy import select, update, bindparam, text, table, column, DateTime
+
+from utils.text import normalize_name
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+def receipt_fingerprint(store_name, purchase_date, total_amount_cents, currency, items):
+    """Hex digest of a receipt; ``items`` are (product_name, quantity, total cents)."""
+    lines = sorted(
+        f'{normalize_name(product_name)}|{quantity or 1}|{total_price_cents}'
+        for product_name, quantity, total_price_cents in items
+    )
+    # Stored timestamps are naive, so an offset in the payload must not change the hash
+    parts = [
+        normalize_name(store_name),
+        purchase_date.replace(tzinfo=None).isoformat(timespec='microseconds'),
+        str(total_amount_cents),
+        currency or '',
+        *lines
+    ]
+    return hashlib.blake2b('\n'.join(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def backfill_fingerprints(conn, batch_size=BACKFILL_BATCH_SIZE):
+    """Fingerprint existing receipts; all but the oldest of each set of
+    duplicates are left without one so the unique index can be built.
+
+    Runs as a migration before stores were split out, so it reads the
+    receipt table's ``store_name`` column rather than the model.
+    """
+    receipts = table('receipt', column('purchase_date', DateTime), *(column(name) for name in (
+        'id', 'user_id', 'store_name', 'total_amount_cents', 'currency', 'fingerprint'
+    )))
+    items = table('receipt_item', *(column(name) for name in (
+        'receipt_id', 'product_name', 'quantity', 'total_price_cents'
+    )))
+
+    after = 0
+    while True:
+        batch = conn.execute(
+            select(receipts.c.id, receipts.c.store_name, receipts.c.purchase_date,
+                   receipts.c.total_amount_cents, receipts.c.currency)
+            .where(receipts.c.id > after).order_by(receipts.c.id).limit(batch_size)
+        ).all()
+        if not batch:
+            break
+        after = batch[-1].id
+        lines = {}
+        for receipt_id, product_name, quantity, total_price_cents in conn.execute(
+            select(items.c.receipt_id, items.c.product_name, items.c.quantity, items.c.total_price_cents)
+            .where(items.c.receipt_id.between(batch[0].id, batch[-1].id))
+        ):
+            lines.setdefault(receipt_id, []).append((product_name, quantity, total_price_cents))
+        conn.execute(
+            update(receipts).where(receipts.c.id == bindparam('receipt_id')).values(fingerprint=bindparam('value')),
+            [
+                {'receipt_id': row.id, 'value': receipt_fingerprint(
+                    row.store_name, row.purchase_date, row.total_amount_cents, row.currency, lines.get(row.id, ())
+                )}
+                for row in batch
+            ]
+        )
+
+    conn.execute(text(
+        'UPDATE receipt SET fingerprint = NULL WHERE fingerprint IS NOT NULL AND id NOT IN '
+        '(SELECT MIN(id) FROM receipt WHERE fingerprint IS NOT NULL GROUP BY user_id, fingerprint)'
+    ))
@@ -0,0 +1,147 @@
+"""Read-only row types and streaming query helpers.
+
+Analytics and listing code that only reads a few columns uses these
+instead of ORM entities: the selects are Core column projections (no
+identity map, no per-object instance state), results are streamed with
+``yield_per`` instead of fetched all at once, and each row is a plain
+named tuple that is garbage as soon as the loop moves on. Receipt and
+item readers append the user's archived rows (``models.archive``).
+"""
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select, func, text
+
+from models import Receipt, ReceiptItem, Budget, db, archive
+
+ROW_BATCH_SIZE = 2000
+
+
+class ReceiptSummary(NamedTuple):
+    id: int
+    store_id: int
+    total_amount_cents: int
+    purchase_date: datetime
+
+
+class ProductRollup(NamedTuple):
+    product_name: str
+    category: Optional[str]
+    total_spent_cents: int
+    total_quantity: int
+    item_count: int
+
+
+class BudgetSnapshot(NamedTuple):
+    id: int
+    name: str
+    total_budget_cents: int
+    spent_amount_cents: int
+    currency: str
+    category: Optional[str]
+    period: str
+    is_recurring: bool
+    start_date: datetime
+    end_date: datetime
+    created_at: datetime
+
+
+class BudgetTotals(NamedTuple):
+    total_budgets: int
+    active_budgets: int
+    allocated_cents: int
+    spent_cents: int
+
+
+RECEIPT_SUMMARY_COLUMNS = tuple(getattr(Receipt, name) for name in ReceiptSummary._fields)
+BUDGET_SNAPSHOT_COLUMNS = tuple(getattr(Budget, name) for name in BudgetSnapshot._fields)
+
+
+def stream(statement, row_type=None, batch_size=ROW_BATCH_SIZE):
+    """Execute ``statement`` and yield its rows ``batch_size`` at a time.
+
+    With ``row_type`` each row is converted to that named tuple.
+    """
+    result = db.session.execute(statement.execution_options(yield_per=batch_size))
+    if row_type is None:
+        yield from result.tuples()
+        return
+    make = row_type._make
+    for row in result.tuples():
+        yield make(row)
+
+
+def receipt_summaries(user_id, since=None, until=None):
+    """A user's receipts in the date range, hot rows first, then archived ones."""
+    query = select(*RECEIPT_SUMMARY_COLUMNS).where(Receipt.user_id == user_id)
+    if since is not None:
+        query = query.where(Receipt.purchase_date >= since)
+    if until is not None:
+        query = query.where(Receipt.purchase_date <= until)
+    yield from stream(query, ReceiptSummary)
+    yield from map(ReceiptSummary._make, archive.archived_receipt_summaries(user_id, since, until))
+
+
+def product_rollups(user_id):
+    """A user's items grouped by (product name, category) in one query.
+
+    Archived items follow as per-part groups, so a key can repeat.
+    """
+    query = select(
+        ReceiptItem.product_name,
+        ReceiptItem.category,
+        func.sum(ReceiptItem.total_price_cents),
+        func.sum(ReceiptItem.quantity),
+        func.count(ReceiptItem.id)
+    ).join(Receipt).where(Receipt.user_id == user_id).group_by(ReceiptItem.product_name, ReceiptItem.category)
+    yield from stream(query, ProductRollup)
+    yield from map(ProductRollup._make, archive.archived_product_rollups(user_id))
+
+
+def begin_read_snapshot():
+    """Make the session's following reads of the user's rows see one snapshot.
+
+    Ends the current (read-only) transaction and starts a new one: REPEATABLE
+    READ on PostgreSQL, and an explicit deferred BEGIN on SQLite, whose driver
+    otherwise runs every SELECT in its own implicit transaction. The snapshot
+    is taken at the next query and released when the session is removed. It
+    is opened on the engine holding receipts, items and budgets, which with
+    sharding is the current user's shard.
+    """
+    db.session.commit()
+    bind_arguments = {'mapper': Receipt.__mapper__}
+    if db.session.get_bind(**bind_arguments).dialect.name == 'sqlite':
+        db.session.execute(text('BEGIN'), bind_arguments=bind_arguments)
+    else:
+        db.session.connection(bind_arguments=bind_arguments,
+                              execution_options={'isolation_level': 'REPEATABLE READ'})
+
+
+def budget_snapshots(user_id, active_at=None):
+    """A user's budgets (newest first), or those active at ``active_at`` by end date."""
+    query = select(*BUDGET_SNAPSHOT_COLUMNS).where(Budget.user_id == user_id)
+    if active_at is not None:
+        query = query.where(Budget.start_date <= active_at, Budget.end_date >= active_at).order_by(Budget.end_date)
+    else:
+        query = query.order_by(Budget.created_at.desc())
+    return list(stream(query, BudgetSnapshot))
+
+
+def budget_totals(user_id, now):
+    """Budget count and allocated/spent sums for a user, and how many are active at ``now``."""
+    total_budgets, allocated_cents, spent_cents = db.session.execute(
+        select(
+            func.count(Budget.id),
+            func.coalesce(func.sum(Budget.total_budget_cents), 0),
+            func.coalesce(func.sum(Budget.spent_amount_cents), 0)
+        ).where(Budget.user_id == user_id)
+    ).one()
+    # Served by ix_budget_user_dates
+    active_budgets = db.session.execute(
+        select(func.count(Budget.id)).where(
+            Budget.user_id == user_id,
+            Budget.start_date <= now,
+            Budget.end_date >= now
+        )
+    ).scalar()
+    return BudgetTotals(total_budgets, active_budgets, allocated_cents, spent_cents)
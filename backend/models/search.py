@@ -0,0 +1,218 @@
+"""Full-text search over a user's receipt items.
+
+Item names are indexed together with their owner, so a search only walks
+the searching user's postings, however many other users' items share the
+database. On SQLite the index is ``receipt_item_fts``, an FTS5 table of
+``(product_name, owner)`` where ``owner`` is a ``u<user id>`` token, and a
+query matches ``owner:u<id> AND product_name:(...)``; prefix indexes of
+2 to 8 letters keep partly typed words to the owner's postings too. On
+PostgreSQL it is a ``receipt_item_fts`` table of ``(item_id, user_id,
+document)`` under one GIN index over ``(user_id, document)`` (btree_gin),
+which serves ``user_id = :id AND document @@ query`` in a single index
+scan. Other databases fall back to LIKE.
+
+The index is a copy: triggers keep it in step with every insert, delete
+(including the ``ON DELETE CASCADE`` from receipts) and rename of an item,
+and with receipts changing hands. Deletes go by item id alone, so they
+never depend on the parent receipt still being there.
+
+Every result contains every query word, and item names are a few words
+long, so bm25 (or ``ts_rank``) mostly ranks by how few other words a name
+has. Ordering by name length gives that ranking without scoring every
+match, which on a 100k-item history is most of the query time.
+
+The index lives next to ``receipt_item``, so with sharding each shard
+indexes its own items. It is created with the table (``create_search_index``
+runs after ``receipt_item`` is created) and by migrations 8 and 10 for
+existing databases. Archived receipts (``models.archive``) are not searched.
+"""
+import re
+from typing import NamedTuple, Optional
+from datetime import datetime
+
+from sqlalchemy import event, select, text, table, column, func, literal_column, or_, and_
+
+from models import Receipt, ReceiptItem, db
+
+SEARCH_TABLE = 'receipt_item_fts'
+MAX_QUERY_TERMS = 8
+SORTS = ('relevance', 'recent')
+
+_TERM = re.compile(r'[^\W_]+')
+
+# Prefix queries a prefix index covers read one doclist and skip to the
+# owner's rows; longer ones merge every indexed word they prefix, for all users
+_SQLITE_OPTIONS = "product_name, owner, tokenize='unicode61 remove_diacritics 2', prefix='2 3 4 5 6 7 8'"
+_SQLITE_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5({_SQLITE_OPTIONS})",
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON receipt_item BEGIN
+        INSERT INTO {SEARCH_TABLE}(rowid, product_name, owner)
+            SELECT new.id, new.product_name, 'u' || user_id FROM receipt WHERE id = new.receipt_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON receipt_item BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update AFTER UPDATE OF id, receipt_id, product_name ON receipt_item BEGIN
+        DELETE FROM {SEARCH_TABLE} WHERE rowid = old.id;
+        INSERT INTO {SEARCH_TABLE}(rowid, product_name, owner)
+            SELECT new.id, new.product_name, 'u' || user_id FROM receipt WHERE id = new.receipt_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_owner AFTER UPDATE OF user_id ON receipt BEGIN
+        UPDATE {SEARCH_TABLE} SET owner = 'u' || new.user_id
+            WHERE rowid IN (SELECT id FROM receipt_item WHERE receipt_id = new.id);
+    END""",
+)
+_SQLITE_FILL = (
+    f"INSERT INTO {SEARCH_TABLE}(rowid, product_name, owner) "
+    "SELECT receipt_item.id, receipt_item.product_name, 'u' || receipt.user_id "
+    "FROM receipt_item JOIN receipt ON receipt.id = receipt_item.receipt_id"
+)
+_SQLITE_TRIGGERS = ('insert', 'delete', 'update', 'owner')
+
+_POSTGRES_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS btree_gin",
+    f"""CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} (
+        item_id integer PRIMARY KEY, user_id integer NOT NULL, document tsvector NOT NULL
+    )""",
+    f"CREATE INDEX IF NOT EXISTS ix_{SEARCH_TABLE}_owner ON {SEARCH_TABLE} USING gin (user_id, document)",
+    f"""CREATE OR REPLACE FUNCTION {SEARCH_TABLE}_sync() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP <> 'INSERT' THEN
+            DELETE FROM {SEARCH_TABLE} WHERE item_id = OLD.id;
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            INSERT INTO {SEARCH_TABLE} (item_id, user_id, document)
+                SELECT NEW.id, user_id, to_tsvector('simple', NEW.product_name) FROM receipt WHERE id = NEW.receipt_id;
+        END IF;
+        RETURN NULL;
+    END $$""",
+    f"""CREATE OR REPLACE FUNCTION {SEARCH_TABLE}_owner() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        UPDATE {SEARCH_TABLE} SET user_id = NEW.user_id
+            WHERE item_id IN (SELECT id FROM receipt_item WHERE receipt_id = NEW.id);
+        RETURN NULL;
+    END $$""",
+    f"DROP TRIGGER IF EXISTS {SEARCH_TABLE}_sync ON receipt_item",
+    f"""CREATE TRIGGER {SEARCH_TABLE}_sync AFTER INSERT OR DELETE OR UPDATE OF id, receipt_id, product_name
+        ON receipt_item FOR EACH ROW EXECUTE FUNCTION {SEARCH_TABLE}_sync()""",
+    f"DROP TRIGGER IF EXISTS {SEARCH_TABLE}_owner ON receipt",
+    f"""CREATE TRIGGER {SEARCH_TABLE}_owner AFTER UPDATE OF user_id
+        ON receipt FOR EACH ROW EXECUTE FUNCTION {SEARCH_TABLE}_owner()""",
+    # The name-only index that preceded the owner-scoped one
+    "DROP INDEX IF EXISTS ix_receipt_item_search",
+)
+_POSTGRES_FILL = (
+    f"INSERT INTO {SEARCH_TABLE} (item_id, user_id, document) "
+    "SELECT receipt_item.id, receipt.user_id, to_tsvector('simple', receipt_item.product_name) "
+    "FROM receipt_item JOIN receipt ON receipt.id = receipt_item.receipt_id"
+)
+
+
+class ItemMatch(NamedTuple):
+    id: int
+    receipt_id: int
+    product_name: str
+    quantity: int
+    unit_price_cents: int
+    total_price_cents: int
+    category: Optional[str]
+    currency: str
+    purchase_date: datetime
+    store_id: int
+
+
+MATCH_COLUMNS = (
+    ReceiptItem.id, ReceiptItem.receipt_id, ReceiptItem.product_name, ReceiptItem.quantity,
+    ReceiptItem.unit_price_cents, ReceiptItem.total_price_cents, ReceiptItem.category,
+    Receipt.currency, Receipt.purchase_date, Receipt.store_id
+)
+
+
+def drop_search_index(conn):
+    """Drop the item search index and the triggers maintaining it."""
+    if conn.dialect.name == 'sqlite':
+        for trigger in _SQLITE_TRIGGERS:
+            conn.exec_driver_sql(f'DROP TRIGGER IF EXISTS {SEARCH_TABLE}_{trigger}')
+        conn.exec_driver_sql(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+    elif conn.dialect.name == 'postgresql':
+        conn.exec_driver_sql(f'DROP TRIGGER IF EXISTS {SEARCH_TABLE}_sync ON receipt_item')
+        conn.exec_driver_sql(f'DROP TRIGGER IF EXISTS {SEARCH_TABLE}_owner ON receipt')
+        conn.exec_driver_sql(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+def create_search_index(conn):
+    """Create the item search index and its triggers if missing, indexing
+    the items already in ``receipt_item``. An index defined differently
+    (from an older version) is replaced."""
+    if conn.dialect.name == 'sqlite':
+        definition = conn.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': SEARCH_TABLE}
+        ).scalar()
+        if definition is not None and _SQLITE_OPTIONS not in definition:
+            drop_search_index(conn)
+            definition = None
+        for statement in _SQLITE_DDL:
+            conn.exec_driver_sql(statement)
+        if definition is None:
+            conn.exec_driver_sql(_SQLITE_FILL)
+    elif conn.dialect.name == 'postgresql':
+        exists = conn.execute(text('SELECT to_regclass(:name)'), {'name': SEARCH_TABLE}).scalar()
+        for statement in _POSTGRES_DDL:
+            conn.exec_driver_sql(statement)
+        if not exists:
+            conn.exec_driver_sql(_POSTGRES_FILL)
+
+
+@event.listens_for(ReceiptItem.__table__, 'after_create')
+def _create_search_index(target, connection, **kw):
+    # A new receipt_item table is empty, so an index left from a dropped one is stale
+    drop_search_index(connection)
+    create_search_index(connection)
+
+
+def query_terms(query):
+    """The words of a search query, lowercased: "Aceite de oliva!" -> ["aceite", "de", "oliva"]."""
+    return _TERM.findall((query or '').lower())[:MAX_QUERY_TERMS]
+
+
+def _fts_query(user_id, terms):
+    # The owner's token, and every term, all but one-letter ones also as a prefix
+    words = ' '.join(f'"{term}"*' if len(term) > 1 else f'"{term}"' for term in terms)
+    return f'owner:"u{int(user_id)}" AND product_name:({words})'
+
+
+def search_items(user_id, query, limit=20, offset=0, sort='relevance', store_id=None):
+    """A user's receipt items whose name matches every word of ``query``,
+    closest match (shortest name) first and the most recent purchase first
+    among equals, or with ``sort='recent'`` newest purchase first.
+    Archived receipts are not searched."""
+    terms = query_terms(query)
+    if not terms:
+        return []
+    dialect = db.session.get_bind(mapper=ReceiptItem.__mapper__).dialect.name
+
+    statement = select(*MATCH_COLUMNS).join(Receipt, Receipt.id == ReceiptItem.receipt_id) \
+        .where(Receipt.user_id == user_id)
+    if dialect == 'sqlite':
+        index = table(SEARCH_TABLE, column('rowid'))
+        statement = statement.join(index, index.c.rowid == ReceiptItem.id) \
+            .where(text(f'{SEARCH_TABLE} MATCH :terms').bindparams(terms=_fts_query(user_id, terms)))
+    elif dialect == 'postgresql':
+        index = table(SEARCH_TABLE, column('item_id'), column('user_id'), column('document'))
+        config = literal_column("'simple'")
+        statement = statement.join(index, index.c.item_id == ReceiptItem.id).where(
+            index.c.user_id == user_id,
+            index.c.document.bool_op('@@')(func.to_tsquery(config, ' & '.join(f'{term}:*' for term in terms)))
+        )
+    else:
+        statement = statement.where(and_(*(
+            or_(ReceiptItem.product_name.ilike(f'{term}%'), ReceiptItem.product_name.ilike(f'% {term}%'))
+            for term in terms
+        )))
+
+    if store_id is not None:
+        statement = statement.where(Receipt.store_id == store_id)
+    if sort == 'relevance':
+        statement = statement.order_by(func.length(ReceiptItem.product_name))
+    statement = statement.order_by(Receipt.purchase_date.desc(), ReceiptItem.id.desc())
+    return [ItemMatch._make(row) for row in db.session.execute(statement.limit(limit).offset(offset))]
@@ -0,0 +1,193 @@
+"""Column-projection serializers for read-heavy endpoints.
+
+These build the same payloads as the models' ``to_dict()`` methods, but
+straight from SQL result tuples so that listing endpoints never hydrate
+ORM objects. Datetimes are left as ``datetime`` values and written as
+ISO 8601 by the app's JSON provider.
+"""
+import heapq
+
+from sqlalchemy import select
+from models import User, Receipt, ReceiptItem, Budget, Product, db, archive
+from models.rows import stream
+from models.stores import store_name, store_names
+from utils.money import from_cents
+
+USER_COLUMNS = (User.id, User.username, User.email, User.created_at)
+
+RECEIPT_COLUMNS = (
+    Receipt.id,
+    Receipt.store_id,
+    Receipt.total_amount_cents,
+    Receipt.currency,
+    Receipt.purchase_date,
+    Receipt.created_at,
+)
+
+ITEM_COLUMNS = (
+    ReceiptItem.receipt_id,
+    ReceiptItem.id,
+    ReceiptItem.product_name,
+    ReceiptItem.quantity,
+    ReceiptItem.unit_price_cents,
+    ReceiptItem.total_price_cents,
+    ReceiptItem.category,
+)
+
+BUDGET_COLUMNS = (
+    Budget.id,
+    Budget.name,
+    Budget.total_budget_cents,
+    Budget.spent_amount_cents,
+    Budget.currency,
+    Budget.category,
+    Budget.period,
+    Budget.is_recurring,
+    Budget.start_date,
+    Budget.end_date,
+    Budget.created_at,
+)
+
+PRODUCT_COLUMNS = (
+    Product.id,
+    Product.name,
+    Product.category,
+    Product.average_price,
+    Product.sustainability_score,
+    Product.created_at,
+)
+
+
+def user_row(row):
+    id, username, email, created_at = row
+    return {
+        'id': id,
+        'username': username,
+        'email': email,
+        'created_at': created_at
+    }
+
+
+def item_row(row):
+    _, id, product_name, quantity, unit_price_cents, total_price_cents, category = row
+    return {
+        'id': id,
+        'product_name': product_name,
+        'quantity': quantity,
+        'unit_price': from_cents(unit_price_cents),
+        'total_price': from_cents(total_price_cents),
+        'category': category
+    }
+
+
+def budget_row(row):
+    (id, name, total_budget_cents, spent_amount_cents, currency, category,
+     period, is_recurring, start_date, end_date, created_at) = row
+    return {
+        'id': id,
+        'name': name,
+        'total_budget': from_cents(total_budget_cents),
+        'spent_amount': from_cents(spent_amount_cents),
+        'remaining_budget': from_cents(total_budget_cents - spent_amount_cents),
+        'currency': currency,
+        'category': category,
+        'period': period,
+        'is_recurring': is_recurring,
+        'start_date': start_date,
+        'end_date': end_date,
+        'created_at': created_at
+    }
+
+
+def product_row(row):
+    id, name, category, average_price, sustainability_score, created_at = row
+    return {
+        'id': id,
+        'name': name,
+        'category': category,
+        'average_price': average_price,
+        'sustainability_score': sustainability_score,
+        'created_at': created_at
+    }
+
+
+def iter_receipts(user_id, receipt_id=None):
+    """Yield a user's receipts (newest first) with their items nested,
+    merging hot and archived receipts (``models.archive``) by date."""
+    hot = _hot_receipts(user_id, receipt_id)
+    if receipt_id is not None:
+        found = list(hot)
+        return iter(found) if found else archive.archived_receipts(user_id, receipt_id)
+    if not archive.has_archive(user_id):
+        return hot
+    return heapq.merge(
+        hot, archive.archived_receipts(user_id),
+        key=lambda receipt: (receipt['purchase_date'], receipt['id']), reverse=True
+    )
+
+
+def _hot_receipts(user_id, receipt_id=None):
+    """Runs exactly two queries, one for the receipt columns and one for the
+    item columns, both streamed in the same receipt order and merged, so
+    only one receipt is held in memory at a time.
+    """
+    receipt_order = (Receipt.purchase_date.desc(), Receipt.id.desc())
+    receipt_query = select(*RECEIPT_COLUMNS).where(Receipt.user_id == user_id).order_by(*receipt_order)
+    item_query = (
+        select(*ITEM_COLUMNS).join(Receipt).where(Receipt.user_id == user_id)
+        .order_by(*receipt_order, ReceiptItem.id)
+    )
+
+    if receipt_id is not None:
+        receipt_query = receipt_query.where(Receipt.id == receipt_id)
+        item_query = item_query.where(Receipt.id == receipt_id)
+
+    names = store_names()
+    items = stream(item_query)
+    item = next(items, None)
+    for id, store_id, total_amount_cents, currency, purchase_date, created_at in stream(receipt_query):
+        receipt_items = []
+        while item is not None and item[0] == id:
+            receipt_items.append(item_row(item))
+            item = next(items, None)
+        yield {
+            'id': id,
+            'store_name': names[store_id] if store_id in names else store_name(store_id),
+            'total_amount': from_cents(total_amount_cents),
+            'currency': currency,
+            'purchase_date': purchase_date,
+            'created_at': created_at,
+            'items': receipt_items
+        }
+
+
+def serialize_receipts(user_id, receipt_id=None):
+    """Return a user's receipts (newest first) with their items nested."""
+    return list(iter_receipts(user_id, receipt_id))
+
+
+def serialize_budgets(user_id):
+    query = select(*BUDGET_COLUMNS).where(Budget.user_id == user_id).order_by(Budget.created_at.desc())
+    return [budget_row(row) for row in stream(query)]
+
+
+def serialize_products(query):
+    """Serialize a ``select(*PRODUCT_COLUMNS)`` statement."""
+    return [product_row(row) for row in db.session.execute(query)]
+
+
+def serialize_item_matches(matches):
+    """Serialize ``models.search.ItemMatch`` rows with their receipt's date and store."""
+    names = store_names({match.store_id for match in matches})
+    return [{
+        'id': match.id,
+        'receipt_id': match.receipt_id,
+        'product_name': match.product_name,
+        'quantity': match.quantity,
+        'unit_price': from_cents(match.unit_price_cents),
+        'total_price': from_cents(match.total_price_cents),
+        'category': match.category,
+        'currency': match.currency,
+        'purchase_date': match.purchase_date,
+        'store_name': names.get(match.store_id)
+    } for match in matches]
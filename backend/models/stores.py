@@ -0,0 +1,200 @@
+"""Store resolution and the per-worker store directory.
+
+Receipts reference a ``Store`` by id. At ingestion the store name printed
+on the receipt is resolved to a store: first through the registered
+aliases, then by its key (the normalized name without a trailing branch
+number, so "WALMART #1234" and "Walmart Sucursal 88" are both
+``walmart``); a name that matches nothing creates a new store.
+
+Stores and aliases live in the main database. Every worker keeps a
+directory of them (ids, names, keys, tracker ids) so serializers and
+analytics turn store ids into names without a join; it reloads when an
+unknown id shows up or the ``stores`` data version changes.
+"""
+from datetime import datetime
+import time
+from threading import Lock
+
+from flask import current_app
+from sqlalchemy import select, update, insert, or_
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import Store, StoreAlias, db, get_data_version, bump_data_version, STORES_SCOPE
+from utils.text import normalize_name
+
+BRANCH_WORDS = frozenset({'store', 'tienda', 'sucursal', 'suc', 'branch', 'no', 'num', 'unidad'})
+DIRECTORY_MAX_AGE = 30
+
+_UPSERT_DIALECTS = {'sqlite': sqlite, 'postgresql': postgresql}
+
+
+def _is_branch_word(word):
+    return not word or word in BRANCH_WORDS or any(char.isdigit() for char in word)
+
+
+def store_key(name):
+    """Normalized store name without trailing branch numbers or words:
+    "Soriana Suc. 45" -> "soriana"."""
+    words = normalize_name(name).split()
+    while len(words) > 1 and _is_branch_word(words[-1]):
+        words.pop()
+    return ' '.join(words)
+
+
+def display_name(name):
+    """Name for a new store: the given name without its branch suffix."""
+    words = name.split()
+    while len(words) > 1 and _is_branch_word(normalize_name(words[-1])):
+        words.pop()
+    name = ' '.join(words)
+    return name.title() if name.isupper() else name
+
+
+def _find(conn, alias, key):
+    aliases = dict(conn.execute(
+        select(StoreAlias.alias, StoreAlias.store_id).where(StoreAlias.alias.in_({alias, key}))
+    ).all())
+    if alias in aliases:
+        return aliases[alias]
+    if key in aliases:
+        return aliases[key]
+    return conn.execute(select(Store.id).where(Store.key == key)).scalar()
+
+
+def resolve_store(conn, name):
+    """Id of the store ``name`` refers to, created if there is none.
+
+    ``conn`` is a connection to the main database; a concurrent creation
+    of the same store is absorbed by the unique key.
+    """
+    alias, key = normalize_name(name), store_key(name)
+    if not key:
+        raise ValueError('Store name must not be empty')
+    store_id = _find(conn, alias, key)
+    if store_id is not None:
+        return store_id
+
+    values = {'name': display_name(name.strip()), 'key': key, 'created_at': datetime.utcnow()}
+    if conn.dialect.name in _UPSERT_DIALECTS:
+        conn.execute(_UPSERT_DIALECTS[conn.dialect.name].insert(Store).values(**values)
+                     .on_conflict_do_nothing(index_elements=['key']))
+    else:
+        conn.execute(insert(Store).values(**values))
+    return _find(conn, alias, key)
+
+
+def _main_connection():
+    return db.session.connection(bind_arguments={'mapper': Store.__mapper__})
+
+
+class StoreDirectory:
+    def __init__(self):
+        self._lock = Lock()
+        self._version = None
+        self._checked_at = 0.0
+        self.stores = {}
+        self.aliases = {}
+        self.keys = {}
+
+    def _load(self, version):
+        stores = {
+            store_id: (name, key, tracker_id)
+            for store_id, name, key, tracker_id in db.session.execute(
+                select(Store.id, Store.name, Store.key, Store.tracker_id)
+            )
+        }
+        aliases = dict(db.session.execute(select(StoreAlias.alias, StoreAlias.store_id)).all())
+        with self._lock:
+            self.stores = stores
+            self.aliases = aliases
+            self.keys = {key: store_id for store_id, (_, key, _) in stores.items()}
+            self._version = version
+
+    def sync(self, max_age=0):
+        now = time.monotonic()
+        if self._version is not None and now - self._checked_at < max_age:
+            return
+        version = get_data_version(STORES_SCOPE)
+        if version != self._version:
+            self._load(version)
+        self._checked_at = now
+
+    def get(self, store_id):
+        """``(name, key, tracker_id)`` of a store, or None if it does not exist."""
+        self.sync(DIRECTORY_MAX_AGE)
+        if store_id not in self.stores:
+            self._load(get_data_version(STORES_SCOPE))
+        return self.stores.get(store_id)
+
+    def find(self, name):
+        """Id of the known store ``name`` refers to, or None."""
+        self.sync()
+        alias, key = normalize_name(name), store_key(name)
+        return self.aliases.get(alias) or self.aliases.get(key) or self.keys.get(key)
+
+    def resolve(self, name):
+        store_id = self.find(name)
+        if store_id is None:
+            store_id = resolve_store(_main_connection(), name)
+        return store_id
+
+
+def directory():
+    """The store directory of the current app in this process."""
+    return current_app.extensions.setdefault('stores', StoreDirectory())
+
+
+def resolve_store_id(name):
+    """Id of the store a receipt's store name refers to (created if new)."""
+    return directory().resolve(name)
+
+
+def store_name(store_id):
+    store = directory().get(store_id)
+    return store[0] if store else None
+
+
+def store_names(store_ids=None):
+    """``{store id: name}`` for ``store_ids`` (default: every store)."""
+    stores = directory()
+    if store_ids is None:
+        stores.sync(DIRECTORY_MAX_AGE)
+        return {store_id: store[0] for store_id, store in stores.stores.items()}
+    return {store_id: store[0] for store_id, store in ((store_id, stores.get(store_id)) for store_id in store_ids) if store}
+
+
+def add_store_alias(alias, name):
+    """Resolve ``alias`` to the existing store named ``name`` from now on."""
+    conn = _main_connection()
+    store_id = _find(conn, normalize_name(name), store_key(name))
+    if store_id is None:
+        raise ValueError(f'No store named {name!r}')
+    alias = normalize_name(alias)
+    owner = _find(conn, alias, alias)
+    if owner == store_id:
+        return store_id
+    if owner is not None:
+        raise ValueError(f'{alias!r} already refers to store {owner}')
+    conn.execute(insert(StoreAlias).values(store_id=store_id, alias=alias))
+    bump_data_version(STORES_SCOPE)
+    db.session.commit()
+    return store_id
+
+
+def link_tracked_stores(trackers):
+    """Point the stores of the price tracker's chains (``{'id', 'name'}``
+    dicts) at their tracker ids and names, creating the stores if needed."""
+    conn = _main_connection()
+    changed = False
+    for tracker in trackers:
+        store_id = resolve_store(conn, tracker['name'])
+        result = conn.execute(
+            update(Store).where(
+                Store.id == store_id,
+                or_(Store.tracker_id.is_distinct_from(tracker['id']), Store.name != tracker['name'])
+            ).values(tracker_id=tracker['id'], name=tracker['name'])
+        )
+        changed = changed or result.rowcount > 0
+    if changed:
+        bump_data_version(STORES_SCOPE)
+    db.session.commit()
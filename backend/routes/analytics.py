@@ -1,47 +1,71 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, send_file
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import Receipt, ReceiptItem, Budget, db
-from datetime import datetime, timedelta
+from models import Receipt, ReceiptItem, db, get_data_version, user_scope
+from models.archive import has_archive, archived_category_totals, archived_product_totals
+from models.rows import receipt_summaries, product_rollups, budget_snapshots
+from services.analytics import (
+    SpendingTrends, ShoppingPatterns, StoreSpend, CategoryBreakdown, TopProducts, SustainabilityScore,
+    budget_analysis as build_budget_analysis, dashboard as build_dashboard, DASHBOARD_SECTIONS
+)
+from services.jobs import enqueue
+from services.reports import CHARTS, FORMATS as REPORT_FORMATS, cached_report
+from utils.http_cache import conditional, current_user_scope
+from utils.admission import admission_control
+from datetime import datetime, date
 from sqlalchemy import func
-import json
 
 analytics_bp = Blueprint('analytics', __name__)
 
+@analytics_bp.route('/dashboard', methods=['GET'])
+@jwt_required()
+@conditional(current_user_scope)
+@admission_control('analytics')
+def dashboard():
+    """Several analytics sections in one response, keyed by section name.
+
+    ``?sections=`` is a comma-separated subset of the section names
+    (default: all); each section's body matches its own endpoint.
+    """
+    try:
+        user_id = get_jwt_identity()
+        
+        requested = request.args.get('sections')
+        sections = [name.strip() for name in requested.split(',') if name.strip()] if requested else DASHBOARD_SECTIONS
+        unknown = [name for name in sections if name not in DASHBOARD_SECTIONS]
+        if unknown:
+            return jsonify({
+                'error': f"Unknown sections: {', '.join(unknown)}",
+                'sections': list(DASHBOARD_SECTIONS)
+            }), 400
+        
+        limit = request.args.get('limit', 10, type=int)
+        return jsonify(build_dashboard(user_id, sections, top_products_limit=limit)), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @analytics_bp.route('/spending-trends', methods=['GET'])
 @jwt_required()
+@conditional(current_user_scope)
+@admission_control('analytics')
 def spending_trends():
     try:
         user_id = get_jwt_identity()
         
-        # Get spending for the last 12 months
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=365)
-        
-        receipts = Receipt.query.filter(
-            Receipt.user_id == user_id,
-            Receipt.purchase_date >= start_date,
-            Receipt.purchase_date <= end_date
-        ).all()
-        
-        # Group by month
-        monthly_spending = {}
-        for receipt in receipts:
-            month_key = receipt.purchase_date.strftime('%Y-%m')
-            if month_key not in monthly_spending:
-                monthly_spending[month_key] = 0
-            monthly_spending[month_key] += receipt.total_amount
-        
-        return jsonify({
-            'monthly_spending': monthly_spending,
-            'total_spending': sum(receipt.total_amount for receipt in receipts),
-            'average_monthly': sum(monthly_spending.values()) / max(len(monthly_spending), 1)
-        }), 200
+        # Spending for the last 12 months, grouped by month (in cents, so the sums are exact)
+        trends = SpendingTrends(datetime.now())
+        for receipt in receipt_summaries(user_id, since=trends.start, until=trends.end):
+            trends.add(receipt)
+        
+        return jsonify(trends.payload()), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @analytics_bp.route('/category-breakdown', methods=['GET'])
 @jwt_required()
+@conditional(current_user_scope)
+@admission_control('analytics')
 def category_breakdown():
     try:
         user_id = get_jwt_identity()
@@ -49,27 +73,27 @@ def category_breakdown():
         # Get category spending
         category_query = db.session.query(
             ReceiptItem.category,
-            func.sum(ReceiptItem.total_price).label('total_spent'),
+            func.sum(ReceiptItem.total_price_cents).label('total_spent'),
             func.count(ReceiptItem.id).label('item_count')
         ).join(Receipt).filter(
             Receipt.user_id == user_id
         ).group_by(ReceiptItem.category).all()
         
-        categories = []
+        breakdown = CategoryBreakdown()
         for category, total_spent, item_count in category_query:
-            categories.append({
-                'category': category or 'Other',
-                'total_spent': float(total_spent),
-                'item_count': item_count
-            })
+            breakdown.add(category, total_spent, item_count)
+        for category, total_spent, item_count in archived_category_totals(user_id):
+            breakdown.add(category, total_spent, item_count)
         
-        return jsonify({'categories': categories}), 200
+        return jsonify(breakdown.payload()), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @analytics_bp.route('/top-products', methods=['GET'])
 @jwt_required()
+@conditional(current_user_scope)
+@admission_control('analytics')
 def top_products():
     try:
         user_id = get_jwt_identity()
@@ -77,127 +101,151 @@ def top_products():
         
         product_query = db.session.query(
             ReceiptItem.product_name,
-            func.sum(ReceiptItem.total_price).label('total_spent'),
+            func.sum(ReceiptItem.total_price_cents).label('total_spent'),
             func.sum(ReceiptItem.quantity).label('total_quantity'),
             func.count(ReceiptItem.id).label('purchase_frequency')
         ).join(Receipt).filter(
             Receipt.user_id == user_id
         ).group_by(ReceiptItem.product_name).order_by(
-            func.sum(ReceiptItem.total_price).desc()
-        ).limit(limit).all()
-        
-        products = []
-        for product_name, total_spent, total_quantity, frequency in product_query:
-            products.append({
-                'product_name': product_name,
-                'total_spent': float(total_spent),
-                'total_quantity': int(total_quantity),
-                'purchase_frequency': frequency,
-                'average_price': float(total_spent) / max(int(total_quantity), 1)
-            })
-        
-        return jsonify({'top_products': products}), 200
+            func.sum(ReceiptItem.total_price_cents).desc()
+        )
+        
+        # With archived items the ranking is only known after merging both sides
+        archived = has_archive(user_id)
+        products = TopProducts(limit)
+        for product_name, total_spent, total_quantity, frequency in (
+            product_query.all() if archived else product_query.limit(limit).all()
+        ):
+            products.add(product_name, total_spent, total_quantity, frequency)
+        if archived:
+            for product_name, total_spent, total_quantity, frequency in archived_product_totals(user_id):
+                products.add(product_name, total_spent, total_quantity, frequency)
+        
+        return jsonify(products.payload()), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @analytics_bp.route('/shopping-patterns', methods=['GET'])
 @jwt_required()
+@conditional(current_user_scope)
+@admission_control('analytics')
 def shopping_patterns():
     try:
         user_id = get_jwt_identity()
         
-        receipts = Receipt.query.filter_by(user_id=user_id).all()
-        
         # Analyze shopping patterns
-        day_of_week = {}
-        hour_of_day = {}
-        store_frequency = {}
-        
-        for receipt in receipts:
-            # Day of week (0=Monday, 6=Sunday)
-            day = receipt.purchase_date.strftime('%A')
-            day_of_week[day] = day_of_week.get(day, 0) + 1
-            
-            # Hour of day
-            hour = receipt.purchase_date.hour
-            hour_of_day[hour] = hour_of_day.get(hour, 0) + 1
-            
-            # Store frequency
-            store_frequency[receipt.store_name] = store_frequency.get(receipt.store_name, 0) + 1
-        
-        return jsonify({
-            'day_of_week_patterns': day_of_week,
-            'hour_of_day_patterns': hour_of_day,
-            'favorite_stores': dict(sorted(store_frequency.items(), key=lambda x: x[1], reverse=True)[:5])
-        }), 200
+        patterns = ShoppingPatterns()
+        for receipt in receipt_summaries(user_id):
+            patterns.add(receipt)
+        
+        return jsonify(patterns.payload()), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@analytics_bp.route('/store-spend', methods=['GET'])
+@jwt_required()
+@conditional(current_user_scope)
+@admission_control('analytics')
+def store_spend():
+    """Spend per store; ``tracker_id`` links a store to the tracked prices
+    of /api/compare-prices and /api/optimize-basket."""
+    try:
+        user_id = get_jwt_identity()
+        
+        spend = StoreSpend()
+        for receipt in receipt_summaries(user_id):
+            spend.add(receipt)
+        
+        return jsonify(spend.payload()), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @analytics_bp.route('/budget-analysis', methods=['GET'])
 @jwt_required()
+@conditional(current_user_scope)
+@admission_control('analytics')
 def budget_analysis():
     try:
         user_id = get_jwt_identity()
         
-        budgets = Budget.query.filter_by(user_id=user_id).all()
-        
-        analysis = []
-        for budget in budgets:
-            utilization = (budget.spent_amount / budget.total_budget * 100) if budget.total_budget > 0 else 0
-            remaining_days = (budget.end_date - datetime.now()).days
-            
-            status = 'on_track'
-            if utilization > 90:
-                status = 'over_budget'
-            elif utilization > 75:
-                status = 'warning'
-            
-            analysis.append({
-                'budget': budget.to_dict(),
-                'utilization_percentage': utilization,
-                'remaining_days': max(remaining_days, 0),
-                'status': status,
-                'daily_budget_remaining': budget.total_budget - budget.spent_amount / max(remaining_days, 1) if remaining_days > 0 else 0
-            })
-        
-        return jsonify({'budget_analysis': analysis}), 200
+        return jsonify(build_budget_analysis(budget_snapshots(user_id), datetime.now())), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@analytics_bp.route('/budget-forecast', methods=['GET'])
+@jwt_required()
+@conditional(current_user_scope)
+@admission_control('analytics')
+def budget_forecast():
+    """Burn rate, projected total and overspend date for every active budget."""
+    try:
+        user_id = get_jwt_identity()
+        
+        from services.forecasting import forecast_budgets
+        return jsonify({'forecasts': forecast_budgets(user_id)}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @analytics_bp.route('/sustainability-score', methods=['GET'])
 @jwt_required()
+@conditional(current_user_scope)
+@admission_control('analytics')
 def sustainability_score():
     try:
         user_id = get_jwt_identity()
         
-        # Mock sustainability analysis - in production this would use real data
-        receipts = Receipt.query.filter_by(user_id=user_id).all()
-        
-        total_items = sum(len(receipt.items) for receipt in receipts)
-        organic_items = sum(1 for receipt in receipts for item in receipt.items if 'organic' in item.product_name.lower())
-        local_items = sum(1 for receipt in receipts for item in receipt.items if any(keyword in item.product_name.lower() for keyword in ['local', 'farm']))
-        
-        sustainability_score = 0
-        if total_items > 0:
-            organic_percentage = organic_items / total_items * 100
-            local_percentage = local_items / total_items * 100
-            sustainability_score = min((organic_percentage + local_percentage) / 2, 100)
-        
-        recommendations = []
-        if organic_percentage < 20:
-            recommendations.append("Try buying more organic products to reduce environmental impact")
-        if local_percentage < 15:
-            recommendations.append("Consider purchasing more locally sourced items to support local farmers")
-        
-        return jsonify({
-            'sustainability_score': round(sustainability_score, 1),
-            'organic_percentage': round(organic_percentage, 1),
-            'local_percentage': round(local_percentage, 1),
-            'recommendations': recommendations
-        }), 200
+        score = SustainabilityScore()
+        for rollup in product_rollups(user_id):
+            score.add(rollup.product_name, rollup.item_count)
+        
+        return jsonify(score.payload()), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@analytics_bp.route('/reports/<chart>.<fmt>', methods=['GET'])
+@jwt_required()
+@conditional(current_user_scope)
+def report(chart, fmt):
+    """A chart of the user's spending as PNG or PDF, drawn server-side.
+
+    Served from the report cache when it has been drawn for the current
+    data version; otherwise a ``render_report`` job is queued and 202 is
+    returned with the job, to poll or simply to retry the URL after.
+    """
+    try:
+        user_id = get_jwt_identity()
+        
+        if chart not in CHARTS or fmt not in REPORT_FORMATS:
+            return jsonify({
+                'error': f'Unknown report: {chart}.{fmt}',
+                'charts': list(CHARTS),
+                'formats': list(REPORT_FORMATS)
+            }), 404
+        
+        version = get_data_version(user_scope(user_id))
+        path = cached_report(user_id, chart, fmt, version)
+        if path:
+            return send_file(path, mimetype=REPORT_FORMATS[fmt], download_name=f'{chart}.{fmt}',
+                             etag=False, conditional=False, max_age=0)
+        
+        key = f'{chart}.{fmt}:{version}:{date.today():%Y%m%d}'
+        payload = {'user_id': user_id, 'chart': chart, 'fmt': fmt}
+        job, _ = enqueue('render_report', payload, user_id=user_id, idempotency_key=key)
+        if job.status == 'succeeded':
+            # Drawn, but the file has since been removed from the cache
+            job, _ = enqueue('render_report', payload, user_id=user_id, idempotency_key=f'{key}:{job.id}')
+        if job.status in ('failed', 'cancelled'):
+            return jsonify({'error': job.error or 'Report could not be rendered', 'job': job.to_dict()}), 500
+        
+        response = jsonify({'message': 'Report is being rendered', 'job': job.to_dict()})
+        response.headers['Retry-After'] = '2'
+        return response, 202
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1,9 +1,36 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from app import jwt
 from models import User, db
+from models.serializers import USER_COLUMNS, user_row
+from services.jobs import enqueue
+from utils.sharding import assign_shard
+from sqlalchemy import select
+from datetime import timezone
 
 auth_bp = Blueprint('auth', __name__)
 
+def token_outlived_account(claims):
+    """Whether a token belongs to a deleted account, or was issued before
+    its account was created: then it belonged to an earlier account with
+    the same id."""
+    row = db.session.execute(select(User.created_at).where(User.id == claims['sub'])).first()
+    if row is None:
+        return True
+    # iat is in whole seconds, so compare against the second the account was created in
+    return row.created_at is not None and \
+        claims['iat'] < int(row.created_at.replace(tzinfo=timezone.utc).timestamp())
+
+def is_stream_ticket(claims):
+    """Whether a token is a price stream ticket (see price_stream in
+    routes.realtime_pricing), which only services.price_stream accepts."""
+    return claims.get('type') == 'stream' or 'stream_products' in claims
+
+@jwt.token_in_blocklist_loader
+def token_refused(jwt_header, jwt_payload):
+    """Refuse (401) stream tickets, and tokens that outlived their account."""
+    return is_stream_ticket(jwt_payload) or token_outlived_account(jwt_payload)
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     try:
@@ -17,7 +44,8 @@ def register():
         
         user = User(
             username=data['username'],
-            email=data['email']
+            email=data['email'],
+            shard=assign_shard()
         )
         user.set_password(data['password'])
         
@@ -58,12 +86,41 @@ def login():
 def profile():
     try:
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        row = db.session.execute(select(*USER_COLUMNS).where(User.id == user_id)).first()
+        
+        if not row:
+            return jsonify({'error': 'User not found'}), 404
+        
+        return jsonify({'user': user_row(row)}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@auth_bp.route('/account', methods=['DELETE'])
+@jwt_required()
+def delete_account():
+    """Delete the account and all of its data (password required).
+    
+    The purge runs as a background job (202); it removes the job itself
+    along with the account's other jobs once it is done.
+    """
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json(silent=True) or {}
+        user = db.session.get(User, user_id)
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        return jsonify({'user': user.to_dict()}), 200
+        if not user.check_password(data.get('password') or ''):
+            return jsonify({'error': 'Invalid credentials'}), 401
+        
+        job, created = enqueue('purge_account', {'user_id': user_id}, user_id=user_id, idempotency_key='account')
+        
+        return jsonify({
+            'message': 'Account deletion queued' if created else 'Account deletion already queued',
+            'job': job.to_dict()
+        }), 202 if created else 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1,19 +1,25 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import Budget, db
-from datetime import datetime, timedelta
+from models import Budget, db, bump_data_version, user_scope
+from services.budget_periods import PERIODS, period_boundary
+from utils.money import DEFAULT_CURRENCY
+from models.serializers import serialize_budgets
+from models.rows import budget_totals
+from services.analytics import budget_summary as budget_summary_payload
+from utils.http_cache import conditional, current_user_scope
+from datetime import datetime
 
 budget_bp = Blueprint('budget', __name__)
 
 @budget_bp.route('/', methods=['GET'])
 @jwt_required()
+@conditional(current_user_scope)
 def get_budgets():
     try:
         user_id = get_jwt_identity()
-        budgets = Budget.query.filter_by(user_id=user_id).order_by(Budget.created_at.desc()).all()
         
         return jsonify({
-            'budgets': [budget.to_dict() for budget in budgets]
+            'budgets': serialize_budgets(user_id)
         }), 200
         
     except Exception as e:
@@ -26,30 +32,34 @@ def create_budget():
         user_id = get_jwt_identity()
         data = request.get_json()
         
-        # Calculate end date based on period
+        # Calculate end date based on period (calendar months and years)
         start_date = datetime.fromisoformat(data['start_date'].replace('Z', '+00:00'))
         period = data.get('period', 'monthly')
+        is_recurring = bool(data.get('is_recurring', False))
         
-        if period == 'weekly':
-            end_date = start_date + timedelta(weeks=1)
-        elif period == 'monthly':
-            end_date = start_date + timedelta(days=30)
-        elif period == 'yearly':
-            end_date = start_date + timedelta(days=365)
+        if period in PERIODS:
+            end_date = period_boundary(start_date, period, 1)
         else:
             end_date = datetime.fromisoformat(data['end_date'].replace('Z', '+00:00'))
         
+        if end_date <= start_date:
+            return jsonify({'error': 'end_date must be after start_date'}), 400
+        
         budget = Budget(
             user_id=user_id,
             name=data['name'],
             total_budget=data['total_budget'],
+            currency=data.get('currency', DEFAULT_CURRENCY),
             category=data.get('category', 'General'),
             period=period,
             start_date=start_date,
-            end_date=end_date
+            end_date=end_date,
+            is_recurring=is_recurring,
+            recurrence_anchor=start_date if is_recurring else None
         )
         
         db.session.add(budget)
+        bump_data_version(user_scope(user_id))
         db.session.commit()
         
         return jsonify({
@@ -77,7 +87,11 @@ def update_budget(budget_id):
         budget.total_budget = data.get('total_budget', budget.total_budget)
         budget.category = data.get('category', budget.category)
         budget.spent_amount = data.get('spent_amount', budget.spent_amount)
+        budget.is_recurring = bool(data.get('is_recurring', budget.is_recurring))
+        if budget.is_recurring and budget.recurrence_anchor is None:
+            budget.recurrence_anchor = budget.start_date
         
+        bump_data_version(user_scope(user_id))
         db.session.commit()
         
         return jsonify({
@@ -99,6 +113,7 @@ def delete_budget(budget_id):
             return jsonify({'error': 'Budget not found'}), 404
         
         db.session.delete(budget)
+        bump_data_version(user_scope(user_id))
         db.session.commit()
         
         return jsonify({'message': 'Budget deleted successfully'}), 200
@@ -108,31 +123,12 @@ def delete_budget(budget_id):
 
 @budget_bp.route('/summary', methods=['GET'])
 @jwt_required()
+@conditional(current_user_scope)
 def budget_summary():
     try:
         user_id = get_jwt_identity()
-        budgets = Budget.query.filter_by(user_id=user_id).all()
-        
-        total_budgets = len(budgets)
-        total_allocated = sum(budget.total_budget for budget in budgets)
-        total_spent = sum(budget.spent_amount for budget in budgets)
-        total_remaining = total_allocated - total_spent
-        
-        active_budgets = [
-            budget for budget in budgets 
-            if budget.start_date <= datetime.now() <= budget.end_date
-        ]
         
-        return jsonify({
-            'summary': {
-                'total_budgets': total_budgets,
-                'active_budgets': len(active_budgets),
-                'total_allocated': total_allocated,
-                'total_spent': total_spent,
-                'total_remaining': total_remaining,
-                'budget_utilization': (total_spent / total_allocated * 100) if total_allocated > 0 else 0
-            }
-        }), 200
+        return jsonify(budget_summary_payload(budget_totals(user_id, datetime.now()))), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
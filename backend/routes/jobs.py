@@ -0,0 +1,98 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from models import Job, db
+from services.jobs import registry, enqueue, cancel
+
+jobs_bp = Blueprint('jobs', __name__)
+
+MAX_LISTED_JOBS = 100
+
+@jobs_bp.route('/', methods=['POST'])
+@jwt_required()
+def create_job():
+    """Queue a background job.
+    
+    An ``Idempotency-Key`` header (or ``idempotency_key`` field) makes
+    retries safe: the same key returns the job that is already queued.
+    """
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json()
+        kind = data.get('kind')
+        
+        job_kind = registry().get(kind)
+        if job_kind is None or not job_kind.user_submittable:
+            return jsonify({'error': f'Unknown job kind: {kind}'}), 400
+        
+        payload = data.get('payload') or {}
+        if not isinstance(payload, dict):
+            return jsonify({'error': 'payload must be an object'}), 400
+        payload.pop('user_id', None)
+        
+        job, created = enqueue(
+            kind,
+            payload,
+            user_id=user_id,
+            idempotency_key=request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+        )
+        
+        return jsonify({
+            'message': 'Job queued' if created else 'Job already exists',
+            'job': job.to_dict()
+        }), 202 if created else 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@jobs_bp.route('/', methods=['GET'])
+@jwt_required()
+def get_jobs():
+    try:
+        user_id = get_jwt_identity()
+        
+        query = Job.query.filter_by(user_id=user_id)
+        if request.args.get('status'):
+            query = query.filter_by(status=request.args['status'])
+        jobs = query.order_by(Job.id.desc()).limit(MAX_LISTED_JOBS).all()
+        
+        return jsonify({
+            'jobs': [job.to_dict() for job in jobs]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@jobs_bp.route('/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_job(job_id):
+    try:
+        user_id = get_jwt_identity()
+        job = Job.query.filter_by(id=job_id, user_id=user_id).first()
+        
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        return jsonify({'job': job.to_dict()}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@jobs_bp.route('/<int:job_id>', methods=['DELETE'])
+@jwt_required()
+def cancel_job(job_id):
+    """Cancel a job that has not started yet."""
+    try:
+        user_id = get_jwt_identity()
+        job = Job.query.filter_by(id=job_id, user_id=user_id).first()
+        
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        if not cancel(job_id, user_id=user_id):
+            return jsonify({'error': f'Job is already {job.status}'}), 409
+        
+        db.session.refresh(job)
+        return jsonify({'message': 'Job cancelled', 'job': job.to_dict()}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
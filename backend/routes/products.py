@@ -1,47 +1,125 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import Product, db
+from models import Product, db, CATALOG_SCOPE
+from models.serializers import PRODUCT_COLUMNS, serialize_products
+from services.catalog import catalog_cache
+from services.catalog_import import import_catalog as import_catalog_stream, catalog_format, CatalogFormatError
+from utils.http_cache import conditional
+from sqlalchemy import select, func
+import hmac
 import json
 
 products_bp = Blueprint('products', __name__)
 
+MAX_PER_PAGE = 100
+MAX_COMPARISON_ITEMS = 1000
+CONTENT_TYPE_FORMATS = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
 @products_bp.route('/', methods=['GET'])
+@conditional(lambda: CATALOG_SCOPE)
 def get_products():
+    """List products.
+    
+    Page mode (``page``/``per_page``) keeps the original response shape.
+    Cursor mode (``cursor``, empty for the first page) uses keyset
+    pagination on the product id and returns ``next_cursor``. The total
+    is cached until the catalog changes; ``total=none`` leaves it out of
+    cursor pages.
+    """
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), MAX_PER_PAGE)
+        cursor = request.args.get('cursor')
+        total_mode = request.args.get('total', 'exact')
         category = request.args.get('category')
         search = request.args.get('search')
         
-        query = Product.query
+        if total_mode not in ('exact', 'none'):
+            return jsonify({'error': 'total must be exact or none'}), 400
+        
+        filters = []
         
         if category:
-            query = query.filter(Product.category == category)
+            filters.append(Product.category == category)
         
         if search:
-            query = query.filter(Product.name.contains(search))
+            filters.append(Product.name.contains(search))
+        
+        query = select(*PRODUCT_COLUMNS).where(*filters).order_by(Product.id)
+        
+        if cursor is not None:
+            if cursor and not cursor.isdigit():
+                return jsonify({'error': 'Invalid cursor'}), 400
+            
+            products = serialize_products(
+                query.where(Product.id > int(cursor or 0)).limit(per_page + 1)
+            )
+            has_more = len(products) > per_page
+            products = products[:per_page]
+            
+            result = {
+                'products': products,
+                'next_cursor': str(products[-1]['id']) if has_more else None
+            }
+        else:
+            result = {
+                'products': serialize_products(query.limit(per_page).offset((page - 1) * per_page)),
+                'current_page': page
+            }
+        
+        if total_mode != 'none' or cursor is None:
+            if search:
+                # Free-text filters are not cached: every distinct search would be a new entry
+                total = db.session.execute(select(func.count(Product.id)).where(*filters)).scalar()
+            else:
+                total = catalog_cache.count(category)
+            result['total'] = total
+            if cursor is None:
+                result['pages'] = -(-total // per_page)
+        
+        return jsonify(result), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@products_bp.route('/import', methods=['POST'])
+def import_catalog():
+    """Upsert products from a store catalog sent as the request body.
+    
+    The body is CSV or NDJSON (``?format=``, else the ``Content-Type`` or
+    the content), optionally gzip-compressed, and is read as a stream.
+    ``?store=`` names the store for rows without one. Requires the
+    ``X-Catalog-Token`` header to match ``CATALOG_IMPORT_TOKEN``.
+    """
+    try:
+        token = current_app.config['CATALOG_IMPORT_TOKEN']
+        if not token or not hmac.compare_digest(request.headers.get('X-Catalog-Token', ''), token):
+            return jsonify({'error': 'Catalog import not allowed'}), 403
         
-        products = query.paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        fmt = request.args.get('format') or CONTENT_TYPE_FORMATS.get(request.mimetype) \
+            or catalog_format(request.args.get('filename'))
+        report = import_catalog_stream(request.stream, fmt, store=request.args.get('store'))
         
         return jsonify({
-            'products': [product.to_dict() for product in products.items],
-            'total': products.total,
-            'pages': products.pages,
-            'current_page': page
+            'message': f"Imported {report['rows'] - report['skipped']} of {report['rows']} rows",
+            **report
         }), 200
         
+    except CatalogFormatError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @products_bp.route('/categories', methods=['GET'])
+@conditional(lambda: CATALOG_SCOPE)
 def get_categories():
     try:
-        categories = db.session.query(Product.category).distinct().all()
-        category_list = [category[0] for category in categories if category[0]]
-        
-        return jsonify({'categories': category_list}), 200
+        return jsonify({'categories': catalog_cache.categories()}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -50,44 +128,14 @@ def get_categories():
 def price_comparison():
     try:
         data = request.get_json()
-        product_names = data.get('products', [])
-        
-        # Mock price comparison - in production this would call real APIs
-        comparison_data = []
+        items = data.get('products', [])
         
-        mock_stores = [
-            {'name': 'SuperMart', 'type': 'supermarket'},
-            {'name': 'Fresh Market', 'type': 'organic'},
-            {'name': 'Budget Store', 'type': 'discount'},
-            {'name': 'Corner Shop', 'type': 'convenience'}
-        ]
-        
-        for product_name in product_names:
-            product_data = {
-                'product_name': product_name,
-                'stores': []
-            }
-            
-            for store in mock_stores:
-                # Generate mock prices
-                base_price = hash(product_name + store['name']) % 20 + 5
-                if store['type'] == 'organic':
-                    base_price *= 1.3
-                elif store['type'] == 'discount':
-                    base_price *= 0.8
-                elif store['type'] == 'convenience':
-                    base_price *= 1.2
-                
-                product_data['stores'].append({
-                    'store_name': store['name'],
-                    'price': round(base_price, 2),
-                    'availability': True,
-                    'store_type': store['type']
-                })
-            
-            comparison_data.append(product_data)
+        if len(items) > MAX_COMPARISON_ITEMS:
+            return jsonify({'error': f'At most {MAX_COMPARISON_ITEMS} products per comparison'}), 400
         
-        return jsonify({'comparison': comparison_data}), 200
+        # numpy-backed; imported on first use to keep worker start-up light
+        from services.price_comparison import compare_prices
+        return jsonify(compare_prices(items)), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
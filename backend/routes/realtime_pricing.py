@@ -1,12 +1,21 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-import requests
+from flask import Blueprint, Response, request, jsonify, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity, create_access_token
 import json
+import math
 from datetime import datetime, timedelta
+from urllib.parse import urlencode
 import asyncio
-import aiohttp
 from typing import Dict, List
 
+from utils.aio import worker_loop
+from utils.pubsub import hub, user_channel, product_channel, format_event
+from utils.text import normalize_name
+from utils.admission import admission_control
+
+# Handlers in this blueprint are async: they run on the worker's shared
+# event loop (see utils.aio) and must not block it, so database and other
+# blocking work goes through asyncio.to_thread. numpy and the numpy-backed
+# services are imported where they are used, keeping worker start-up light.
 realtime_pricing_bp = Blueprint('realtime_pricing', __name__)
 
 # Mock external API endpoints - in production these would be real APIs
@@ -22,28 +31,60 @@ PRICE_TRACKING_STORES = [
     {"id": "costco", "name": "Costco", "api_endpoint": "https://api.costco.com.mx/items"},
 ]
 
+# Mock pricing model: base price per product and price level per store
+MOCK_BASE_PRICES = {
+    "milk": 25.00,
+    "bread": 30.00,
+    "eggs": 45.00,
+    "chicken": 120.00,
+    "rice": 35.00,
+    "coca-cola": 22.50,
+    "bananas": 18.00,
+}
+MOCK_DEFAULT_PRICE = 50.00
+
+MOCK_STORE_MULTIPLIERS = {
+    "walmart": 0.95,
+    "chedraui": 1.02,
+    "soriana": 1.05,
+    "costco": 0.88,
+}
+
+# Price stream: most products one connection may watch
+MAX_STREAM_PRODUCTS = 50
+
+# Basket optimizer defaults: cost (MXN) of each store visited beyond the first
+DEFAULT_TRIP_COST = 30.00
+MAX_BASKET_ITEMS = 1000
+
 class RealTimePriceTracker:
     def __init__(self):
         self.price_history = {}
         self.active_alerts = {}
+        self.last_best = {}
         
     async def fetch_prices_async(self, product_queries: List[str]) -> Dict:
         """Fetch prices from multiple stores asynchronously"""
-        async with aiohttp.ClientSession() as session:
-            tasks = []
+        session = await worker_loop.http_session()
+        tasks = []
+        for query in product_queries:
             for store in PRICE_TRACKING_STORES:
-                for query in product_queries:
-                    task = self.fetch_store_price(session, store, query)
-                    tasks.append(task)
-            
-            results = await asyncio.gather(*tasks, return_exceptions=True)
-            return self.process_price_results(results)
+                task = self.fetch_store_price(session, store, query)
+                tasks.append(task)
+        
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        processed = self.process_price_results(results)
+        self.publish_price_changes(processed)
+        return processed
     
     async def fetch_store_price(self, session, store: Dict, product_query: str):
         """Fetch price from a specific store"""
         try:
-            # Mock API call - in production this would be actual HTTP requests
-            # For demonstration, return mock data
+            # Mock API call - in production this would be an HTTP request on
+            # the shared session. MOCK_PRICE_LATENCY_MS simulates its round-trip.
+            latency_ms = current_app.config.get('MOCK_PRICE_LATENCY_MS', 0)
+            if latency_ms:
+                await asyncio.sleep(latency_ms / 1000)
             mock_price_data = self.get_mock_price_data(store["id"], product_query)
             return mock_price_data
         except Exception as e:
@@ -53,27 +94,9 @@ class RealTimePriceTracker:
         """Generate mock price data for demonstration"""
         import random
         
-        base_prices = {
-            "milk": 25.00,
-            "bread": 30.00,
-            "eggs": 45.00,
-            "chicken": 120.00,
-            "rice": 35.00,
-            "coca-cola": 22.50,
-            "bananas": 18.00,
-        }
-        
-        # Simulate price variations by store
-        store_multipliers = {
-            "walmart": 0.95,
-            "chedraui": 1.02,
-            "soriana": 1.05,
-            "costco": 0.88,
-        }
-        
         product_key = product_query.lower()
-        base_price = base_prices.get(product_key, 50.00)
-        store_multiplier = store_multipliers.get(store_id, 1.0)
+        base_price = MOCK_BASE_PRICES.get(product_key, MOCK_DEFAULT_PRICE)
+        store_multiplier = MOCK_STORE_MULTIPLIERS.get(store_id, 1.0)
         
         # Add random variation
         variation = random.uniform(0.9, 1.1)
@@ -90,6 +113,19 @@ class RealTimePriceTracker:
             "confidence": random.uniform(85, 99),
         }
 
+    def get_price_matrix(self, product_queries: List[str]):
+        """Current prices as a (products, PRICE_TRACKING_STORES) array.
+        
+        Same pricing model as get_mock_price_data, generated in one
+        vectorized draw instead of one call per (product, store).
+        """
+        import numpy as np
+        
+        base = np.array([MOCK_BASE_PRICES.get(query.lower(), MOCK_DEFAULT_PRICE) for query in product_queries])
+        multipliers = np.array([MOCK_STORE_MULTIPLIERS.get(store["id"], 1.0) for store in PRICE_TRACKING_STORES])
+        variation = np.random.default_rng().uniform(0.9, 1.1, size=(len(base), len(multipliers)))
+        return np.round(base[:, None] * multipliers * variation, 2)
+
     def process_price_results(self, results: List) -> Dict:
         """Process and organize price comparison results"""
         processed = {
@@ -120,6 +156,53 @@ class RealTimePriceTracker:
         
         return processed
     
+    def publish_price_changes(self, processed: Dict):
+        """Push changed best prices to price-stream subscribers and fire
+        the price alerts they satisfy."""
+        for product, prices in processed["products"].items():
+            if not prices:
+                continue
+            key = normalize_name(product)
+            best = min(prices, key=lambda x: x["price"])
+            if self.last_best.get(key) == (best["price"], best["store_id"]):
+                continue
+            self.last_best[key] = (best["price"], best["store_id"])
+            
+            hub.publish(product_channel(key), "price", {
+                "product": product,
+                "best_price": best["price"],
+                "store": best["store_name"],
+                "prices": [{"store_id": p["store_id"], "store_name": p["store_name"], "price": p["price"]} for p in prices],
+                "timestamp": processed["timestamp"]
+            })
+            self.check_alerts(key, prices)
+    
+    def check_alerts(self, product_key: str, prices: List[Dict]):
+        """Notify alert owners when a price drops to their target.
+        
+        An alert fires again only when the price drops further.
+        """
+        for alert in self.active_alerts.values():
+            if not alert["is_active"] or normalize_name(alert["product_name"]) != product_key:
+                continue
+            stores = {normalize_name(store) for store in alert["stores"]}
+            matching = [p for p in prices if not stores or p["store_id"] in stores or normalize_name(p["store_name"]) in stores]
+            if not matching:
+                continue
+            best = min(matching, key=lambda x: x["price"])
+            if best["price"] > alert["target_price"] or best["price"] >= alert.get("triggered_price", float("inf")):
+                continue
+            alert["triggered_price"] = best["price"]
+            hub.publish(user_channel(alert["user_id"]), "alert", {
+                "alert_id": alert["id"],
+                "product_name": alert["product_name"],
+                "target_price": alert["target_price"],
+                "current_price": best["price"],
+                "store_name": best["store_name"],
+                "alert_type": alert["alert_type"],
+                "triggered_at": datetime.now().isoformat()
+            })
+    
     def calculate_savings(self, prices: List[Dict], best_price: float) -> float:
         """Calculate savings compared to average price"""
         if len(prices) < 2:
@@ -131,9 +214,70 @@ class RealTimePriceTracker:
 # Initialize price tracker
 price_tracker = RealTimePriceTracker()
 
+def trend_from_index(product_name: str, entries: List) -> Dict:
+    """Build the /price-trends payload from weekly price index entries."""
+    import numpy as np
+    
+    price_history = [
+        {
+            "date": entry.week_start.isoformat(),
+            "price": entry.median_cents / 100,
+            "store": entry.store_name,
+            "p25": entry.p25_cents / 100,
+            "p75": entry.p75_cents / 100,
+            "sample_count": entry.sample_count
+        }
+        for entry in entries
+    ]
+    
+    # Weekly series across stores: median of the store medians
+    weeks = sorted({entry.week_start for entry in entries})
+    weekly = np.array([
+        np.median([entry.median_cents for entry in entries if entry.week_start == week])
+        for week in weeks
+    ]) / 100
+    
+    current = float(weekly[-1])
+    if len(weekly) >= 3:
+        x = np.arange(len(weekly))
+        slope, intercept = np.polyfit(x, weekly, 1)
+        fitted = slope * x + intercept
+        total_variance = float(((weekly - weekly.mean()) ** 2).sum())
+        r_squared = 1 - float(((weekly - fitted) ** 2).sum()) / total_variance if total_variance else 1.0
+        next_week = float(slope * len(weekly) + intercept)
+        confidence = 50 + 49 * max(r_squared, 0)
+    else:
+        next_week = current
+        confidence = 50.0
+    
+    trend_direction = "stable"
+    if next_week > current * 1.02:
+        trend_direction = "up"
+    elif next_week < current * 0.98:
+        trend_direction = "down"
+    
+    return {
+        "product_name": product_name,
+        "source": "price_index",
+        "price_history": price_history,
+        "current_price": round(current, 2),
+        "prediction": {
+            "next_week": round(next_week, 2),
+            "confidence": round(confidence, 1),
+            "trend": trend_direction
+        },
+        "statistics": {
+            "min_price": min(point["price"] for point in price_history),
+            "max_price": max(point["price"] for point in price_history),
+            "avg_price": round(float(weekly.mean()), 2),
+            "volatility": round(float(weekly.std() / weekly.mean()), 2) if weekly.mean() else 0.0
+        }
+    }
+
 @realtime_pricing_bp.route('/compare-prices', methods=['POST'])
 @jwt_required()
-def compare_prices():
+@admission_control('pricing')
+async def compare_prices():
     """Compare prices across multiple stores for given products"""
     try:
         data = request.get_json()
@@ -142,39 +286,26 @@ def compare_prices():
         if not products:
             return jsonify({'error': 'No products specified'}), 400
         
-        # For async operations in Flask, we need to handle differently
-        # In production, you might use Celery or similar for background tasks
+        # All (product, store) lookups run concurrently on the worker loop
+        fetched = await price_tracker.fetch_prices_async(products)
         
-        # Mock implementation for demonstration
         results = {
-            "timestamp": datetime.now().isoformat(),
-            "products": {},
+            "timestamp": fetched["timestamp"],
+            "products": fetched["products"],
             "best_deals": [],
             "total_savings": 0
         }
         
-        for product in products:
-            # Simulate fetching from multiple stores
-            store_prices = []
-            for store in PRICE_TRACKING_STORES:
-                price_data = price_tracker.get_mock_price_data(store["id"], product)
-                store_prices.append(price_data)
-            
-            results["products"][product] = store_prices
+        for deal in fetched["best_deals"]:
+            savings = deal["savings_vs_avg"]
+            results["best_deals"].append({
+                "product": deal["product"],
+                "best_price": deal["best_price"],
+                "store": deal["store"],
+                "savings": savings
+            })
             
-            # Find best deal
-            if store_prices:
-                best_price = min(store_prices, key=lambda x: x["price"])
-                savings = price_tracker.calculate_savings(store_prices, best_price["price"])
-                
-                results["best_deals"].append({
-                    "product": product,
-                    "best_price": best_price["price"],
-                    "store": best_price["store_name"],
-                    "savings": savings
-                })
-                
-                results["total_savings"] += savings
+            results["total_savings"] += savings
         
         return jsonify({
             'message': 'Price comparison completed',
@@ -184,9 +315,190 @@ def compare_prices():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def stream_events(subscription, last_id, dumps, heartbeat, max_seconds):
+    """Server-sent event stream for ``subscription``.
+    
+    Replays buffered events after ``last_id``, then waits for new ones,
+    sending a comment line every ``heartbeat`` seconds so proxies keep the
+    connection open and dead clients are noticed. After ``max_seconds``
+    the stream ends and the browser reconnects with its Last-Event-ID.
+    """
+    deadline = datetime.now() + timedelta(seconds=max_seconds)
+    try:
+        yield f"retry: 3000\n\n"
+        while datetime.now() < deadline:
+            for event_id, event, data in subscription.events_after(last_id):
+                yield format_event(event_id, event, data, dumps)
+                last_id = event_id
+            if not subscription.wait(heartbeat):
+                yield ": heartbeat\n\n"
+    finally:
+        subscription.close()
+
+@realtime_pricing_bp.route('/price-stream', methods=['GET'])
+@jwt_required(locations=['headers', 'query_string'])
+async def price_stream():
+    """Live price changes and alert triggers (text/event-stream).
+    
+    Watches the products in ``?products=`` (comma separated) and in the
+    user's active price alerts. EventSource cannot send headers, so the
+    token may also be passed as ``?jwt=``.
+    
+    With SSE_STREAM_URL set, the client is redirected to the stream server
+    (services.price_stream) with a stream ticket naming the products, and
+    no request thread is held. Otherwise the stream is served here, by one
+    request thread for its whole life, at most SSE_MAX_STREAMS per worker.
+    """
+    try:
+        user_id = get_jwt_identity()
+        products = [p.strip() for p in request.args.get('products', '').split(',') if p.strip()]
+        products += [
+            alert["product_name"] for alert in price_tracker.active_alerts.values()
+            if alert["user_id"] == user_id and alert["is_active"]
+        ]
+        keys = list(dict.fromkeys(normalize_name(product) for product in products))
+        
+        if len(keys) > MAX_STREAM_PRODUCTS:
+            return jsonify({'error': f'At most {MAX_STREAM_PRODUCTS} products per stream'}), 400
+        
+        config = current_app.config
+        last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        if config['SSE_STREAM_URL']:
+            # The ticket ends up in URLs and logs: it only opens this stream, and only for a moment
+            ticket = create_access_token(
+                identity=user_id,
+                expires_delta=timedelta(seconds=config['SSE_TICKET_SECONDS']),
+                additional_claims={'type': 'stream', 'stream_products': keys}
+            )
+            query = {'ticket': ticket, **({'last_event_id': last_id} if last_id else {})}
+            response = current_app.redirect(f"{config['SSE_STREAM_URL'].rstrip('/')}/api/price-stream?{urlencode(query)}", 307)
+            response.headers['Cache-Control'] = 'no-store'
+            return response
+        
+        if not hub.open_stream(config['SSE_MAX_STREAMS']):
+            response = jsonify({'error': 'Too many open price streams, try again later'})
+            response.headers['Retry-After'] = '30'
+            return response, 503
+        
+        subscription = hub.subscribe([user_channel(user_id)] + [product_channel(key) for key in keys])
+        response = Response(
+            stream_events(
+                subscription,
+                last_id or hub.last_event_id(),
+                current_app.json.dumps,
+                config['SSE_HEARTBEAT_SECONDS'],
+                config['SSE_MAX_STREAM_SECONDS']
+            ),
+            mimetype='text/event-stream'
+        )
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        # Also when the client goes away before the stream's first chunk
+        response.call_on_close(subscription.close)
+        response.call_on_close(hub.close_stream)
+        return response
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@realtime_pricing_bp.route('/optimize-basket', methods=['POST'])
+@jwt_required()
+@admission_control('pricing')
+async def optimize_basket_route():
+    """Cheapest store split for a whole shopping list.
+    
+    Minimizes the basket total plus ``trip_cost`` for every store beyond
+    the first, visiting at most ``max_stores`` stores.
+    """
+    try:
+        data = request.get_json()
+        items = data.get('products', [])
+        
+        if not items:
+            return jsonify({'error': 'No products specified'}), 400
+        
+        if len(items) > MAX_BASKET_ITEMS:
+            return jsonify({'error': f'At most {MAX_BASKET_ITEMS} products per basket'}), 400
+        
+        try:
+            trip_cost = float(data.get('trip_cost', DEFAULT_TRIP_COST))
+        except (TypeError, ValueError):
+            trip_cost = math.nan
+        max_stores = data.get('max_stores')
+        
+        if not math.isfinite(trip_cost) or trip_cost < 0:
+            return jsonify({'error': 'trip_cost must be a non-negative number'}), 400
+        
+        if max_stores is not None and (type(max_stores) is not int or max_stores < 1):
+            return jsonify({'error': 'max_stores must be a positive integer'}), 400
+        
+        from services.basket_optimizer import optimize_basket
+        from services.price_comparison import parse_shopping_list
+        
+        try:
+            names, quantities = parse_shopping_list(items)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'quantity must be a number'}), 400
+        
+        if not all(math.isfinite(quantity) and quantity >= 0 for quantity in quantities):
+            return jsonify({'error': 'quantity must be a non-negative number'}), 400
+        
+        # Nothing to buy on a zero-quantity line, and 0 x a missing (inf) price is NaN
+        wanted = [i for i, quantity in enumerate(quantities) if quantity > 0]
+        if not wanted:
+            return jsonify({'error': 'No products specified'}), 400
+        names, quantities = [names[i] for i in wanted], quantities[wanted]
+        
+        prices = price_tracker.get_price_matrix(names)
+        plan = await asyncio.to_thread(optimize_basket, prices, quantities, trip_cost=trip_cost, max_stores=max_stores)
+        
+        stores = PRICE_TRACKING_STORES
+        price_rows = prices.tolist()
+        quantities = quantities.tolist()
+        
+        result = {
+            "timestamp": datetime.now().isoformat(),
+            "stores": [
+                {
+                    "store_id": stores[j]["id"],
+                    "store_name": stores[j]["name"],
+                    "items": [
+                        {
+                            "product": names[i],
+                            "quantity": quantities[i],
+                            "price": price_rows[i][j],
+                            "line_total": round(price_rows[i][j] * quantities[i], 2)
+                        }
+                        for i in range(len(names)) if plan['assignment'][i] == j
+                    ]
+                }
+                for j in plan['stores']
+            ],
+            "items_cost": plan['items_cost'],
+            "trip_cost": plan['trip_cost'],
+            "total_cost": plan['total_cost'],
+            "best_single_store": {
+                "store_name": stores[plan['best_single_store']]["name"],
+                "total_cost": plan['best_single_store_cost']
+            },
+            "savings_vs_single_store": round(plan['best_single_store_cost'] - plan['total_cost'], 2),
+            "method": plan['method']
+        }
+        
+        for store in result["stores"]:
+            store["subtotal"] = round(sum(item["line_total"] for item in store["items"]), 2)
+        
+        return jsonify({
+            'message': 'Basket optimized successfully',
+            'data': result
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @realtime_pricing_bp.route('/price-alerts', methods=['GET'])
 @jwt_required()
-def get_price_alerts():
+async def get_price_alerts():
     """Get active price alerts for user"""
     try:
         user_id = get_jwt_identity()
@@ -227,7 +539,7 @@ def get_price_alerts():
 
 @realtime_pricing_bp.route('/price-alerts', methods=['POST'])
 @jwt_required()
-def create_price_alert():
+async def create_price_alert():
     """Create a new price alert"""
     try:
         user_id = get_jwt_identity()
@@ -261,9 +573,22 @@ def create_price_alert():
 
 @realtime_pricing_bp.route('/price-trends/<product_name>', methods=['GET'])
 @jwt_required()
-def get_price_trends(product_name):
-    """Get price trend data for a specific product"""
+@admission_control('pricing')
+async def get_price_trends(product_name):
+    """Get price trend data for a specific product
+    
+    Served from the crowd-sourced price index when it has data for the
+    product; otherwise simulated.
+    """
     try:
+        from services.price_index import price_trend
+        entries = await asyncio.to_thread(price_trend, product_name)
+        if entries:
+            return jsonify({
+                'message': 'Price trends retrieved successfully',
+                'data': trend_from_index(product_name, entries)
+            }), 200
+        
         # Mock trend data
         import random
         from datetime import datetime, timedelta
@@ -296,6 +621,7 @@ def get_price_trends(product_name):
         
         result = {
             "product_name": product_name,
+            "source": "simulated",
             "price_history": price_history,
             "current_price": price_history[-1]["price"],
             "prediction": {
@@ -321,7 +647,8 @@ def get_price_trends(product_name):
 
 @realtime_pricing_bp.route('/ml-predictions', methods=['GET'])
 @jwt_required()
-def get_ml_predictions():
+@admission_control('pricing')
+async def get_ml_predictions():
     """Get ML-powered price predictions for user's frequent products"""
     try:
         user_id = get_jwt_identity()
@@ -1,21 +1,37 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import Receipt, ReceiptItem, db
+from models import Receipt, db, bump_data_version, user_scope
+from models.archive import has_archive, delete_archived_receipt
+from models.search import search_items as find_items, SORTS as SEARCH_SORTS
+from models.serializers import serialize_receipts, iter_receipts, serialize_item_matches
+from models.stores import directory
+from services.jobs import enqueue
+from services.receipt_ingest import (
+    create_receipt as ingest_receipt, import_receipts as import_receipt_batch, parse_receipt,
+    IdempotencyKeyReused, MAX_IMPORT_RECEIPTS
+)
+from services.purge import delete_receipts as delete_receipt_range
+from services.receipt_scanner import scan_receipt_image
+from utils.http_cache import conditional, current_user_scope
+from utils.admission import admission_control
+from utils.streaming import json_list_response
 from datetime import datetime
+from sqlalchemy import delete
 import json
 
 receipts_bp = Blueprint('receipts', __name__)
 
+MAX_SEARCH_RESULTS = 100
+
 @receipts_bp.route('/', methods=['GET'])
 @jwt_required()
+@conditional(current_user_scope)
 def get_receipts():
     try:
         user_id = get_jwt_identity()
-        receipts = Receipt.query.filter_by(user_id=user_id).order_by(Receipt.purchase_date.desc()).all()
         
-        return jsonify({
-            'receipts': [receipt.to_dict() for receipt in receipts]
-        }), 200
+        # Streamed: a user's full history can be large
+        return json_list_response('receipts', iter_receipts(user_id)), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -23,54 +39,163 @@ def get_receipts():
 @receipts_bp.route('/', methods=['POST'])
 @jwt_required()
 def create_receipt():
+    """Create a receipt.
+    
+    Resubmitting a receipt (same store, purchase time, total and items) or
+    reusing an ``Idempotency-Key`` returns the original receipt with 200
+    instead of creating a duplicate.
+    """
     try:
         user_id = get_jwt_identity()
         data = request.get_json()
         
-        receipt = Receipt(
-            user_id=user_id,
-            store_name=data['store_name'],
-            total_amount=data['total_amount'],
-            purchase_date=datetime.fromisoformat(data['purchase_date'].replace('Z', '+00:00'))
-        )
-        
-        db.session.add(receipt)
-        db.session.flush()  # To get the receipt ID
-        
-        # Add items
-        for item_data in data.get('items', []):
-            item = ReceiptItem(
-                receipt_id=receipt.id,
-                product_name=item_data['product_name'],
-                quantity=item_data.get('quantity', 1),
-                unit_price=item_data['unit_price'],
-                total_price=item_data['total_price'],
-                category=item_data.get('category', 'Other')
-            )
-            db.session.add(item)
+        receipt, created = ingest_receipt(user_id, data, request.headers.get('Idempotency-Key'))
         
-        db.session.commit()
+        if not created:
+            return jsonify({
+                'message': 'Receipt already exists',
+                'receipt': receipt
+            }), 200
         
         return jsonify({
             'message': 'Receipt created successfully',
-            'receipt': receipt.to_dict()
+            'receipt': receipt
         }), 201
         
+    except IdempotencyKeyReused as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 422
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@receipts_bp.route('/bulk', methods=['POST'])
+@jwt_required()
+def import_receipts():
+    """Create up to ``MAX_IMPORT_RECEIPTS`` receipts in one request.
+    
+    Receipts the user already has are skipped, so an import can be re-run:
+    every entry of ``results`` carries the receipt id and whether it was
+    ``created`` or a ``duplicate``.
+    """
+    try:
+        user_id = get_jwt_identity()
+        payloads = (request.get_json(silent=True) or {}).get('receipts')
+        
+        if not isinstance(payloads, list):
+            return jsonify({'error': 'Expected a "receipts" list'}), 400
+        if len(payloads) > MAX_IMPORT_RECEIPTS:
+            return jsonify({'error': f'At most {MAX_IMPORT_RECEIPTS} receipts per request'}), 400
+        for index, data in enumerate(payloads):
+            try:
+                parse_receipt(data)
+            except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+                return jsonify({'error': f'Invalid receipt at index {index}: {e!r}'}), 400
+        
+        results = import_receipt_batch(user_id, payloads)
+        created = sum(1 for result in results if result['status'] == 'created')
+        
+        return jsonify({
+            'message': f'Imported {created} receipts',
+            'created': created,
+            'duplicates': len(results) - created,
+            'results': results
+        }), 200
+        
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@receipts_bp.route('/', methods=['DELETE'])
+@jwt_required()
+def delete_receipts():
+    """Delete the receipts purchased from ``since`` up to, not including,
+    ``until`` (ISO dates in the JSON body; at least one is required).
+    
+    Receipts are deleted in chunks, each in its own transaction.
+    """
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json(silent=True) or {}
+        
+        bounds = {}
+        for name in ('since', 'until'):
+            if data.get(name):
+                try:
+                    bounds[name] = datetime.fromisoformat(data[name].replace('Z', '+00:00')).replace(tzinfo=None)
+                except (TypeError, ValueError, AttributeError):
+                    return jsonify({'error': f'Invalid {name} date'}), 400
+        if not bounds:
+            return jsonify({'error': 'Give since and/or until'}), 400
+        
+        deleted = delete_receipt_range(user_id, **bounds)
+        
+        return jsonify({
+            'message': f'Deleted {deleted} receipts',
+            'deleted': deleted
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@receipts_bp.route('/items/search', methods=['GET'])
+@jwt_required()
+@conditional(current_user_scope)
+def search_items():
+    """Search the user's receipt items by name.
+    
+    ``q`` matches items containing every word (as a prefix); ``store``
+    limits results to one store. Results are ranked by relevance, most
+    recent purchase first among equals (``sort=recent``: newest first),
+    and paginated with ``limit``/``offset``; ``next_offset`` is null on
+    the last page.
+    
+    Only receipts in the hot tables are searched, not archived ones
+    (``models.archive``); ``archived_excluded`` is true when the user has
+    an archive, so older purchases may be missing from the results.
+    """
+    try:
+        user_id = get_jwt_identity()
+        query = request.args.get('q', '')
+        limit = min(max(request.args.get('limit', 20, type=int), 1), MAX_SEARCH_RESULTS)
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        sort = request.args.get('sort', 'relevance')
+        
+        if not query.strip():
+            return jsonify({'error': 'q is required'}), 400
+        if sort not in SEARCH_SORTS:
+            return jsonify({'error': f"sort must be one of {', '.join(SEARCH_SORTS)}"}), 400
+        
+        archived_excluded = has_archive(user_id)
+        store_id = None
+        if request.args.get('store'):
+            store_id = directory().find(request.args['store'])
+            if store_id is None:
+                return jsonify({'items': [], 'next_offset': None, 'archived_excluded': archived_excluded}), 200
+        
+        matches = find_items(user_id, query, limit=limit + 1, offset=offset, sort=sort, store_id=store_id)
+        return jsonify({
+            'items': serialize_item_matches(matches[:limit]),
+            'next_offset': offset + limit if len(matches) > limit else None,
+            'archived_excluded': archived_excluded
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @receipts_bp.route('/<int:receipt_id>', methods=['GET'])
 @jwt_required()
+@conditional(current_user_scope)
 def get_receipt(receipt_id):
     try:
         user_id = get_jwt_identity()
-        receipt = Receipt.query.filter_by(id=receipt_id, user_id=user_id).first()
+        receipts = serialize_receipts(user_id, receipt_id=receipt_id)
         
-        if not receipt:
+        if not receipts:
             return jsonify({'error': 'Receipt not found'}), 404
         
-        return jsonify({'receipt': receipt.to_dict()}), 200
+        return jsonify({'receipt': receipts[0]}), 200
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -80,12 +205,13 @@ def get_receipt(receipt_id):
 def delete_receipt(receipt_id):
     try:
         user_id = get_jwt_identity()
-        receipt = Receipt.query.filter_by(id=receipt_id, user_id=user_id).first()
+        # Items go with the receipt through ON DELETE CASCADE
+        result = db.session.execute(delete(Receipt).where(Receipt.id == receipt_id, Receipt.user_id == user_id))
         
-        if not receipt:
+        if result.rowcount == 0 and not (has_archive(user_id) and delete_archived_receipt(user_id, receipt_id)):
             return jsonify({'error': 'Receipt not found'}), 404
         
-        db.session.delete(receipt)
+        bump_data_version(user_scope(user_id))
         db.session.commit()
         
         return jsonify({'message': 'Receipt deleted successfully'}), 200
@@ -95,38 +221,28 @@ def delete_receipt(receipt_id):
 
 @receipts_bp.route('/scan', methods=['POST'])
 @jwt_required()
+@admission_control('scan')
 def scan_receipt():
-    """Mock receipt scanning endpoint - in production this would use OCR"""
+    """Scan a receipt image.
+    
+    With ``?async=true`` the scan is queued as a background job and the
+    job is returned (202); poll ``/api/jobs/<id>`` for the result.
+    """
     try:
-        # This is a mock implementation - replace with actual OCR logic
-        mock_receipt_data = {
-            'store_name': 'SuperMart',
-            'total_amount': 45.67,
-            'purchase_date': datetime.now().isoformat(),
-            'items': [
-                {
-                    'product_name': 'Organic Bananas',
-                    'quantity': 2,
-                    'unit_price': 1.99,
-                    'total_price': 3.98,
-                    'category': 'Fruits'
-                },
-                {
-                    'product_name': 'Whole Milk',
-                    'quantity': 1,
-                    'unit_price': 4.50,
-                    'total_price': 4.50,
-                    'category': 'Dairy'
-                },
-                {
-                    'product_name': 'Chicken Breast',
-                    'quantity': 1,
-                    'unit_price': 12.99,
-                    'total_price': 12.99,
-                    'category': 'Meat'
-                }
-            ]
-        }
+        if request.args.get('async', '').lower() in ('1', 'true'):
+            data = request.get_json(silent=True) or {}
+            job, created = enqueue(
+                'scan_receipt',
+                {'image': data.get('image')},
+                user_id=get_jwt_identity(),
+                idempotency_key=request.headers.get('Idempotency-Key')
+            )
+            return jsonify({
+                'message': 'Receipt scan queued',
+                'job': job.to_dict()
+            }), 202 if created else 200
+        
+        mock_receipt_data = scan_receipt_image()
         
         return jsonify({
             'message': 'Receipt scanned successfully',
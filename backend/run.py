@@ -1,6 +1,7 @@
-from app import create_app
+from app import create_app, init_database
 
 app = create_app()
 
 if __name__ == '__main__':
+    init_database(app)
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,18 @@
+"""Async price stream server: ``python run_stream.py [--host HOST] [--port PORT]``."""
+import argparse
+
+from app import create_app
+from services.price_stream import run_stream_server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve /api/price-stream from an event loop.')
+    parser.add_argument('--host', default='0.0.0.0', help='Interface to listen on.')
+    parser.add_argument('--port', type=int, default=None, help='Port (default: SSE_STREAM_PORT).')
+    args = parser.parse_args()
+
+    run_stream_server(create_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+"""Background job worker: ``python run_worker.py [--processes N] [--once]``."""
+import argparse
+
+from app import create_app
+from services.jobs import run_worker
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run queued background jobs.')
+    parser.add_argument('--processes', type=int, default=None, help='Worker processes (default: JOB_WORKER_PROCESSES).')
+    parser.add_argument('--poll-interval', type=float, default=None, help='Seconds between queue polls when idle.')
+    parser.add_argument('--once', action='store_true', help='Exit once the queue is empty.')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        run_worker(processes=args.processes, poll_interval=args.poll_interval, once=args.once)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""Payload builders for the analytics and budget summary endpoints.
+
+Each section of the dashboard is an accumulator: rows are fed to ``add``
+one at a time and ``payload`` returns the same body the section's own
+endpoint serves. The endpoints and the batched dashboard share these, so
+the dashboard can feed one receipt scan and one item rollup to every
+section that needs it instead of querying once per section.
+"""
+from datetime import datetime, timedelta
+
+from models.rows import receipt_summaries, product_rollups, budget_snapshots, budget_totals, begin_read_snapshot
+from models.serializers import budget_row
+from models.stores import directory, store_names
+from utils.money import from_cents
+
+
+class SpendingTrends:
+    """Spending per month over the last 12 months."""
+
+    def __init__(self, now):
+        self.end = now
+        self.start = now - timedelta(days=365)
+        self.monthly_cents = {}
+
+    def add(self, receipt):
+        if not self.start <= receipt.purchase_date <= self.end:
+            return
+        month_key = receipt.purchase_date.strftime('%Y-%m')
+        self.monthly_cents[month_key] = self.monthly_cents.get(month_key, 0) + receipt.total_amount_cents
+
+    def payload(self):
+        total_cents = sum(self.monthly_cents.values())
+        return {
+            'monthly_spending': {month: from_cents(cents) for month, cents in self.monthly_cents.items()},
+            'total_spending': from_cents(total_cents),
+            'average_monthly': from_cents(total_cents) / max(len(self.monthly_cents), 1)
+        }
+
+
+class ShoppingPatterns:
+    """Receipt counts per weekday, hour and store."""
+
+    def __init__(self):
+        self.day_of_week = {}
+        self.hour_of_day = {}
+        self.store_frequency = {}
+
+    def add(self, receipt):
+        day = receipt.purchase_date.strftime('%A')
+        self.day_of_week[day] = self.day_of_week.get(day, 0) + 1
+
+        hour = receipt.purchase_date.hour
+        self.hour_of_day[hour] = self.hour_of_day.get(hour, 0) + 1
+
+        self.store_frequency[receipt.store_id] = self.store_frequency.get(receipt.store_id, 0) + 1
+
+    def payload(self):
+        names = store_names(self.store_frequency)
+        store_frequency = {}
+        for store_id, count in self.store_frequency.items():
+            name = names.get(store_id)
+            store_frequency[name] = store_frequency.get(name, 0) + count
+        return {
+            'day_of_week_patterns': self.day_of_week,
+            'hour_of_day_patterns': self.hour_of_day,
+            'favorite_stores': dict(sorted(store_frequency.items(), key=lambda x: x[1], reverse=True)[:5])
+        }
+
+
+class StoreSpend:
+    """Spend and receipt count per store, with the price tracker's id for
+    stores whose prices are tracked (highest spend first)."""
+
+    def __init__(self):
+        self.totals = {}
+
+    def add(self, receipt):
+        spent, count = self.totals.get(receipt.store_id, (0, 0))
+        self.totals[receipt.store_id] = (spent + receipt.total_amount_cents, count + 1)
+
+    def payload(self):
+        stores = directory()
+        rows = []
+        for store_id, (spent, count) in sorted(self.totals.items(), key=lambda item: item[1][0], reverse=True):
+            name, _, tracker_id = stores.get(store_id) or (None, None, None)
+            rows.append({
+                'store_id': store_id,
+                'store_name': name,
+                'tracker_id': tracker_id,
+                'total_spent': from_cents(spent),
+                'receipt_count': count
+            })
+        return {'stores': rows}
+
+
+class CategoryBreakdown:
+    """Spend and item count per category (uncategorized items first)."""
+
+    def __init__(self):
+        self.totals = {}
+
+    def add(self, category, total_spent_cents, item_count):
+        spent, count = self.totals.get(category, (0, 0))
+        self.totals[category] = (spent + total_spent_cents, count + item_count)
+
+    def payload(self):
+        categories = []
+        for category in sorted(self.totals, key=lambda c: (c is not None, c or '')):
+            total_spent, item_count = self.totals[category]
+            categories.append({
+                'category': category or 'Other',
+                'total_spent': from_cents(total_spent),
+                'item_count': item_count
+            })
+        return {'categories': categories}
+
+
+class TopProducts:
+    """The ``limit`` products with the highest total spend."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.totals = {}
+
+    def add(self, product_name, total_spent_cents, total_quantity, purchase_frequency):
+        spent, quantity, frequency = self.totals.get(product_name, (0, 0, 0))
+        self.totals[product_name] = (
+            spent + total_spent_cents, quantity + total_quantity, frequency + purchase_frequency
+        )
+
+    def payload(self):
+        ranked = sorted(self.totals.items(), key=lambda item: item[1][0], reverse=True)
+        products = []
+        for product_name, (total_spent, total_quantity, frequency) in ranked[:max(self.limit, 0)]:
+            products.append({
+                'product_name': product_name,
+                'total_spent': from_cents(total_spent),
+                'total_quantity': int(total_quantity),
+                'purchase_frequency': frequency,
+                'average_price': from_cents(total_spent) / max(int(total_quantity), 1)
+            })
+        return {'top_products': products}
+
+
+class SustainabilityScore:
+    """Share of organic and locally sourced items.
+
+    Mock sustainability analysis - in production this would use real data.
+    """
+
+    def __init__(self):
+        self.total_items = self.organic_items = self.local_items = 0
+
+    def add(self, product_name, item_count):
+        name = product_name.lower()
+        self.total_items += item_count
+        if 'organic' in name:
+            self.organic_items += item_count
+        if any(keyword in name for keyword in ['local', 'farm']):
+            self.local_items += item_count
+
+    def payload(self):
+        sustainability_score = 0
+        organic_percentage = local_percentage = 0
+        if self.total_items > 0:
+            organic_percentage = self.organic_items / self.total_items * 100
+            local_percentage = self.local_items / self.total_items * 100
+            sustainability_score = min((organic_percentage + local_percentage) / 2, 100)
+
+        recommendations = []
+        if organic_percentage < 20:
+            recommendations.append("Try buying more organic products to reduce environmental impact")
+        if local_percentage < 15:
+            recommendations.append("Consider purchasing more locally sourced items to support local farmers")
+
+        return {
+            'sustainability_score': round(sustainability_score, 1),
+            'organic_percentage': round(organic_percentage, 1),
+            'local_percentage': round(local_percentage, 1),
+            'recommendations': recommendations
+        }
+
+
+def budget_analysis(budgets, now):
+    analysis = []
+    for budget in budgets:
+        total_budget = from_cents(budget.total_budget_cents)
+        spent_amount = from_cents(budget.spent_amount_cents)
+        utilization = (spent_amount / total_budget * 100) if total_budget > 0 else 0
+        remaining_days = (budget.end_date - now).days
+
+        status = 'on_track'
+        if utilization > 90:
+            status = 'over_budget'
+        elif utilization > 75:
+            status = 'warning'
+
+        analysis.append({
+            'budget': budget_row(budget),
+            'utilization_percentage': utilization,
+            'remaining_days': max(remaining_days, 0),
+            'status': status,
+            'daily_budget_remaining': (total_budget - spent_amount) / remaining_days if remaining_days > 0 else 0
+        })
+    return {'budget_analysis': analysis}
+
+
+def budget_summary(totals):
+    total_allocated = from_cents(totals.allocated_cents)
+    total_spent = from_cents(totals.spent_cents)
+    return {
+        'summary': {
+            'total_budgets': totals.total_budgets,
+            'active_budgets': totals.active_budgets,
+            'total_allocated': total_allocated,
+            'total_spent': total_spent,
+            'total_remaining': from_cents(totals.allocated_cents - totals.spent_cents),
+            'budget_utilization': (total_spent / total_allocated * 100) if total_allocated > 0 else 0
+        }
+    }
+
+
+RECEIPT_SECTIONS = ('spending_trends', 'shopping_patterns', 'store_spend')
+ITEM_SECTIONS = ('category_breakdown', 'top_products', 'sustainability_score')
+BUDGET_SECTIONS = ('budget_analysis', 'budget_summary')
+DASHBOARD_SECTIONS = RECEIPT_SECTIONS + ITEM_SECTIONS + BUDGET_SECTIONS
+
+
+def dashboard(user_id, sections=DASHBOARD_SECTIONS, top_products_limit=10, now=None):
+    """Build the requested sections from one consistent read of the user's data.
+
+    Everything is read in one snapshot: a receipt scan for the receipt
+    sections, a (product, category) rollup for the item sections, the
+    user's budget list for budget analysis and the indexed count/sum
+    aggregates of /api/budget/summary for the budget summary.
+    """
+    now = now or datetime.now()
+    begin_read_snapshot()
+    payloads = {}
+
+    receipt_accumulators = {}
+    if 'spending_trends' in sections:
+        receipt_accumulators['spending_trends'] = SpendingTrends(now)
+    if 'shopping_patterns' in sections:
+        receipt_accumulators['shopping_patterns'] = ShoppingPatterns()
+    if 'store_spend' in sections:
+        receipt_accumulators['store_spend'] = StoreSpend()
+    if receipt_accumulators:
+        if 'spending_trends' not in receipt_accumulators or len(receipt_accumulators) > 1:
+            receipts = receipt_summaries(user_id)
+        else:
+            trends = receipt_accumulators['spending_trends']
+            receipts = receipt_summaries(user_id, since=trends.start, until=trends.end)
+        adders = [accumulator.add for accumulator in receipt_accumulators.values()]
+        for receipt in receipts:
+            for add in adders:
+                add(receipt)
+        payloads.update((name, accumulator.payload()) for name, accumulator in receipt_accumulators.items())
+
+    if any(section in sections for section in ITEM_SECTIONS):
+        categories = CategoryBreakdown()
+        products = TopProducts(top_products_limit)
+        sustainability = SustainabilityScore()
+        for rollup in product_rollups(user_id):
+            categories.add(rollup.category, rollup.total_spent_cents, rollup.item_count)
+            products.add(rollup.product_name, rollup.total_spent_cents, rollup.total_quantity, rollup.item_count)
+            sustainability.add(rollup.product_name, rollup.item_count)
+        for name, accumulator in (('category_breakdown', categories), ('top_products', products),
+                                  ('sustainability_score', sustainability)):
+            if name in sections:
+                payloads[name] = accumulator.payload()
+
+    if 'budget_analysis' in sections:
+        payloads['budget_analysis'] = budget_analysis(budget_snapshots(user_id), now)
+    if 'budget_summary' in sections:
+        payloads['budget_summary'] = budget_summary(budget_totals(user_id, now))
+
+    return payloads
@@ -0,0 +1,129 @@
+"""Cheapest way to buy a whole shopping list across several stores.
+
+Given an ``(items, stores)`` price matrix, pick the set of stores that
+minimizes
+
+    sum(quantity * cheapest price among the chosen stores)
+    + trip_cost * (number of chosen stores - 1)
+
+subject to using at most ``max_stores`` stores. Every item is then bought
+at the cheapest of the chosen stores.
+
+For up to ``EXACT_MAX_STORES`` stores every subset is evaluated with a
+bitmask DP: each subset's per-item minimum is the element-wise minimum of
+the subset without its lowest store and that store's column, so each
+subset costs one vectorized ``np.minimum``. Larger store counts use a
+greedy construction followed by 1-swap local search.
+"""
+import numpy as np
+
+EXACT_MAX_STORES = 12
+EXACT_MAX_CELLS = 4_000_000
+
+
+def _subset_cost(line_costs, stores, trip_cost):
+    return float(line_costs[:, stores].min(axis=1).sum()) + trip_cost * (len(stores) - 1)
+
+
+def _exact(line_costs, trip_cost, max_stores):
+    n, m = line_costs.shape
+    size = 1 << m
+    popcount = np.zeros(size, dtype=np.int64)
+    mins = np.full((size, n), np.inf)
+    costs = np.full(size, np.inf)
+
+    for mask in range(1, size):
+        low = mask & -mask
+        rest = mask ^ low
+        popcount[mask] = popcount[rest] + 1
+        if popcount[mask] > max_stores:
+            continue
+        np.minimum(mins[rest], line_costs[:, low.bit_length() - 1], out=mins[mask])
+        costs[mask] = mins[mask].sum() + trip_cost * (popcount[mask] - 1)
+
+    best = int(costs.argmin())
+    return [j for j in range(m) if best >> j & 1]
+
+
+def _greedy(line_costs, trip_cost, max_stores):
+    n, m = line_costs.shape
+    selected = []
+    current = np.full(n, np.inf)
+    cost = np.inf
+
+    while len(selected) < max_stores:
+        candidates = np.minimum(current[:, None], line_costs)
+        totals = candidates.sum(axis=0) + trip_cost * len(selected)
+        totals[selected] = np.inf
+        j = int(totals.argmin())
+        if totals[j] >= cost:
+            break
+        selected.append(j)
+        current = candidates[:, j]
+        cost = float(totals[j])
+
+    improved = True
+    while improved:
+        improved = False
+        for position in range(len(selected)):
+            for j in range(m):
+                if j in selected:
+                    continue
+                trial = selected[:position] + [j] + selected[position + 1:]
+                trial_cost = _subset_cost(line_costs, trial, trip_cost)
+                if trial_cost < cost - 1e-9:
+                    selected, cost, improved = trial, trial_cost, True
+
+    return sorted(selected)
+
+
+def optimize_basket(prices, quantities, trip_cost=0.0, max_stores=None):
+    """Choose stores for a basket.
+
+    ``prices`` is an ``(items, stores)`` array; use ``np.inf`` where a
+    store does not carry an item. Items no store carries are reported in
+    ``unavailable`` and left out of the optimization.
+
+    Returns a dict with the chosen store indices, the store index each
+    item is bought at (-1 for unavailable items), the cost breakdown and
+    the solver that was used.
+    """
+    prices = np.asarray(prices, dtype=float)
+    quantities = np.asarray(quantities, dtype=float)
+    n, m = prices.shape
+    max_stores = m if max_stores is None else max(1, min(int(max_stores), m))
+
+    available = np.isfinite(prices).any(axis=1)
+    line_costs = prices[available] * quantities[available, None]
+
+    if m <= EXACT_MAX_STORES and (1 << m) * max(len(line_costs), 1) <= EXACT_MAX_CELLS:
+        stores, method = _exact(line_costs, trip_cost, max_stores), 'exact'
+    else:
+        stores, method = _greedy(line_costs, trip_cost, max_stores), 'greedy'
+
+    assignment = np.full(n, -1, dtype=np.int64)
+    chosen = np.asarray(stores)
+    assignment[available] = chosen[line_costs[:, chosen].argmin(axis=1)]
+
+    items_cost = float(line_costs[:, chosen].min(axis=1).sum()) if len(line_costs) else 0.0
+    trip = trip_cost * (len(stores) - 1)
+
+    # Reference points: cheapest single store and buying every item at its
+    # cheapest store regardless of how many trips that takes.
+    single_store_costs = line_costs.sum(axis=0) if len(line_costs) else np.zeros(m)
+    independent_stores = np.unique(line_costs.argmin(axis=1)) if len(line_costs) else []
+
+    return {
+        'stores': stores,
+        'assignment': assignment.tolist(),
+        'unavailable': np.flatnonzero(~available).tolist(),
+        'items_cost': round(items_cost, 2),
+        'trip_cost': round(trip, 2),
+        'total_cost': round(items_cost + trip, 2),
+        'best_single_store': int(single_store_costs.argmin()),
+        'best_single_store_cost': round(float(single_store_costs.min()), 2),
+        'independent_best_cost': round(
+            float(line_costs.min(axis=1).sum()) + trip_cost * max(len(independent_stores) - 1, 0), 2
+        ) if len(line_costs) else 0.0,
+        'method': method
+    }
@@ -0,0 +1,123 @@
+"""Calendar-correct budget periods and the recurring-budget rollover job.
+
+Periods are computed from the recurrence anchor (the start of the first
+period), never by adding to the previous period, so a monthly budget that
+starts on Jan 31 runs Jan 31 - Feb 29 - Mar 31 - Apr 30 instead of
+drifting to the 28th/29th.
+"""
+from calendar import monthrange
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, insert
+
+from models import Budget, db, bump_data_version, user_scope
+from utils.sharding import shard_ids, using_shard
+
+PERIODS = ('weekly', 'monthly', 'yearly')
+
+
+def add_months(value, months):
+    year, month = divmod(value.month - 1 + months, 12)
+    year += value.year
+    day = min(value.day, monthrange(year, month + 1)[1])
+    return value.replace(year=year, month=month + 1, day=day)
+
+
+def period_boundary(anchor, period, index, duration=None):
+    """Start of the ``index``-th period of a series anchored at ``anchor``.
+
+    ``duration`` is the fixed length used for custom periods.
+    """
+    if period == 'weekly':
+        return anchor + timedelta(weeks=index)
+    if period == 'monthly':
+        return add_months(anchor, index)
+    if period == 'yearly':
+        return add_months(anchor, 12 * index)
+    return anchor + duration * index
+
+
+def next_period(anchor, period, previous_end, now, duration=None):
+    """Bounds of the first period that starts at or after ``previous_end``
+    and has not ended by ``now`` (missed periods are skipped)."""
+    index = 1
+    while period_boundary(anchor, period, index, duration) < previous_end:
+        index += 1
+    while period_boundary(anchor, period, index + 1, duration) <= now:
+        index += 1
+    return (
+        period_boundary(anchor, period, index, duration),
+        period_boundary(anchor, period, index + 1, duration)
+    )
+
+
+def rollover_budgets(now=None, batch_size=1000):
+    """Create the next period for every recurring budget that has ended.
+
+    Due budgets are read in batches through the rollover index; each batch
+    is written with one bulk INSERT of the new periods and one UPDATE that
+    marks the old ones as rolled over. Shards are processed one after the
+    other. Returns the number of budgets created.
+    """
+    now = now or datetime.now()
+    created = 0
+    for shard in shard_ids():
+        with using_shard(shard):
+            created += _rollover_shard(now, batch_size)
+    return created
+
+
+def _rollover_shard(now, batch_size):
+    created = 0
+
+    while True:
+        due = db.session.execute(
+            select(
+                Budget.id, Budget.user_id, Budget.name, Budget.total_budget_cents,
+                Budget.currency, Budget.category, Budget.period,
+                Budget.start_date, Budget.end_date, Budget.recurrence_anchor
+            ).where(
+                Budget.is_recurring.is_(True),
+                Budget.rolled_over.is_(False),
+                Budget.end_date <= now
+            ).order_by(Budget.id).limit(batch_size)
+        ).all()
+
+        if not due:
+            break
+
+        new_budgets = []
+        for (id, user_id, name, total_budget_cents, currency, category,
+             period, start_date, end_date, anchor) in due:
+            anchor = anchor or start_date
+            duration = None if period in PERIODS else end_date - start_date
+            start, end = next_period(anchor, period, end_date, now, duration)
+            new_budgets.append({
+                'user_id': user_id,
+                'name': name,
+                'total_budget_cents': total_budget_cents,
+                'spent_amount_cents': 0,
+                'currency': currency,
+                'category': category,
+                'period': period,
+                'start_date': start,
+                'end_date': end,
+                'is_recurring': True,
+                'recurrence_anchor': anchor,
+                'rolled_over': False,
+                'created_at': now
+            })
+
+        db.session.execute(insert(Budget), new_budgets)
+        db.session.execute(
+            update(Budget)
+            .where(Budget.id.in_([row.id for row in due]))
+            .values(rolled_over=True)
+        )
+        for user_id in {row.user_id for row in due}:
+            bump_data_version(user_scope(user_id))
+        db.session.commit()
+
+        created += len(new_budgets)
+
+    return created
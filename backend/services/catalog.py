@@ -0,0 +1,71 @@
+"""Per-worker cache of product counts and categories.
+
+Entries are keyed by the ``catalog`` data version, which every product
+write bumps, so a cached COUNT(*) or DISTINCT category list is reused
+until the catalog actually changes. Counts with a free-text search are
+not cached (see routes.products). Checking the version is a single
+primary-key lookup.
+"""
+from threading import Lock
+
+from sqlalchemy import select, func
+from models import Product, db, get_data_version, CATALOG_SCOPE
+
+
+class CatalogCache:
+    def __init__(self):
+        self._lock = Lock()
+        self._version = None
+        self._counts = {}
+        self._categories = None
+
+    def _sync(self):
+        version = get_data_version(CATALOG_SCOPE)
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                self._counts = {}
+                self._categories = None
+
+    def count(self, category=None):
+        """Number of products in ``category`` (None: every product).
+
+        Only the catalog's own categories are cached, so the cache is
+        bounded by the catalog rather than by what clients ask for; an
+        unknown category has no products.
+        """
+        self._sync()
+        if category is not None and category not in self.categories():
+            return 0
+        with self._lock:
+            version, total = self._version, self._counts.get(category)
+        if total is None:
+            query = select(func.count(Product.id))
+            if category is not None:
+                query = query.where(Product.category == category)
+            total = db.session.execute(query).scalar()
+            with self._lock:
+                if self._version == version:
+                    self._counts[category] = total
+        return total
+
+    def categories(self):
+        self._sync()
+        with self._lock:
+            version, categories = self._version, self._categories
+        if categories is None:
+            rows = db.session.execute(
+                select(Product.category).where(Product.category.isnot(None)).distinct()
+            )
+            categories = sorted(category for category, in rows if category)
+            with self._lock:
+                if self._version == version:
+                    self._categories = categories
+        return categories
+
+    def invalidate(self):
+        with self._lock:
+            self._version = None
+
+
+catalog_cache = CatalogCache()
@@ -0,0 +1,324 @@
+"""Streaming import of store catalog dumps into the product table.
+
+Catalogs are CSV or NDJSON, optionally gzip-compressed (detected from the
+data), with one product per row: ``name`` (required), ``category``,
+``price``, ``currency``, ``store`` and ``observed_at``. They are read as
+a stream and written in batches of ``CATALOG_IMPORT_BATCH_SIZE`` rows,
+one transaction each, so memory use does not grow with the dump.
+
+Products are matched on (normalized name, category) and written with one
+``INSERT ... ON CONFLICT DO UPDATE`` per batch: new products are created,
+and a known product's ``average_price`` is folded into a running mean
+over ``price_count`` prices. Each priced row is also appended to
+``product_price_observation`` with its store, instead of rewriting the
+product's legacy ``price_history`` JSON.
+"""
+import csv
+import gzip
+import io
+import json
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import select, update, insert, bindparam, case, func, table, column, DateTime
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import Product, ProductPriceObservation, db, bump_data_version, CATALOG_SCOPE
+from models.stores import resolve_store_id
+from utils.money import DEFAULT_CURRENCY, to_cents
+from utils.text import normalize_name
+
+FORMATS = ('csv', 'ndjson')
+DEFAULT_CATEGORY = 'Other'
+MAX_REPORTED_ERRORS = 20
+BACKFILL_BATCH_SIZE = 5000
+
+_UPSERT_DIALECTS = {'sqlite': sqlite, 'postgresql': postgresql}
+
+
+class CatalogFormatError(ValueError):
+    pass
+
+
+def catalog_format(filename):
+    """Format implied by a file name (``.csv``, ``.ndjson``/``.jsonl``, optionally ``.gz``)."""
+    name = (filename or '').lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return None
+
+
+def _text_stream(stream):
+    """Decoded text of a binary stream, gunzipped if it starts with the gzip magic."""
+    if not hasattr(stream, 'peek'):
+        stream = io.BufferedReader(stream)
+    if stream.peek(2)[:2] == b'\x1f\x8b':
+        stream = gzip.GzipFile(fileobj=stream)
+    return io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+
+def read_catalog(stream, fmt=None):
+    """Yield ``(line number, row dict)`` from a binary catalog stream."""
+    text = _text_stream(stream)
+    if fmt is None:
+        head = text.buffer.peek(64) if hasattr(text.buffer, 'peek') else b''
+        fmt = 'ndjson' if head.lstrip(b'\xef\xbb\xbf \t\r\n')[:1] == b'{' else 'csv'
+    if fmt not in FORMATS:
+        raise CatalogFormatError(f'Unknown catalog format: {fmt}')
+
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        if not reader.fieldnames or 'name' not in reader.fieldnames:
+            raise CatalogFormatError('CSV catalogs need a "name" column')
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(text, 1):
+        if line.strip():
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row
+
+
+def _parse_row(row, default_store, now):
+    if not isinstance(row, dict):
+        raise ValueError('not a JSON object')
+    name = (row.get('name') or '').strip()
+    key = normalize_name(name)
+    if not key:
+        raise ValueError('missing name')
+    price = row.get('price')
+    try:
+        price_cents = to_cents(price) if price not in (None, '') else None
+    except ArithmeticError:
+        raise ValueError(f'invalid price {price!r}') from None
+    if price_cents is not None and price_cents < 0:
+        raise ValueError('negative price')
+    observed_at = row.get('observed_at')
+    return {
+        'name': name[:200],
+        'name_key': key[:200],
+        'category': (row.get('category') or '').strip()[:100] or DEFAULT_CATEGORY,
+        'price_cents': price_cents,
+        'currency': (row.get('currency') or DEFAULT_CURRENCY).strip().upper()[:3],
+        'store': (row.get('store') or '').strip() or default_store,
+        'observed_at': datetime.fromisoformat(observed_at.replace('Z', '+00:00')).replace(tzinfo=None)
+                       if observed_at else now
+    }
+
+
+def _product_rows(rows, now):
+    """One row per (name key, category), carrying the batch's mean price and count."""
+    products = {}
+    for row in rows:
+        entry = products.setdefault((row['name_key'], row['category']), {
+            'name': row['name'], 'name_key': row['name_key'], 'category': row['category'],
+            'total': 0, 'price_count': 0, 'created_at': now
+        })
+        if row['price_cents'] is not None:
+            entry['total'] += row['price_cents']
+            entry['price_count'] += 1
+    for entry in products.values():
+        total = entry.pop('total')
+        entry['average_price'] = total / entry['price_count'] / 100 if entry['price_count'] else None
+    return list(products.values())
+
+
+def _upsert_products(products):
+    """Insert or update ``products``; returns ``{(name_key, category): id}``."""
+    products_table = Product.__table__
+    dialect = db.session.get_bind(mapper=Product.__mapper__).dialect.name
+    if dialect not in _UPSERT_DIALECTS:
+        return _upsert_products_portable(products)
+
+    statement = _UPSERT_DIALECTS[dialect].insert(products_table)
+    excluded, current = statement.excluded, products_table.c
+    statement = statement.on_conflict_do_update(
+        index_elements=['name_key', 'category'],
+        set_={
+            'average_price': case(
+                (excluded.price_count == 0, current.average_price),
+                else_=(func.coalesce(current.average_price, 0) * current.price_count
+                       + excluded.average_price * excluded.price_count)
+                      / (current.price_count + excluded.price_count)
+            ),
+            'price_count': current.price_count + excluded.price_count
+        }
+    ).returning(current.name_key, current.category, current.id)
+    return {(key, category): product_id for key, category, product_id in db.session.execute(statement, products)}
+
+
+def _upsert_products_portable(products):
+    products_table = Product.__table__
+    keys = {(product['name_key'], product['category']) for product in products}
+    ids = {
+        (key, category): (product_id, average_price, price_count)
+        for product_id, key, category, average_price, price_count in db.session.execute(
+            select(Product.id, Product.name_key, Product.category, Product.average_price, Product.price_count)
+            .where(Product.name_key.in_({key for key, _ in keys}))
+        ) if (key, category) in keys
+    }
+    new = [product for product in products if (product['name_key'], product['category']) not in ids]
+    if new:
+        db.session.execute(insert(products_table), new)
+    changed = []
+    for product in products:
+        existing = ids.get((product['name_key'], product['category']))
+        if existing is None or not product['price_count']:
+            continue
+        product_id, average_price, price_count = existing
+        count = price_count + product['price_count']
+        changed.append({
+            'product_id': product_id,
+            'average_price': ((average_price or 0) * price_count + product['average_price'] * product['price_count']) / count,
+            'price_count': count
+        })
+    if changed:
+        db.session.execute(
+            update(products_table).where(products_table.c.id == bindparam('product_id'))
+            .values(average_price=bindparam('average_price'), price_count=bindparam('price_count')),
+            changed
+        )
+    return {
+        (key, category): product_id for product_id, key, category in db.session.execute(
+            select(Product.id, Product.name_key, Product.category).where(Product.name_key.in_({key for key, _ in keys}))
+        ) if (key, category) in keys
+    }
+
+
+def _write_batch(rows, store_ids, now):
+    product_ids = _upsert_products(_product_rows(rows, now))
+    observations = []
+    for row in rows:
+        if row['price_cents'] is None:
+            continue
+        if row['store'] and row['store'] not in store_ids:
+            store_ids[row['store']] = resolve_store_id(row['store'])
+        observations.append({
+            'product_id': product_ids[(row['name_key'], row['category'])],
+            'store_id': store_ids.get(row['store']),
+            'price_cents': row['price_cents'],
+            'currency': row['currency'],
+            'observed_at': row['observed_at']
+        })
+    if observations:
+        db.session.execute(insert(ProductPriceObservation.__table__), observations)
+    bump_data_version(CATALOG_SCOPE)
+    db.session.commit()
+    return len(product_ids), len(observations)
+
+
+def import_catalog(stream, fmt=None, store=None, batch_size=None, log=None):
+    """Import a catalog from a binary stream; returns a report with the
+    row, product and observation counts, skipped rows and rows/s.
+
+    ``store`` names the store the prices come from, for rows without a
+    ``store`` field.
+    """
+    batch_size = batch_size or current_app.config['CATALOG_IMPORT_BATCH_SIZE']
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    report = {'rows': 0, 'products': 0, 'observations': 0, 'skipped': 0, 'errors': []}
+    store_ids = {}
+
+    def flush(batch):
+        products, observations = _write_batch(batch, store_ids, now)
+        report['products'] += products
+        report['observations'] += observations
+        if log:
+            elapsed = time.perf_counter() - started
+            log(f"{report['rows']} rows, {report['rows'] / elapsed:.0f} rows/s")
+
+    batch = []
+    for line_number, row in read_catalog(stream, fmt):
+        report['rows'] += 1
+        try:
+            batch.append(_parse_row(row, store, now))
+        except (ValueError, TypeError, ArithmeticError, AttributeError) as e:
+            report['skipped'] += 1
+            if len(report['errors']) < MAX_REPORTED_ERRORS:
+                report['errors'].append({'line': line_number, 'error': str(e)})
+            continue
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    elapsed = time.perf_counter() - started
+    report['seconds'] = round(elapsed, 3)
+    report['rows_per_second'] = round(report['rows'] / elapsed) if elapsed else report['rows']
+    return report
+
+
+def backfill_name_keys(conn, batch_size=BACKFILL_BATCH_SIZE):
+    """Fill ``product.name_key`` for existing products; all but the oldest
+    of each (name key, category) are left without one so the unique index
+    can be built. Legacy ``price_history`` entries become observations."""
+    products = table('product', column('created_at', DateTime), *(column(name) for name in (
+        'id', 'name', 'name_key', 'category', 'average_price', 'price_count', 'price_history'
+    )))
+    after = 0
+    while True:
+        batch = conn.execute(
+            select(products.c.id, products.c.name, products.c.price_history, products.c.created_at)
+            .where(products.c.id > after).order_by(products.c.id).limit(batch_size)
+        ).all()
+        if not batch:
+            break
+        after = batch[-1].id
+        conn.execute(
+            update(products).where(products.c.id == bindparam('product_id')).values(name_key=bindparam('key')),
+            [{'product_id': row.id, 'key': normalize_name(row.name)[:200] or None} for row in batch]
+        )
+        observations = [
+            observation for row in batch if row.price_history
+            for observation in _history_observations(row.id, row.price_history, row.created_at)
+        ]
+        if observations:
+            conn.execute(insert(ProductPriceObservation.__table__), observations)
+
+    conn.execute(update(products).where(products.c.average_price.isnot(None)).values(price_count=1))
+    conn.execute(update(products).where(
+        products.c.name_key.isnot(None),
+        products.c.id.notin_(
+            select(func.min(products.c.id)).where(products.c.name_key.isnot(None))
+            .group_by(products.c.name_key, products.c.category)
+        )
+    ).values(name_key=None))
+
+
+def _history_observations(product_id, price_history, created_at):
+    """Observations from a legacy ``price_history`` JSON list of prices or
+    ``{"price", "date"}`` objects; anything else is ignored."""
+    try:
+        entries = json.loads(price_history)
+    except ValueError:
+        return []
+    if not isinstance(entries, list):
+        return []
+    observations = []
+    for entry in entries:
+        try:
+            if isinstance(entry, dict):
+                price, when = entry.get('price'), entry.get('date') or entry.get('timestamp')
+                observed_at = datetime.fromisoformat(str(when).replace('Z', '+00:00')).replace(tzinfo=None) \
+                    if when else created_at
+            else:
+                price, observed_at = entry, created_at
+            price_cents = to_cents(price)
+        except (ValueError, TypeError, ArithmeticError):
+            continue
+        if price_cents is None or observed_at is None:
+            continue
+        observations.append({'product_id': product_id, 'price_cents': price_cents,
+                             'currency': DEFAULT_CURRENCY, 'observed_at': observed_at})
+    return observations
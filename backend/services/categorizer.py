@@ -0,0 +1,222 @@
+"""Item category classifier applied at receipt ingestion.
+
+A linear model over hashed character n-grams of the normalized product
+name, trained (``train_category_model``) from receipt items and catalog
+products that already have a real category. Only the weights are saved,
+as an ``.npz`` file at ``CATEGORY_MODEL_PATH``; hashing needs no fitted
+vocabulary, so a worker loads the file once (and again when it changes)
+and classifies a whole receipt or import batch with one sparse matrix
+product. Items the model is not confident about stay ``Other``.
+
+``reclassify_items`` (the ``reclassify_items`` job) runs the current
+model over existing ``Other`` items, in chunks. numpy and scikit-learn
+are imported on first use to keep worker start-up light.
+"""
+import os
+import threading
+import time
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import select, update, func, or_, bindparam
+
+from models import Product, Receipt, ReceiptItem, db, bump_data_version, user_scope
+from utils.sharding import shard_ids, using_shard
+from utils.text import normalize_name
+
+FALLBACK_CATEGORY = 'Other'
+N_FEATURES = 2 ** 17
+NGRAM_RANGE = (2, 4)
+MIN_CLASS_EXAMPLES = 3
+MAX_TRAINING_EXAMPLES = 500000
+MODEL_CHECK_SECONDS = 60
+RECLASSIFY_CHUNK_SIZE = 2000
+
+
+def _vectorizer(n_features, ngram_range):
+    from sklearn.feature_extraction.text import HashingVectorizer
+    return HashingVectorizer(analyzer='char_wb', ngram_range=tuple(ngram_range), n_features=int(n_features),
+                             alternate_sign=False, norm='l2', preprocessor=normalize_name)
+
+
+class CategoryModel:
+    """The classifier loaded from ``path``, reloaded when the file changes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._loaded = None  # (mtime, vectorizer, weights, intercept, classes)
+        self._checked_at = 0.0
+
+    def _sync(self):
+        now = time.monotonic()
+        if self._checked_at and now - self._checked_at < MODEL_CHECK_SECONDS:
+            return self._loaded
+        with self._lock:
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError:
+                mtime = None
+            if mtime is None:
+                self._loaded = None
+            elif self._loaded is None or self._loaded[0] != mtime:
+                try:
+                    import numpy as np
+                    with np.load(self.path) as data:
+                        self._loaded = (mtime, _vectorizer(data['n_features'], data['ngram_range']),
+                                        data['weights'], data['intercept'], data['classes'].tolist())
+                except Exception as e:
+                    current_app.logger.warning('Could not load category model %s: %s', self.path, e)
+                    self._loaded = None
+            self._checked_at = now
+        return self._loaded
+
+    @property
+    def available(self):
+        return self._sync() is not None
+
+    def classify(self, names, min_confidence=None):
+        """Category per product name; ``Other`` below ``min_confidence``
+        (default ``CATEGORY_MIN_CONFIDENCE``) or without a model."""
+        loaded = self._sync()
+        if loaded is None or not names:
+            return [FALLBACK_CATEGORY] * len(names)
+        import numpy as np
+        if min_confidence is None:
+            min_confidence = current_app.config['CATEGORY_MIN_CONFIDENCE']
+        _, vectorizer, weights, intercept, classes = loaded
+
+        scores = np.asarray(vectorizer.transform(names) @ weights) + intercept
+        best = scores.argmax(axis=1)
+        # One-vs-rest log loss: the best class's own probability against the rest,
+        # so a name unlike anything seen scores low in every class
+        confidence = 1 / (1 + np.exp(-scores[np.arange(len(names)), best]))
+        return [
+            classes[index] if score >= min_confidence else FALLBACK_CATEGORY
+            for index, score in zip(best.tolist(), confidence.tolist())
+        ]
+
+
+def category_model():
+    """The classifier of the current app in this process."""
+    model = current_app.extensions.get('category_model')
+    if model is None:
+        model = current_app.extensions.setdefault('category_model', CategoryModel(current_app.config['CATEGORY_MODEL_PATH']))
+    return model
+
+
+def categorize_items(items):
+    """Fill in the category of item dicts that have none, in one predict call."""
+    missing = [item for item in items if not item.get('category')]
+    if missing:
+        categories = category_model().classify([item['product_name'] for item in missing])
+        for item, category in zip(missing, categories):
+            item['category'] = category
+
+
+def _training_examples():
+    """``Counter`` of (normalized name, category) over every shard's receipt
+    items and the product catalog, leaving out ``Other``."""
+    examples = Counter()
+    labelled = or_(ReceiptItem.category.is_(None), ReceiptItem.category == FALLBACK_CATEGORY)
+    for shard in shard_ids():
+        with using_shard(shard):
+            for name, category, count in db.session.execute(
+                select(ReceiptItem.product_name, ReceiptItem.category, func.count())
+                .where(~labelled).group_by(ReceiptItem.product_name, ReceiptItem.category)
+            ):
+                examples[(normalize_name(name), category)] += count
+    for name, category in db.session.execute(
+        select(Product.name, Product.category)
+        .where(Product.category.isnot(None), Product.category != FALLBACK_CATEGORY)
+    ):
+        examples[(normalize_name(name), category)] += 1
+    return examples
+
+
+def train_category_model(path=None, log=None):
+    """Train the classifier from categorized items and products and save it
+    to ``path`` (default ``CATEGORY_MODEL_PATH``); returns a summary with
+    the accuracy on a held-out tenth of the examples."""
+    import numpy as np
+    from sklearn.linear_model import SGDClassifier
+
+    path = path or current_app.config['CATEGORY_MODEL_PATH']
+    examples = _training_examples()
+    class_sizes = Counter(category for _, category in examples)
+    rows = [
+        (name, category, count) for (name, category), count in examples.most_common(MAX_TRAINING_EXAMPLES)
+        if name and class_sizes[category] >= MIN_CLASS_EXAMPLES
+    ]
+    classes = sorted({category for _, category, _ in rows})
+    if len(classes) < 2:
+        raise ValueError('Need categorized items in at least two categories to train')
+
+    vectorizer = _vectorizer(N_FEATURES, NGRAM_RANGE)
+    X = vectorizer.transform([name for name, _, _ in rows])
+    y = np.array([category for _, category, _ in rows])
+    weights = 1 + np.log([count for _, _, count in rows])
+
+    order = np.random.default_rng(0).permutation(len(rows))
+    held_out = order[:len(rows) // 10] if len(rows) >= 1000 else order[:0]
+    train = order[len(held_out):]
+    model = SGDClassifier(loss='log_loss', alpha=1e-6, max_iter=30, tol=1e-4, random_state=0)
+    model.fit(X[train], y[train], sample_weight=weights[train])
+    accuracy = float(model.score(X[held_out], y[held_out])) if len(held_out) else None
+
+    coef, intercept = model.coef_, model.intercept_
+    if len(model.classes_) == 2:
+        # Binary models keep one row of weights for the second class
+        coef, intercept = np.vstack([-coef, coef]), np.concatenate([-intercept, intercept])
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        np.savez(f, weights=coef.T.astype(np.float32), intercept=intercept.astype(np.float32),
+                 classes=np.array(model.classes_.tolist()), n_features=N_FEATURES, ngram_range=NGRAM_RANGE)
+    os.replace(temporary, path)
+    current_app.extensions.pop('category_model', None)
+
+    summary = {'examples': len(rows), 'classes': len(classes), 'accuracy': accuracy}
+    if log:
+        log(f"Trained on {len(rows)} names in {len(classes)} categories"
+            + (f", held-out accuracy {accuracy:.1%}" if accuracy is not None else ''))
+    return summary
+
+
+def reclassify_items(chunk_size=RECLASSIFY_CHUNK_SIZE, log=None):
+    """Give existing ``Other`` (or uncategorized) items the category the
+    current model predicts, chunk by chunk; returns the number changed."""
+    model = category_model()
+    if not model.available:
+        raise RuntimeError('No category model; train one first (train_category_model)')
+
+    uncategorized = or_(ReceiptItem.category.is_(None), ReceiptItem.category == FALLBACK_CATEGORY)
+    statement = update(ReceiptItem.__table__).where(ReceiptItem.__table__.c.id == bindparam('item_id')) \
+        .values(category=bindparam('new_category'))
+    changed = 0
+    for shard in shard_ids():
+        with using_shard(shard):
+            after = 0
+            while True:
+                rows = db.session.execute(
+                    select(ReceiptItem.id, ReceiptItem.product_name, Receipt.user_id).join(Receipt)
+                    .where(ReceiptItem.id > after, uncategorized).order_by(ReceiptItem.id).limit(chunk_size)
+                ).all()
+                if not rows:
+                    break
+                after = rows[-1].id
+                updates, users = [], set()
+                for row, category in zip(rows, model.classify([row.product_name for row in rows])):
+                    if category != FALLBACK_CATEGORY:
+                        updates.append({'item_id': row.id, 'new_category': category})
+                        users.add(row.user_id)
+                if updates:
+                    db.session.execute(statement, updates)
+                    for user_id in users:
+                        bump_data_version(user_scope(user_id))
+                db.session.commit()
+                changed += len(updates)
+            if log:
+                log(f"Shard {shard}: {changed} item(s) reclassified so far")
+    return changed
@@ -0,0 +1,151 @@
+"""Burn-rate forecasts for a user's active budgets.
+
+All active budgets are forecast together: one grouped query loads the
+user's daily spend per item category (archived receipts included) since
+the earliest budget start, the series are laid out as a (categories,
+days) matrix, and every
+budget's burn rate, projection and confidence band is computed with
+array operations over a (budgets, days) view of that matrix.
+
+A budget in the ``General`` category (or without a category) tracks all
+spending; any other budget tracks items of its category.
+"""
+from datetime import datetime, date, timedelta
+
+import numpy as np
+from sqlalchemy import select, func
+
+from models import Receipt, ReceiptItem, db
+from models.archive import archived_daily_category_spend
+from models.rows import budget_snapshots
+from utils.money import from_cents
+
+GENERAL_CATEGORIES = {None, '', 'general'}
+
+# Two-sided 95% normal quantile for the burn-rate confidence band
+Z_95 = 1.96
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def active_budgets(user_id, now):
+    return budget_snapshots(user_id, active_at=now)
+
+
+def daily_spend_matrix(user_id, first_day, last_day):
+    """Return ``(categories, matrix)`` with spend in cents per (category, day)."""
+    day = func.date(Receipt.purchase_date)
+    since = datetime.combine(first_day, datetime.min.time())
+    until = datetime.combine(last_day, datetime.max.time())
+    rows = db.session.execute(
+        select(day, func.lower(ReceiptItem.category), func.sum(ReceiptItem.total_price_cents))
+        .join(Receipt)
+        .where(
+            Receipt.user_id == user_id,
+            Receipt.purchase_date >= since,
+            Receipt.purchase_date <= until
+        )
+        .group_by(day, func.lower(ReceiptItem.category))
+    ).all()
+    rows.extend(archived_daily_category_spend(user_id, since, until))
+
+    categories = sorted({category or '' for _, category, _ in rows})
+    index = {category: i for i, category in enumerate(categories)}
+    matrix = np.zeros((len(categories), (last_day - first_day).days + 1))
+    for day_value, category, cents in rows:
+        matrix[index[category or ''], (_as_date(day_value) - first_day).days] += cents
+    return categories, matrix
+
+
+def forecast_budgets(user_id, now=None):
+    now = now or datetime.now()
+    today = now.date()
+    budgets = active_budgets(user_id, now)
+    if not budgets:
+        return []
+
+    first_day = min(_as_date(budget.start_date) for budget in budgets)
+    categories, matrix = daily_spend_matrix(user_id, first_day, today)
+    days = len(matrix[0]) if len(categories) else (today - first_day).days + 1
+
+    # (budgets, days) series: the matching category row, or all categories
+    totals_row = matrix.sum(axis=0) if len(categories) else np.zeros(days)
+    rows = []
+    for budget in budgets:
+        key = (budget.category or '').lower()
+        if key in GENERAL_CATEGORIES:
+            rows.append(totals_row)
+        elif key in categories:
+            rows.append(matrix[categories.index(key)])
+        else:
+            rows.append(np.zeros(days))
+    series = np.vstack(rows)
+
+    offsets = np.arange(days)
+    start = np.array([(_as_date(b.start_date) - first_day).days for b in budgets])[:, None]
+    in_window = offsets >= start
+    series = np.where(in_window, series, 0.0)
+
+    elapsed = np.maximum(in_window.sum(axis=1), 1)
+    spent = series.sum(axis=1)
+    limit = np.array([b.total_budget_cents for b in budgets], dtype=float)
+    remaining_days = np.array([max((_as_date(b.end_date) - today).days, 0) for b in budgets])
+
+    rate = spent / elapsed
+    variance = np.where(in_window, (series - rate[:, None]) ** 2, 0.0).sum(axis=1) / np.maximum(elapsed - 1, 1)
+    margin = Z_95 * np.sqrt(variance / elapsed)
+
+    projected = spent + rate * remaining_days
+    projected_low = spent + np.maximum(rate - margin, 0) * remaining_days
+    projected_high = spent + (rate + margin) * remaining_days
+
+    # Day on which cumulative spend first exceeds the limit: observed if it
+    # already happened, otherwise extrapolated at the current burn rate.
+    cumulative = np.cumsum(series, axis=1)
+    exceeded = cumulative > limit[:, None]
+    already_over = exceeded.any(axis=1)
+    first_over = exceeded.argmax(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        days_to_limit = np.ceil((limit - spent) / rate)
+
+    spent_cents = np.rint(spent).astype(int).tolist()
+    rate, projected_low, projected_high = (
+        np.round(values / 100, 2).tolist() for values in (rate, projected_low, projected_high)
+    )
+    projected_total = np.round(projected / 100, 2).tolist()
+
+    forecasts = []
+    for i, budget in enumerate(budgets):
+        if already_over[i]:
+            overspend_date = first_day + timedelta(days=int(first_over[i]))
+            status = 'over_budget'
+        elif rate[i] > 0 and projected[i] > limit[i]:
+            overspend_date = today + timedelta(days=int(days_to_limit[i]))
+            status = 'projected_overspend'
+        else:
+            overspend_date = None
+            status = 'on_track'
+
+        forecasts.append({
+            'budget_id': budget.id,
+            'name': budget.name,
+            'category': budget.category,
+            'total_budget': from_cents(budget.total_budget_cents),
+            'spent_to_date': from_cents(spent_cents[i]),
+            'days_elapsed': int(elapsed[i]),
+            'days_remaining': int(remaining_days[i]),
+            'daily_burn_rate': rate[i],
+            'projected_total': projected_total[i],
+            'projected_low': projected_low[i],
+            'projected_high': projected_high[i],
+            'projected_overspend_date': overspend_date.isoformat() if overspend_date else None,
+            'status': status
+        })
+
+    return forecasts
@@ -0,0 +1,283 @@
+"""Database-backed background job queue.
+
+Jobs are rows in the ``job`` table, so the queue needs no broker and works
+with the same SQLite file as the API. ``run_worker.py`` claims queued jobs
+with a conditional UPDATE (safe with several worker processes), runs them
+in a process pool and records the result. Failed jobs are retried with
+exponential backoff until ``max_attempts``; jobs whose worker died are
+requeued once their lock goes stale.
+
+Job kinds are plain functions registered with ``@job`` in services.tasks.
+Their keyword arguments come from the JSON payload and their return value
+is stored as the JSON result.
+"""
+import json
+import os
+import random
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from multiprocessing import get_context
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from models import Job, db
+from utils.sharding import using_shard, user_shard
+
+JOBS = {}
+MAX_RETRY_DELAY = 3600  # seconds
+
+
+class JobKind:
+    def __init__(self, fn, user_submittable, max_attempts):
+        self.fn = fn
+        self.user_submittable = user_submittable
+        self.max_attempts = max_attempts
+
+
+def job(kind, user_submittable=False, max_attempts=None):
+    """Register ``fn`` as the handler for jobs of ``kind``.
+
+    ``user_submittable`` kinds may be queued through ``POST /api/jobs``;
+    they receive the submitting user's id as ``user_id``.
+    """
+    def decorator(fn):
+        JOBS[kind] = JobKind(fn, user_submittable, max_attempts)
+        return fn
+    return decorator
+
+
+def registry():
+    import services.tasks  # noqa: F401 -- registers the job kinds
+    return JOBS
+
+
+def enqueue(kind, payload=None, user_id=None, idempotency_key=None, run_after=None, max_attempts=None):
+    """Queue a job and return ``(job, created)``.
+
+    With an ``idempotency_key`` the existing job for the same (user, kind,
+    key) is returned instead of queuing a second one.
+    """
+    kinds = registry()
+    if kind not in kinds:
+        raise ValueError(f'Unknown job kind: {kind}')
+
+    key = f'{user_id or "system"}:{kind}:{idempotency_key}' if idempotency_key else None
+    if key:
+        existing = Job.query.filter_by(idempotency_key=key).first()
+        if existing:
+            return existing, False
+
+    job = Job(
+        kind=kind,
+        payload=json.dumps(payload or {}),
+        user_id=user_id,
+        idempotency_key=key,
+        run_after=run_after or datetime.utcnow(),
+        max_attempts=max_attempts or kinds[kind].max_attempts or current_app.config['JOB_MAX_ATTEMPTS']
+    )
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Lost a race with a concurrent request using the same key
+        db.session.rollback()
+        return Job.query.filter_by(idempotency_key=key).one(), False
+    return job, True
+
+
+def cancel(job_id, user_id=None):
+    """Cancel a job that has not started yet; returns whether it was cancelled."""
+    query = db.update(Job).where(Job.id == job_id, Job.status == 'queued')
+    if user_id is not None:
+        query = query.where(Job.user_id == user_id)
+    result = db.session.execute(query.values(status='cancelled', finished_at=datetime.utcnow()))
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def claim(worker_id, candidates=5):
+    """Lock the next due job for ``worker_id``; None when the queue is empty."""
+    now = datetime.utcnow()
+    job_ids = db.session.execute(
+        db.select(Job.id)
+        .where(Job.status == 'queued', Job.run_after <= now)
+        .order_by(Job.run_after, Job.id)
+        .limit(candidates)
+    ).scalars().all()
+
+    for job_id in job_ids:
+        result = db.session.execute(
+            db.update(Job)
+            .where(Job.id == job_id, Job.status == 'queued')
+            .values(status='running', locked_by=worker_id, locked_at=now, attempts=Job.attempts + 1)
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            return db.session.get(Job, job_id)
+    return None
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter, in seconds."""
+    base = current_app.config['JOB_RETRY_BASE_SECONDS']
+    delay = min(base * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+    return delay * random.uniform(0.75, 1.25)
+
+
+def complete(job_id, worker_id, result):
+    db.session.execute(
+        db.update(Job)
+        .where(Job.id == job_id, Job.status == 'running', Job.locked_by == worker_id)
+        .values(status='succeeded', result=result, error=None, locked_by=None, finished_at=datetime.utcnow())
+    )
+    db.session.commit()
+
+
+def fail(job_id, worker_id, error):
+    """Record a failed attempt: requeue with backoff, or fail for good."""
+    job = db.session.get(Job, job_id)
+    if job is None or job.status != 'running' or job.locked_by != worker_id:
+        return
+    job.error = error
+    job.locked_by = None
+    if job.attempts < job.max_attempts:
+        job.status = 'queued'
+        job.run_after = datetime.utcnow() + timedelta(seconds=retry_delay(job.attempts))
+    else:
+        job.status = 'failed'
+        job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+
+def heartbeat(worker_id):
+    """Refresh the locks of this worker's running jobs."""
+    db.session.execute(
+        db.update(Job)
+        .where(Job.status == 'running', Job.locked_by == worker_id)
+        .values(locked_at=datetime.utcnow())
+    )
+    db.session.commit()
+
+
+def reap_stale(lock_timeout):
+    """Requeue (or fail) running jobs whose worker stopped heartbeating."""
+    cutoff = datetime.utcnow() - timedelta(seconds=lock_timeout)
+    stale = Job.query.filter(Job.status == 'running', Job.locked_at < cutoff).all()
+    for job in stale:
+        job.locked_by = None
+        job.error = 'Worker lost while running the job'
+        if job.attempts < job.max_attempts:
+            job.status = 'queued'
+            job.run_after = datetime.utcnow()
+        else:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return len(stale)
+
+
+def purge_finished(retention_days):
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    db.session.execute(
+        db.delete(Job).where(Job.status.in_(('succeeded', 'failed', 'cancelled')), Job.finished_at < cutoff)
+    )
+    db.session.commit()
+
+
+# Worker process side: each pool process builds its own app (and engine)
+_process_app = None
+
+
+def _init_process():
+    global _process_app
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent handles shutdown
+    from app import create_app
+    _process_app = create_app()
+
+
+def _execute(kind, payload, user_id):
+    with _process_app.app_context():
+        try:
+            arguments = json.loads(payload)
+            if registry()[kind].user_submittable:
+                arguments['user_id'] = user_id
+            with using_shard(user_shard(user_id) if user_id is not None else None):
+                result = registry()[kind].fn(**arguments)
+            return current_app.json.dumps(result) if result is not None else None
+        except Exception as e:
+            # Re-raise as a plain exception so it always pickles back to the parent
+            raise RuntimeError(f'{type(e).__name__}: {e}') from None
+        finally:
+            db.session.remove()
+
+
+def run_worker(processes=None, poll_interval=None, once=False, log=print):
+    """Claim and run jobs until SIGTERM/SIGINT (or, with ``once``, until idle).
+
+    Must be called inside an app context.
+    """
+    config = current_app.config
+    processes = processes or config['JOB_WORKER_PROCESSES']
+    poll_interval = poll_interval or config['JOB_POLL_INTERVAL']
+    lock_timeout = config['JOB_LOCK_TIMEOUT']
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+
+    stopping = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopping.set())
+
+    def new_pool():
+        return ProcessPoolExecutor(processes, mp_context=get_context('spawn'), initializer=_init_process)
+
+    pool = new_pool()
+    running = {}
+    next_maintenance = 0
+    log(f'Job worker {worker_id} started with {processes} process(es)')
+
+    while running or not stopping.is_set():
+        if time.monotonic() >= next_maintenance:
+            heartbeat(worker_id)
+            if reaped := reap_stale(lock_timeout):
+                log(f'Requeued {reaped} stale job(s)')
+            purge_finished(config['JOB_RETENTION_DAYS'])
+            next_maintenance = time.monotonic() + lock_timeout / 4
+
+        while not stopping.is_set() and len(running) < processes:
+            job = claim(worker_id)
+            if job is None:
+                break
+            running[pool.submit(_execute, job.kind, job.payload, job.user_id)] = job.id
+
+        if not running:
+            if once:
+                break
+            stopping.wait(poll_interval)
+            continue
+
+        done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+        broken = False
+        for future in done:
+            job_id = running.pop(future)
+            try:
+                complete(job_id, worker_id, future.result())
+            except BrokenProcessPool:
+                broken = True
+                fail(job_id, worker_id, 'Worker process died while running the job')
+            except Exception as e:
+                log(f'Job {job_id} failed: {e}')
+                fail(job_id, worker_id, str(e))
+        if broken:
+            pool.shutdown(wait=False, cancel_futures=True)
+            for job_id in running.values():
+                fail(job_id, worker_id, 'Worker process died while running the job')
+            running = {}
+            pool = new_pool()
+
+    pool.shutdown()
+    log(f'Job worker {worker_id} stopped')
@@ -0,0 +1,206 @@
+"""Crowd-sourced price index built from every user's receipt items.
+
+The job streams (product, store, purchase date, unit price, user) rows
+through a server-side cursor in chunks, one shard after another, then
+reads the archived items (``models.archive``) batch by batch. Each
+chunk is turned into compact integer arrays with pandas: dense codes for
+the normalized product names, the store id, the Monday of the purchase
+week, and the price in cents. At the end the arrays are sorted once.
+Median, p25/p75 and the distinct-user count for every (product, store,
+week) group are then computed with vectorized NumPy operations. Memory
+use is about 32 bytes per item (int32 product and week codes, int64
+store, price and user).
+
+Groups seen by fewer than ``min_users`` distinct users are dropped, so
+no single user's purchases can be read back from the index.
+"""
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import select, delete, insert, func
+
+from models import Receipt, ReceiptItem, PriceIndex, db
+from models.archive import archived_observations
+from models.stores import directory
+from utils.sharding import shard_ids, using_shard
+from utils.text import normalize_name
+
+EPOCH = date(1970, 1, 1)
+
+
+class _KeyCodes:
+    """Dense integer codes for normalized names, keeping the first raw
+    spelling seen as the display name."""
+
+    def __init__(self):
+        self.codes = {}
+        self.keys = []
+        self.names = []
+
+    def code(self, raw):
+        key = normalize_name(raw)
+        if key not in self.codes:
+            self.codes[key] = len(self.keys)
+            self.keys.append(key)
+            self.names.append(raw.strip())
+        return self.codes[key]
+
+    def encode(self, values):
+        import pandas as pd
+
+        local, uniques = pd.factorize(values)
+        lookup = np.array([self.code(value) for value in uniques], dtype=np.int32)
+        return lookup[local]
+
+
+def week_start(value):
+    value = value.date() if isinstance(value, datetime) else value
+    return value - timedelta(days=value.weekday())
+
+
+def _monday_ordinals(purchase_dates):
+    import pandas as pd
+
+    days = pd.to_datetime(purchase_dates).values.astype('datetime64[D]').astype(np.int64)
+    # 1970-01-01 was a Thursday (weekday 3)
+    return (days - (days + 3) % 7).astype(np.int32)
+
+
+def _stream_observations(since, chunk_size):
+    import pandas as pd
+
+    products = _KeyCodes()
+    columns = {name: [] for name in ('product', 'store', 'week', 'price', 'user')}
+
+    query = (
+        select(
+            ReceiptItem.product_name, Receipt.store_id, Receipt.purchase_date,
+            ReceiptItem.unit_price_cents, Receipt.user_id
+        )
+        .join(Receipt)
+        .where(ReceiptItem.unit_price_cents > 0)
+        .execution_options(yield_per=chunk_size)
+    )
+    if since is not None:
+        query = query.where(Receipt.purchase_date >= datetime.combine(since, datetime.min.time()))
+
+    def add(frame):
+        columns['product'].append(products.encode(frame['product']))
+        columns['store'].append(frame['store'].to_numpy(dtype=np.int64))
+        columns['week'].append(_monday_ordinals(frame['purchased']))
+        columns['price'].append(frame['price'].to_numpy(dtype=np.int64))
+        columns['user'].append(frame['user'].to_numpy(dtype=np.int64))
+
+    for shard in shard_ids():
+        with using_shard(shard):
+            for chunk in db.session.execute(query).partitions():
+                add(pd.DataFrame(chunk, columns=['product', 'store', 'purchased', 'price', 'user']))
+
+    archive_since = datetime.combine(since, datetime.min.time()) if since is not None else None
+    for user_id, batch in archived_observations(archive_since):
+        frame = batch.to_pandas().set_axis(['product', 'store', 'purchased', 'price'], axis=1)
+        frame['user'] = user_id
+        add(frame)
+
+    arrays = {
+        name: np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+        for name, parts in columns.items()
+    }
+    return products, arrays
+
+
+def _group_statistics(arrays, min_users):
+    product, store, week, price, user = (
+        arrays[name] for name in ('product', 'store', 'week', 'price', 'user')
+    )
+    order = np.lexsort((price, week, store, product))
+    product, store, week, price, user = (a[order] for a in (product, store, week, price, user))
+
+    changed = (np.diff(product) != 0) | (np.diff(store) != 0) | (np.diff(week) != 0)
+    starts = np.concatenate(([0], np.flatnonzero(changed) + 1))
+    counts = np.diff(np.append(starts, len(price)))
+
+    def quantile(q):
+        position = starts + q * (counts - 1)
+        low = np.floor(position).astype(np.int64)
+        high = np.ceil(position).astype(np.int64)
+        return price[low] + (price[high] - price[low]) * (position - low)
+
+    group = np.repeat(np.arange(len(starts)), counts)
+    pairs = np.unique(group * (int(user.max()) + 1) + user)
+    distinct_users = np.bincount(pairs // (int(user.max()) + 1), minlength=len(starts))
+
+    keep = distinct_users >= min_users
+    return {
+        'product': product[starts][keep],
+        'store': store[starts][keep],
+        'week': week[starts][keep],
+        'p25': np.rint(quantile(0.25))[keep].astype(np.int64),
+        'median': np.rint(quantile(0.5))[keep].astype(np.int64),
+        'p75': np.rint(quantile(0.75))[keep].astype(np.int64),
+        'count': counts[keep]
+    }
+
+
+def build_price_index(since=None, min_users=3, chunk_size=50000, batch_size=5000):
+    """Rebuild the price index from ``since`` (a date, aligned to its
+    Monday) or from scratch. Returns the number of index rows written."""
+    since = week_start(since) if since is not None else None
+    products, arrays = _stream_observations(since, chunk_size)
+    stores = directory()
+
+    stats = _group_statistics(arrays, min_users) if len(arrays['price']) else None
+    now = datetime.utcnow()
+
+    rows = []
+    if stats is not None:
+        for product, store, week, p25, median, p75, count in zip(
+            *(stats[name].tolist() for name in ('product', 'store', 'week', 'p25', 'median', 'p75', 'count'))
+        ):
+            store_name, store_key, _ = stores.get(store)
+            rows.append({
+                'product_key': products.keys[product],
+                'store_key': store_key,
+                'product_name': products.names[product],
+                'store_name': store_name,
+                'week_start': EPOCH + timedelta(days=week),
+                'median_cents': median,
+                'p25_cents': p25,
+                'p75_cents': p75,
+                'sample_count': count,
+                'updated_at': now
+            })
+
+    stale = delete(PriceIndex)
+    if since is not None:
+        stale = stale.where(PriceIndex.week_start >= since)
+    db.session.execute(stale)
+    for offset in range(0, len(rows), batch_size):
+        db.session.execute(insert(PriceIndex), rows[offset:offset + batch_size])
+    db.session.commit()
+
+    return len(rows)
+
+
+def recent_medians(names, weeks=4):
+    """Average weekly median price (in cents) per product over the last
+    ``weeks`` weeks, keyed by the names as given; one query for all names."""
+    keys = {name: normalize_name(name) for name in names}
+    since = week_start(date.today()) - timedelta(weeks=weeks)
+    rows = db.session.execute(
+        select(PriceIndex.product_key, func.avg(PriceIndex.median_cents))
+        .where(PriceIndex.product_key.in_(set(keys.values())), PriceIndex.week_start >= since)
+        .group_by(PriceIndex.product_key)
+    ).all()
+    medians = dict(rows)
+    return {name: medians[key] for name, key in keys.items() if key in medians}
+
+
+def price_trend(product_name, weeks=12):
+    """Weekly index entries for a product, oldest first, or ``[]``."""
+    since = week_start(date.today()) - timedelta(weeks=weeks)
+    return db.session.execute(
+        select(PriceIndex)
+        .where(PriceIndex.product_key == normalize_name(product_name), PriceIndex.week_start >= since)
+        .order_by(PriceIndex.week_start, PriceIndex.store_key)
+    ).scalars().all()
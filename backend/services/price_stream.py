@@ -0,0 +1,92 @@
+"""Async server for the price stream: ``python run_stream.py``.
+
+Serves ``GET /api/price-stream`` from one aiohttp event loop, so an open
+stream is a parked coroutine instead of a gunicorn request thread and one
+process holds thousands of idle connections. Clients arrive through a
+redirect from the API's /api/price-stream, carrying a stream ticket (a JWT
+of type ``stream``, valid for SSE_TICKET_SECONDS, with a ``stream_products``
+claim) that names the products to watch. The API refuses tickets, so
+one leaked from a URL cannot be used as an access token.
+
+Events are published by the API workers and the job worker, so the server
+receives them through the Redis backplane and needs SSE_REDIS_URL.
+"""
+import asyncio
+
+from flask_jwt_extended import decode_token
+
+from utils.pubsub import hub, user_channel, product_channel, format_event
+
+
+def _ticket_claims(app, ticket):
+    from routes.auth import token_outlived_account
+
+    with app.app_context():
+        try:
+            claims = decode_token(ticket)
+        except Exception:
+            return None
+        # decode_token skips the check jwt_required makes for deleted accounts
+        if claims.get('type') != 'stream' or 'stream_products' not in claims or token_outlived_account(claims):
+            return None
+    return claims
+
+
+def stream_app(app):
+    """The aiohttp application serving ``app``'s price stream."""
+    from aiohttp import web
+
+    config = app.config
+    dumps = app.json.dumps
+    streams = set()
+
+    async def price_stream(request):
+        claims = _ticket_claims(app, request.query.get('ticket', ''))
+        if claims is None:
+            return web.json_response({'error': 'Invalid or expired stream ticket'}, status=401)
+
+        loop = asyncio.get_running_loop()
+        channels = [user_channel(claims['sub'])] + [product_channel(key) for key in claims['stream_products']]
+        subscription = hub.subscribe(channels, loop=loop)
+        streams.add(subscription)
+        last_id = request.headers.get('Last-Event-ID') or request.query.get('last_event_id') or hub.last_event_id()
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+            # The ticket in the URL is the credential, so any origin may connect
+            'Access-Control-Allow-Origin': '*'
+        })
+        try:
+            await response.prepare(request)
+            await response.write(b'retry: 3000\n\n')
+            deadline = loop.time() + config['SSE_MAX_STREAM_SECONDS']
+            while loop.time() < deadline:
+                for event_id, event, data in subscription.events_after(last_id):
+                    await response.write(format_event(event_id, event, data, dumps).encode())
+                    last_id = event_id
+                if not await subscription.wait_async(config['SSE_HEARTBEAT_SECONDS']):
+                    await response.write(b': heartbeat\n\n')
+        except ConnectionResetError:
+            pass
+        finally:
+            subscription.close()
+            streams.discard(subscription)
+        return response
+
+    async def health(request):
+        return web.json_response({'status': 'ok', 'streams': len(streams)})
+
+    server = web.Application()
+    server.router.add_get('/api/price-stream', price_stream)
+    server.router.add_get('/health', health)
+    return server
+
+
+def run_stream_server(app, host='0.0.0.0', port=None):
+    """Serve the price stream until interrupted."""
+    from aiohttp import web
+
+    if not app.config['SSE_REDIS_URL']:
+        raise RuntimeError('The stream server receives events through Redis; set SSE_REDIS_URL')
+    web.run_app(stream_app(app), host=host, port=port or app.config['SSE_STREAM_PORT'])
@@ -0,0 +1,73 @@
+"""Set-based deletion of receipt ranges and whole accounts.
+
+Rows are deleted with plain DELETE statements in chunks of
+``PURGE_CHUNK_SIZE``, each chunk its own transaction, so a large purge
+holds SQLite's write lock for one chunk at a time and other writers get
+in between. A receipt's items go with it through the ``ON DELETE
+CASCADE`` foreign key; nothing is loaded into the session.
+
+Cascades stop at the database boundary: with sharding on, deleting the
+user row in the main database cannot reach the user's shard. An account
+is therefore purged shard first (receipts, budgets, data version), then
+the archive and rendered reports, and the user row last, which cascades
+to the user's jobs. Every step can be repeated, so a purge that stopped
+halfway finishes when retried.
+"""
+from flask import current_app
+from sqlalchemy import select, delete
+
+from models import Receipt, Budget, DataVersion, User, db, bump_data_version, user_scope
+from models.archive import has_archive, delete_archived_range, delete_archive
+from services.reports import delete_reports
+from utils.sharding import using_user_shard, scope_bind
+
+
+def _delete_in_chunks(model, user_id, *criteria, chunk_size=None):
+    """Delete the user's ``model`` rows matching ``criteria``; returns the count."""
+    chunk_size = chunk_size or current_app.config['PURGE_CHUNK_SIZE']
+    chunk = select(model.id).where(model.user_id == user_id, *criteria).limit(chunk_size)
+    deleted = 0
+    while ids := db.session.execute(chunk).scalars().all():
+        db.session.execute(delete(model).where(model.id.in_(ids)))
+        # Per chunk, so cached responses never outlive the rows they show
+        bump_data_version(user_scope(user_id))
+        db.session.commit()
+        deleted += len(ids)
+    return deleted
+
+
+def delete_receipts(user_id, since=None, until=None, chunk_size=None):
+    """Delete a user's receipts purchased from ``since`` up to, not
+    including, ``until`` (None: unbounded), archived ones included.
+    Returns the number of receipts deleted."""
+    criteria = []
+    if since is not None:
+        criteria.append(Receipt.purchase_date >= since)
+    if until is not None:
+        criteria.append(Receipt.purchase_date < until)
+    deleted = _delete_in_chunks(Receipt, user_id, *criteria, chunk_size=chunk_size)
+
+    if has_archive(user_id):
+        archived = delete_archived_range(user_id, since, until)
+        if archived:
+            bump_data_version(user_scope(user_id))
+            db.session.commit()
+            deleted += archived
+    return deleted
+
+
+def purge_account(user_id, chunk_size=None):
+    """Delete a user and everything they own; returns the deleted counts."""
+    with using_user_shard(user_id):
+        receipts = delete_receipts(user_id, chunk_size=chunk_size)
+        budgets = _delete_in_chunks(Budget, user_id, chunk_size=chunk_size)
+        scope = user_scope(user_id)
+        db.session.execute(delete(DataVersion).where(DataVersion.scope == scope),
+                           bind_arguments={'bind': scope_bind(scope)})
+        db.session.commit()
+    delete_archive(user_id)
+    delete_reports(user_id)
+
+    db.session.execute(delete(User).where(User.id == user_id))
+    db.session.commit()
+    return {'receipts': receipts, 'budgets': budgets}
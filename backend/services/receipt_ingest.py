@@ -0,0 +1,208 @@
+"""Receipt creation with duplicate detection.
+
+Every new receipt stores its content fingerprint (models.fingerprints)
+and, when the client sent one, its ``Idempotency-Key``; both are unique
+per user. A retried or re-imported receipt is answered with the original
+instead of being stored twice:
+
+* ``create_receipt`` finds the original with one indexed lookup on
+  (user, key) or (user, fingerprint), falling back to the archive for old
+  purchase dates, and resolves races through the unique indexes.
+* ``import_receipts`` inserts a whole batch with ``ON CONFLICT DO
+  NOTHING`` on the fingerprint index, so already imported rows are
+  skipped by the database rather than checked one SELECT at a time.
+
+Items sent without a category are classified (services.categorizer) with
+one predict call per receipt or import batch.
+"""
+from datetime import datetime
+
+from sqlalchemy import select, or_, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from models import Receipt, ReceiptItem, db, bump_data_version, user_scope
+from models.archive import has_archive, archived_fingerprints
+from models.fingerprints import receipt_fingerprint
+from models.serializers import serialize_receipts
+from models.stores import resolve_store_id, store_key
+from services.categorizer import categorize_items
+from utils.money import DEFAULT_CURRENCY, to_cents
+
+MAX_IMPORT_RECEIPTS = 1000
+LOOKUP_CHUNK_SIZE = 500
+
+_UPSERT_DIALECTS = {'sqlite': sqlite, 'postgresql': postgresql}
+
+
+class IdempotencyKeyReused(ValueError):
+    pass
+
+
+def parse_receipt(data):
+    """Column values of a receipt payload (with its fingerprint, and the
+    store still as ``store_name``) and its item rows (category None when
+    not given)."""
+    if not store_key(data['store_name']):
+        raise ValueError('store_name must not be empty')
+    receipt = {
+        'store_name': data['store_name'],
+        'total_amount_cents': to_cents(data['total_amount']),
+        'currency': data.get('currency', DEFAULT_CURRENCY),
+        'purchase_date': datetime.fromisoformat(data['purchase_date'].replace('Z', '+00:00'))
+    }
+    items = [
+        {
+            'product_name': item['product_name'],
+            'quantity': item.get('quantity', 1),
+            'unit_price_cents': to_cents(item['unit_price']),
+            'total_price_cents': to_cents(item['total_price']),
+            'category': item.get('category') or None
+        }
+        for item in data.get('items', [])
+    ]
+    receipt['fingerprint'] = receipt_fingerprint(
+        receipt['store_name'], receipt['purchase_date'], receipt['total_amount_cents'], receipt['currency'],
+        [(item['product_name'], item['quantity'], item['total_price_cents']) for item in items]
+    )
+    return receipt, items
+
+
+def _find_existing(user_id, fingerprint, idempotency_key):
+    match = Receipt.fingerprint == fingerprint
+    if idempotency_key:
+        match = or_(match, Receipt.idempotency_key == idempotency_key)
+    existing = Receipt.query.filter(Receipt.user_id == user_id, match).all()
+    if idempotency_key:
+        for receipt in existing:
+            if receipt.idempotency_key == idempotency_key:
+                if receipt.fingerprint != fingerprint:
+                    raise IdempotencyKeyReused('Idempotency-Key was already used for a different receipt')
+                return receipt
+    return existing[0] if existing else None
+
+
+def _archived_duplicates(user_id, receipts):
+    """``{fingerprint: archived receipt id}`` for ``receipts`` already in the archive."""
+    if not receipts or not has_archive(user_id):
+        return {}
+    dates = [receipt['purchase_date'].replace(tzinfo=None) for receipt in receipts]
+    archived = archived_fingerprints(user_id, min(dates), max(dates))
+    return {
+        receipt['fingerprint']: archived[receipt['fingerprint']]
+        for receipt in receipts if receipt['fingerprint'] in archived
+    }
+
+
+def create_receipt(user_id, data, idempotency_key=None):
+    """Store a receipt unless it was already submitted; returns ``(receipt, created)``
+    with the stored (or original) receipt as a dict."""
+    values, items = parse_receipt(data)
+
+    existing = _find_existing(user_id, values['fingerprint'], idempotency_key)
+    if existing is not None:
+        return existing.to_dict(), False
+    archived = _archived_duplicates(user_id, [values])
+    if archived:
+        return serialize_receipts(user_id, receipt_id=archived[values['fingerprint']])[0], False
+
+    values['store_id'] = resolve_store_id(values.pop('store_name'))
+    categorize_items(items)
+    receipt = Receipt(user_id=user_id, idempotency_key=idempotency_key or None, **values)
+    db.session.add(receipt)
+    try:
+        db.session.flush()  # To get the receipt ID
+        for item in items:
+            db.session.add(ReceiptItem(receipt_id=receipt.id, **item))
+        bump_data_version(user_scope(user_id))
+        db.session.commit()
+    except IntegrityError:
+        # Lost a race with a concurrent submission of the same receipt or key
+        db.session.rollback()
+        existing = _find_existing(user_id, values['fingerprint'], idempotency_key)
+        if existing is None:
+            raise
+        return existing.to_dict(), False
+    return receipt.to_dict(), True
+
+
+def _insert_new(user_id, receipts):
+    """Insert ``receipts``, skipping fingerprints the user already has;
+    returns ``{fingerprint: id}`` of the inserted ones."""
+    table = Receipt.__table__
+    dialect = db.session.get_bind(mapper=Receipt.__mapper__).dialect.name
+    rows = [dict(receipt, user_id=user_id, created_at=datetime.utcnow()) for receipt in receipts]
+    if dialect in _UPSERT_DIALECTS:
+        statement = _UPSERT_DIALECTS[dialect].insert(table).on_conflict_do_nothing(
+            index_elements=['user_id', 'fingerprint']
+        )
+    else:
+        present = set(_existing_ids(user_id, [row['fingerprint'] for row in rows]))
+        rows = [row for row in rows if row['fingerprint'] not in present]
+        statement = insert(table)
+    if not rows:
+        return {}
+    inserted = db.session.execute(statement.returning(table.c.fingerprint, table.c.id), rows)
+    return dict(inserted.all())
+
+
+def _existing_ids(user_id, fingerprints):
+    found = {}
+    for start in range(0, len(fingerprints), LOOKUP_CHUNK_SIZE):
+        found.update(db.session.execute(
+            select(Receipt.fingerprint, Receipt.id).where(
+                Receipt.user_id == user_id, Receipt.fingerprint.in_(fingerprints[start:start + LOOKUP_CHUNK_SIZE])
+            )
+        ).all())
+    return found
+
+
+def import_receipts(user_id, payloads):
+    """Store a batch of receipts, skipping ones the user already has.
+
+    Returns one ``{'index', 'id', 'status'}`` result per payload, with
+    status ``created`` or ``duplicate`` (the id is then the original's).
+    Re-running an import is therefore safe and returns the same ids.
+    """
+    parsed = [parse_receipt(data) for data in payloads]
+
+    first_index = {}
+    for index, (receipt, _) in enumerate(parsed):
+        first_index.setdefault(receipt['fingerprint'], index)
+    unique = [parsed[index] for index in first_index.values()]
+
+    ids = _archived_duplicates(user_id, [receipt for receipt, _ in unique])
+    candidates = [(receipt, items) for receipt, items in unique if receipt['fingerprint'] not in ids]
+
+    store_ids = {}
+    rows = []
+    for receipt, _ in candidates:
+        name = receipt['store_name']
+        if name not in store_ids:
+            store_ids[name] = resolve_store_id(name)
+        rows.append({**{key: value for key, value in receipt.items() if key != 'store_name'},
+                     'store_id': store_ids[name]})
+    categorize_items([item for _, items in candidates for item in items])
+    created = _insert_new(user_id, rows)
+    item_rows = [
+        dict(item, receipt_id=created[receipt['fingerprint']])
+        for receipt, items in candidates if receipt['fingerprint'] in created
+        for item in items
+    ]
+    if item_rows:
+        db.session.execute(insert(ReceiptItem.__table__), item_rows)
+
+    skipped = [receipt['fingerprint'] for receipt, _ in candidates if receipt['fingerprint'] not in created]
+    ids.update(_existing_ids(user_id, skipped))
+    ids.update(created)
+
+    if created:
+        bump_data_version(user_scope(user_id))
+    db.session.commit()
+
+    results = []
+    for index, (receipt, _) in enumerate(parsed):
+        fingerprint = receipt['fingerprint']
+        is_new = fingerprint in created and first_index[fingerprint] == index
+        results.append({'index': index, 'id': ids.get(fingerprint), 'status': 'created' if is_new else 'duplicate'})
+    return results
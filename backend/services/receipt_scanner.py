@@ -0,0 +1,37 @@
+"""Receipt image scanning."""
+from datetime import datetime
+
+
+def scan_receipt_image(image=None):
+    """Extract store, total and items from a receipt image.
+
+    Mock implementation - replace with actual OCR logic.
+    """
+    return {
+        'store_name': 'SuperMart',
+        'total_amount': 45.67,
+        'purchase_date': datetime.now().isoformat(),
+        'items': [
+            {
+                'product_name': 'Organic Bananas',
+                'quantity': 2,
+                'unit_price': 1.99,
+                'total_price': 3.98,
+                'category': 'Fruits'
+            },
+            {
+                'product_name': 'Whole Milk',
+                'quantity': 1,
+                'unit_price': 4.50,
+                'total_price': 4.50,
+                'category': 'Dairy'
+            },
+            {
+                'product_name': 'Chicken Breast',
+                'quantity': 1,
+                'unit_price': 12.99,
+                'total_price': 12.99,
+                'category': 'Meat'
+            }
+        ]
+    }
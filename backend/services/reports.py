@@ -0,0 +1,171 @@
+"""Server-rendered spending report charts, cached on disk.
+
+Charts are drawn by the ``render_report`` job with matplotlib's Agg
+backend (and seaborn's styling) and saved as PNG or PDF under
+``<REPORT_CACHE_DIR>/user-<id>/``. A file is named after the user's data
+version and the day it was drawn for, the same inputs as the analytics
+ETags, so a cached chart is current exactly as long as the JSON it was
+drawn from; older renders of the same chart are removed when a new one
+is written. Serving a chart is then a file read.
+
+matplotlib and seaborn are imported on first render, in the job worker,
+so API workers never load them.
+"""
+import os
+import shutil
+from datetime import date, datetime
+
+from flask import current_app
+
+from models import get_data_version, user_scope
+from models.rows import receipt_summaries, product_rollups, budget_snapshots, begin_read_snapshot
+from services.analytics import SpendingTrends, CategoryBreakdown
+from utils.money import from_cents
+
+CHARTS = ('monthly-spending', 'categories', 'budget-burn', 'overview')
+FORMATS = {'png': 'image/png', 'pdf': 'application/pdf'}
+PIE_SLICES = 7
+PNG_DPI = 144
+
+
+def user_report_dir(user_id):
+    return os.path.join(current_app.config['REPORT_CACHE_DIR'], f'user-{int(user_id)}')
+
+
+def report_path(user_id, chart, fmt, version, day=None):
+    """Where the render of ``chart`` for one data version and day is cached."""
+    day = day or date.today()
+    return os.path.join(user_report_dir(user_id), f'{chart}-{version}-{day:%Y%m%d}.{fmt}')
+
+
+def cached_report(user_id, chart, fmt, version):
+    """Path of the current render, or None if it has not been drawn yet."""
+    path = report_path(user_id, chart, fmt, version)
+    return path if os.path.isfile(path) else None
+
+
+def delete_reports(user_id):
+    shutil.rmtree(user_report_dir(user_id), ignore_errors=True)
+
+
+def _monthly_spending(user_id, now):
+    trends = SpendingTrends(now)
+    for receipt in receipt_summaries(user_id, since=trends.start, until=trends.end):
+        trends.add(receipt)
+    # Every month of the window, so gaps show as empty bars rather than disappearing
+    months = []
+    year, month = trends.start.year, trends.start.month
+    while (year, month) <= (now.year, now.month):
+        months.append(f'{year:04d}-{month:02d}')
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return [(key, from_cents(trends.monthly_cents.get(key, 0))) for key in months]
+
+
+def _category_shares(user_id):
+    breakdown = CategoryBreakdown()
+    for rollup in product_rollups(user_id):
+        breakdown.add(rollup.category, rollup.total_spent_cents, rollup.item_count)
+    shares = sorted(((row['category'], row['total_spent']) for row in breakdown.payload()['categories']
+                     if row['total_spent'] > 0), key=lambda share: -share[1])
+    if len(shares) > PIE_SLICES:
+        rest = sum(spent for _, spent in shares[PIE_SLICES - 1:])
+        shares = shares[:PIE_SLICES - 1] + [('Everything else', rest)]
+    return shares
+
+
+def _budget_burn(user_id, now):
+    """``(name, spent %, elapsed %)`` for each budget active at ``now``."""
+    burn = []
+    for budget in budget_snapshots(user_id, active_at=now):
+        period = (budget.end_date - budget.start_date).total_seconds()
+        elapsed = (now - budget.start_date).total_seconds() / period * 100 if period > 0 else 100
+        spent = budget.spent_amount_cents / budget.total_budget_cents * 100 if budget.total_budget_cents > 0 else 0
+        burn.append((budget.name, spent, min(max(elapsed, 0), 100)))
+    return burn
+
+
+def _draw_monthly_spending(ax, months, palette):
+    import seaborn as sns
+    sns.barplot(x=[month for month, _ in months], y=[amount for _, amount in months], ax=ax, color=palette[0])
+    ax.set_title('Monthly spending (last 12 months)')
+    ax.set_xlabel('')
+    ax.set_ylabel('Spent')
+    ax.tick_params(axis='x', labelrotation=45)
+
+
+def _draw_categories(ax, shares, palette):
+    ax.set_title('Spending by category')
+    if not shares:
+        ax.text(0.5, 0.5, 'No items yet', ha='center', va='center', transform=ax.transAxes)
+        ax.set_axis_off()
+        return
+    ax.pie([spent for _, spent in shares], labels=[category for category, _ in shares],
+           colors=palette[:len(shares)], autopct='%1.0f%%', startangle=90, counterclock=False)
+    ax.set_aspect('equal')
+
+
+def _draw_budget_burn(ax, burn, palette):
+    ax.set_title('Budget burn (active budgets)')
+    if not burn:
+        ax.text(0.5, 0.5, 'No active budgets', ha='center', va='center', transform=ax.transAxes)
+        ax.set_axis_off()
+        return
+    positions = range(len(burn))
+    colors = [palette[3] if spent > elapsed else palette[2] for _, spent, elapsed in burn]
+    ax.barh(positions, [spent for _, spent, _ in burn], color=colors)
+    ax.scatter([elapsed for _, _, elapsed in burn], positions, marker='|', s=400, color='black', zorder=3,
+               label='Share of period elapsed')
+    ax.set_yticks(list(positions), [name for name, _, _ in burn])
+    ax.invert_yaxis()
+    ax.set_xlabel('% of budget spent')
+    ax.set_xlim(0, max(100, *(spent for _, spent, _ in burn)) * 1.05)
+    ax.legend(loc='lower right')
+
+
+def render_report(user_id, chart, fmt, now=None):
+    """Draw ``chart`` for a user into the report cache; returns the data
+    version it was drawn from."""
+    if chart not in CHARTS:
+        raise ValueError(f'Unknown chart: {chart}')
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown report format: {fmt}')
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import rc_context
+    from matplotlib.figure import Figure
+    import seaborn as sns
+
+    now = now or datetime.now()
+    begin_read_snapshot()
+    # Read before the data: a write landing in between leaves the file one
+    # version behind (re-rendered on the next request), never ahead
+    version = get_data_version(user_scope(user_id))
+
+    drawings = []
+    if chart in ('monthly-spending', 'overview'):
+        drawings.append((_draw_monthly_spending, _monthly_spending(user_id, now)))
+    if chart in ('categories', 'overview'):
+        drawings.append((_draw_categories, _category_shares(user_id)))
+    if chart in ('budget-burn', 'overview'):
+        drawings.append((_draw_budget_burn, _budget_burn(user_id, now)))
+
+    palette = sns.color_palette('deep', PIE_SLICES).as_hex()
+    with rc_context(sns.axes_style('whitegrid')):
+        figure = Figure(figsize=(9, 5 * len(drawings)), layout='constrained')
+        for ax, (draw, data) in zip(figure.subplots(len(drawings), 1, squeeze=False)[:, 0], drawings):
+            draw(ax, data, palette)
+
+        path = report_path(user_id, chart, fmt, version, now.date())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f'{path}.{os.getpid()}.tmp'
+        figure.savefig(temporary, format=fmt, dpi=PNG_DPI,
+                       metadata={'Title': f'BiteBudget {chart.replace("-", " ")}'} if fmt == 'pdf' else None)
+    os.replace(temporary, path)
+
+    # Older renders of this chart can never be served again
+    prefix = f'{chart}-'
+    for name in os.listdir(os.path.dirname(path)):
+        if name.startswith(prefix) and name.endswith(f'.{fmt}') and name != os.path.basename(path) \
+                and name[len(prefix):].split('-')[0].isdigit():
+            os.remove(os.path.join(os.path.dirname(path), name))
+    return version
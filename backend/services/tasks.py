@@ -0,0 +1,74 @@
+"""Job kinds run by the background worker (see services.jobs)."""
+from datetime import date
+
+from flask import current_app
+
+from services.jobs import job
+
+
+@job('scan_receipt', user_submittable=True)
+def scan_receipt(user_id, image=None):
+    from services.receipt_scanner import scan_receipt_image
+    return scan_receipt_image(image)
+
+
+@job('export_receipts', user_submittable=True)
+def export_receipts(user_id):
+    from models.serializers import serialize_receipts
+    return {'receipts': serialize_receipts(user_id)}
+
+
+@job('refresh_prices', user_submittable=True)
+def refresh_prices(user_id, products):
+    from routes.realtime_pricing import price_tracker
+    from utils.aio import worker_loop
+    return worker_loop.run(price_tracker.fetch_prices_async(products))
+
+
+@job('rollover_budgets')
+def rollover_budgets():
+    from services.budget_periods import rollover_budgets
+    return {'created': rollover_budgets()}
+
+
+@job('build_price_index')
+def build_price_index(since=None, min_users=None):
+    from services.price_index import build_price_index
+    rows = build_price_index(
+        since=date.fromisoformat(since) if since else None,
+        min_users=min_users or current_app.config['PRICE_INDEX_MIN_USERS']
+    )
+    return {'rows': rows}
+
+
+@job('archive_receipts')
+def archive_receipts(after_days=None):
+    from models.archive import archive_receipts
+    counts = archive_receipts(after_days=after_days)
+    return {'users': counts['users'], 'receipts': counts['receipts']}
+
+
+@job('purge_account')
+def purge_account(user_id):
+    from services.purge import purge_account
+    return purge_account(user_id)
+
+
+@job('train_category_model')
+def train_category_model():
+    from services.categorizer import train_category_model
+    return train_category_model()
+
+
+@job('reclassify_items')
+def reclassify_items(chunk_size=None, retrain=False):
+    from services.categorizer import train_category_model, reclassify_items, category_model, RECLASSIFY_CHUNK_SIZE
+    if retrain or not category_model().available:
+        train_category_model()
+    return {'reclassified': reclassify_items(chunk_size=chunk_size or RECLASSIFY_CHUNK_SIZE)}
+
+
+@job('render_report')
+def render_report(user_id, chart, fmt):
+    from services.reports import render_report
+    return {'chart': chart, 'format': fmt, 'version': render_report(user_id, chart, fmt)}
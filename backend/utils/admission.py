@@ -0,0 +1,344 @@
+"""Admission control for the expensive routes.
+
+Views decorated with ``@admission_control('<class>')`` belong to a route
+class (``analytics``, ``pricing``, ``scan``). Each class has:
+
+* a concurrency limit: at most ``limit`` of its requests run at once on
+  this host, across every gunicorn worker;
+* a bounded wait queue: up to ``queue`` more requests wait (FIFO) for a
+  slot, for at most ``ADMISSION_QUEUE_TIMEOUT`` seconds;
+* a per-user token bucket: ``rate`` requests per second with bursts of
+  ``burst``.
+
+A request over its user's rate gets 429, and a request that finds the
+queue full or waits too long gets 503, both immediately and with a
+``Retry-After`` header, so a burst of dashboard loads is shed instead of
+tying up the threads that serve logins and health checks. Routes without
+the decorator are never limited.
+
+The state lives in a small memory-mapped file (``ADMISSION_STATE_DIR``,
+``/dev/shm`` by default) locked with ``flock``, so every worker on the
+host sees the same slots, queues and buckets. Slots record the pid that
+holds them and are freed when that process is gone, so a killed worker
+does not leak capacity. ``GET /api/metrics`` reports queue depths and
+counters per class.
+"""
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, jsonify
+
+MAGIC = b'BBADMIT1'
+ROUTE_CLASSES = ('analytics', 'pricing', 'scan')
+
+_HEADER = struct.Struct('<8s')
+# admitted, queued, shed (queue full), shed (timed out), rate limited, service time EWMA (s)
+_COUNTERS = struct.Struct('<5Qd')
+# holder pid (0: free), since (time.monotonic)
+_SLOT = struct.Struct('<qd')
+# key (0: free), tokens, updated (time.monotonic)
+_BUCKET = struct.Struct('<Qdd')
+_BUCKET_PROBES = 8
+_POLL_MAX_SECONDS = 0.02
+
+
+class Rejected(Exception):
+    def __init__(self, status, message, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_limits(value, defaults, cast=int):
+    """Parse ``name=a:b,name=a:b`` into ``{name: (a, b)}`` over ``defaults``."""
+    limits = dict(defaults)
+    for entry in (part.strip() for part in value.split(',')):
+        if not entry:
+            continue
+        name, _, numbers = entry.partition('=')
+        first, _, second = numbers.partition(':')
+        limits[name.strip()] = (cast(first), cast(second))
+    return limits
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class AdmissionStore:
+    """Slots, queues and token buckets in a file shared by the host's workers.
+
+    ``classes`` maps a route class to ``(limit, queue, rate, burst)``. The
+    file name includes a digest of that layout, so workers started with a
+    different configuration never share (or resize) a file.
+    """
+
+    def __init__(self, directory, classes, bucket_slots=4096):
+        self.classes = dict(classes)
+        self.bucket_slots = bucket_slots
+        self.offsets = {}
+        offset = _HEADER.size
+        for name, (limit, queue, _, _) in self.classes.items():
+            self.offsets[name] = offset
+            offset += _COUNTERS.size + (limit + queue) * _SLOT.size
+        self.buckets_offset = offset
+        self.size = offset + bucket_slots * _BUCKET.size
+
+        layout = repr(sorted(self.classes.items())) + f'/{bucket_slots}'
+        digest = hashlib.blake2b(layout.encode('utf-8'), digest_size=6).hexdigest()
+        self.path = os.path.join(directory, f'bitebudget-admission-{digest}')
+        self._pid = None
+        self._map = None
+        self._lock = None
+
+    def _open(self):
+        if self._pid == os.getpid():
+            return
+        # A descriptor inherited across fork() shares its flock with the
+        # parent, so every process opens the file itself
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size != self.size:
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, self.size)
+                    os.pwrite(fd, _HEADER.pack(MAGIC), 0)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self._map = mmap.mmap(fd, self.size)
+        except Exception:
+            os.close(fd)
+            raise
+        self._fd, self._lock, self._pid = fd, threading.Lock(), os.getpid()
+
+    @contextmanager
+    def _locked(self):
+        self._open()
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield self._map
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    # Slots and counters
+
+    def _slot_offsets(self, name):
+        limit, queue, _, _ = self.classes[name]
+        start = self.offsets[name] + _COUNTERS.size
+        running = [start + index * _SLOT.size for index in range(limit)]
+        waiting = [start + (limit + index) * _SLOT.size for index in range(queue)]
+        return running, waiting
+
+    def _holders(self, buf, offsets):
+        """``{offset: (pid, since)}`` of the occupied slots, freeing dead holders."""
+        holders, me = {}, os.getpid()
+        for offset in offsets:
+            pid, since = _SLOT.unpack_from(buf, offset)
+            if pid == 0:
+                continue
+            if pid != me and not _alive(pid):
+                _SLOT.pack_into(buf, offset, 0, 0.0)
+                continue
+            holders[offset] = (pid, since)
+        return holders
+
+    def _count(self, buf, name, field, value=1):
+        counters = list(_COUNTERS.unpack_from(buf, self.offsets[name]))
+        counters[field] += value
+        _COUNTERS.pack_into(buf, self.offsets[name], *counters)
+
+    def _retry_after(self, buf, name, queued):
+        limit = self.classes[name][0]
+        service_seconds = _COUNTERS.unpack_from(buf, self.offsets[name])[5]
+        return max(1, math.ceil(service_seconds * (queued + 1) / limit))
+
+    # Token buckets
+
+    def _take_token(self, buf, key, rate, burst, now):
+        """Spend one token of ``key``'s bucket; returns seconds until one is
+        available when the bucket is empty, else 0."""
+        first = hash(key) % self.bucket_slots
+        victim = None
+        for probe in range(_BUCKET_PROBES):
+            offset = self.buckets_offset + ((first + probe) % self.bucket_slots) * _BUCKET.size
+            slot_key, tokens, updated = _BUCKET.unpack_from(buf, offset)
+            if slot_key == key:
+                tokens = min(burst, tokens + (now - updated) * rate)
+                break
+            rank = updated if slot_key else -math.inf
+            if victim is None or rank < victim[1]:
+                victim = (offset, rank)
+        else:
+            # Not tracked (or evicted, which only happens to the least recently
+            # used bucket in the probe window): start from a full bucket
+            offset, tokens = victim[0], float(burst)
+
+        if tokens < 1:
+            _BUCKET.pack_into(buf, offset, key, tokens, now)
+            return (1 - tokens) / rate
+        _BUCKET.pack_into(buf, offset, key, tokens - 1, now)
+        return 0
+
+    # Admission
+
+    def admit(self, name, user_id, timeout):
+        """Wait for a slot of route class ``name``; returns the slot to pass
+        to ``release`` or raises ``Rejected``."""
+        limit, queue, rate, burst = self.classes[name]
+        running, waiting = self._slot_offsets(name)
+        me = os.getpid()
+
+        with self._locked() as buf:
+            now = time.monotonic()
+            if user_id is not None and rate > 0:
+                key = int(user_id) * len(ROUTE_CLASSES) + ROUTE_CLASSES.index(name) + 1
+                wait = self._take_token(buf, key, rate, burst, now)
+                if wait:
+                    self._count(buf, name, 4)
+                    raise Rejected(429, 'Too many requests', max(1, math.ceil(wait)))
+
+            busy = self._holders(buf, running)
+            queued = self._holders(buf, waiting)
+            if not queued and len(busy) < limit:
+                return self._occupy(buf, name, running, busy, now)
+
+            free = [offset for offset in waiting if offset not in queued]
+            if not free:
+                self._count(buf, name, 2)
+                raise Rejected(503, 'Server busy, try again later', self._retry_after(buf, name, len(queued)))
+            ticket = free[0]
+            _SLOT.pack_into(buf, ticket, me, now)
+            self._count(buf, name, 1)
+
+        deadline = time.monotonic() + timeout
+        delay = 0.002
+        while True:
+            time.sleep(delay)
+            delay = min(delay * 2, _POLL_MAX_SECONDS)
+            with self._locked() as buf:
+                busy = self._holders(buf, running)
+                queued = self._holders(buf, waiting)
+                mine = queued.get(ticket)
+                ahead = sum(1 for holder in queued.values() if mine and holder[1] < mine[1])
+                if mine and ahead < limit - len(busy):
+                    _SLOT.pack_into(buf, ticket, 0, 0.0)
+                    return self._occupy(buf, name, running, busy, time.monotonic())
+                if time.monotonic() >= deadline:
+                    _SLOT.pack_into(buf, ticket, 0, 0.0)
+                    self._count(buf, name, 3)
+                    raise Rejected(503, 'Server busy, try again later', self._retry_after(buf, name, len(queued)))
+
+    def _occupy(self, buf, name, running, busy, now):
+        slot = next(offset for offset in running if offset not in busy)
+        _SLOT.pack_into(buf, slot, os.getpid(), now)
+        self._count(buf, name, 0)
+        return slot
+
+    def release(self, name, slot):
+        with self._locked() as buf:
+            pid, since = _SLOT.unpack_from(buf, slot)
+            if pid != os.getpid():
+                return
+            _SLOT.pack_into(buf, slot, 0, 0.0)
+            elapsed = time.monotonic() - since
+            counters = list(_COUNTERS.unpack_from(buf, self.offsets[name]))
+            counters[5] = elapsed if counters[5] == 0 else counters[5] * 0.8 + elapsed * 0.2
+            _COUNTERS.pack_into(buf, self.offsets[name], *counters)
+
+    def metrics(self):
+        snapshot = {}
+        with self._locked() as buf:
+            for name, (limit, queue, rate, burst) in self.classes.items():
+                running, waiting = self._slot_offsets(name)
+                admitted, queued, shed_full, shed_timeout, rate_limited, service = \
+                    _COUNTERS.unpack_from(buf, self.offsets[name])
+                snapshot[name] = {
+                    'limit': limit,
+                    'queue_limit': queue,
+                    'in_flight': len(self._holders(buf, running)),
+                    'queue_depth': len(self._holders(buf, waiting)),
+                    'admitted': admitted,
+                    'queued': queued,
+                    'shed_queue_full': shed_full,
+                    'shed_timeout': shed_timeout,
+                    'rate_limited': rate_limited,
+                    'avg_service_ms': round(service * 1000, 1)
+                }
+        return snapshot
+
+
+def init_admission(app):
+    """Build the host-wide admission store from the ADMISSION_* settings."""
+    if not app.config['ADMISSION_ENABLED']:
+        return
+    limits = app.config['ADMISSION_LIMITS']
+    rates = app.config['ADMISSION_RATES']
+    classes = {
+        name: (*limits[name], *rates[name])
+        for name in ROUTE_CLASSES
+    }
+    app.extensions['admission'] = AdmissionStore(app.config['ADMISSION_STATE_DIR'], classes)
+
+
+def default_state_dir():
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def admission_metrics():
+    store = current_app.extensions.get('admission')
+    return store.metrics() if store else {}
+
+
+def admission_control(route_class):
+    """Admit the view's requests through ``route_class``'s limits.
+
+    Place it below ``@jwt_required`` (buckets are per user) and below
+    ``@conditional`` so revalidations answered with 304 are not limited.
+    The slot is released when the view returns.
+    """
+    if route_class not in ROUTE_CLASSES:
+        raise ValueError(f'Unknown route class {route_class!r}')
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            store = current_app.extensions.get('admission')
+            if store is None:
+                return current_app.ensure_sync(view)(*args, **kwargs)
+
+            from flask_jwt_extended import get_jwt_identity
+            try:
+                user_id = get_jwt_identity()
+            except RuntimeError:
+                user_id = None
+            try:
+                slot = store.admit(route_class, user_id, current_app.config['ADMISSION_QUEUE_TIMEOUT'])
+            except Rejected as rejected:
+                response = jsonify({'error': str(rejected), 'retry_after': rejected.retry_after})
+                response.status_code = rejected.status
+                response.headers['Retry-After'] = str(rejected.retry_after)
+                return response
+            try:
+                return current_app.ensure_sync(view)(*args, **kwargs)
+            finally:
+                store.release(route_class, slot)
+        return wrapper
+    return decorator
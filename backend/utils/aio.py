@@ -0,0 +1,84 @@
+"""One event loop and one aiohttp connection pool per worker process.
+
+Async views (the pricing blueprint) are run on a long-lived event loop in
+a background thread instead of a fresh loop per request, so concurrent
+requests share the loop and the pooled, keep-alive HTTP connections to
+the store APIs. The request thread waits for its coroutine; the
+coroutine runs in a copy of the request's context, so ``request``, ``g``
+and the JWT helpers work inside it. Blocking calls (database queries)
+should be wrapped in ``asyncio.to_thread`` to keep the loop free.
+
+The loop is started lazily and restarted after ``fork()``, so it is safe
+with gunicorn's ``preload_app``.
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import os
+import threading
+
+
+class WorkerLoop:
+    def __init__(self, connection_limit=100, request_timeout=10):
+        self.connection_limit = connection_limit
+        self.request_timeout = request_timeout
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+        self._session = None
+
+    def loop(self):
+        if self._loop is None or self._pid != os.getpid():
+            with self._lock:
+                if self._loop is None or self._pid != os.getpid():
+                    loop = asyncio.new_event_loop()
+                    thread = threading.Thread(
+                        target=loop.run_forever, name='worker-event-loop', daemon=True
+                    )
+                    thread.start()
+                    self._loop, self._pid, self._session = loop, os.getpid(), None
+        return self._loop
+
+    def run(self, coro, timeout=None):
+        """Run ``coro`` on the worker loop in the caller's context and wait for it."""
+        loop = self.loop()
+        context = contextvars.copy_context()
+        future = concurrent.futures.Future()
+        tasks = []
+
+        def start():
+            task = loop.create_task(coro, context=context)
+            tasks.append(task)
+
+            def done(task):
+                if task.cancelled():
+                    future.cancel()
+                elif task.exception() is not None:
+                    future.set_exception(task.exception())
+                else:
+                    future.set_result(task.result())
+            task.add_done_callback(done)
+
+        loop.call_soon_threadsafe(start)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            loop.call_soon_threadsafe(lambda: tasks and tasks[0].cancel())
+            raise
+
+    async def http_session(self):
+        """The worker's shared aiohttp session (call from the worker loop)."""
+        import aiohttp
+
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connection_limit),
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout)
+            )
+        return self._session
+
+
+worker_loop = WorkerLoop(
+    connection_limit=int(os.environ.get('HTTP_POOL_SIZE', 100)),
+    request_timeout=float(os.environ.get('HTTP_TIMEOUT', 10))
+)
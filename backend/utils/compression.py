@@ -0,0 +1,92 @@
+from flask import request, current_app
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'text/csv',
+    'text/plain',
+    'text/html',
+}
+
+
+def init_compression(app):
+    """Register response finalization: validators first, then compression."""
+    app.after_request(_finalize_response)
+
+
+def _finalize_response(response):
+    if request.method == 'GET' and response.status_code == 200 and not response.is_streamed:
+        # Views decorated with @conditional already set an ETag from the
+        # data version; everything else gets one from the body.
+        if 'ETag' not in response.headers and response.mimetype == 'application/json':
+            response.add_etag(weak=True)
+        response.make_conditional(request)
+
+    return _compress(response)
+
+
+def _choose_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def _compressor(encoding, config):
+    if encoding == 'br':
+        return brotli.Compressor(quality=config['COMPRESS_BR_LEVEL'])
+    return zlib.compressobj(config['COMPRESS_LEVEL'], zlib.DEFLATED, 31)
+
+
+def _compress(response):
+    config = current_app.config
+
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    compressor = _compressor(encoding, config)
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.iter_encoded(), compressor, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < config['COMPRESS_MIN_SIZE']:
+            return response
+        if encoding == 'br':
+            data = compressor.process(body) + compressor.finish()
+        else:
+            data = compressor.compress(body) + compressor.flush()
+        response.set_data(data)
+
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def _compress_stream(chunks, compressor, encoding):
+    """Compress a generator response chunk by chunk, flushing each chunk
+    so clients see data as soon as the view yields it."""
+    for chunk in chunks:
+        if encoding == 'br':
+            data = compressor.process(chunk) + compressor.flush()
+        else:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+
+    yield compressor.finish() if encoding == 'br' else compressor.flush()
@@ -0,0 +1,45 @@
+from flask import request, current_app, make_response
+from flask_jwt_extended import get_jwt_identity
+from datetime import date
+from functools import wraps
+import hashlib
+
+from models import get_data_version, user_scope
+
+
+def weak_etag(*parts):
+    """Build an ETag value from the parts that determine a response body."""
+    digest = hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=12)
+    return digest.hexdigest()
+
+
+def current_user_scope():
+    return user_scope(get_jwt_identity())
+
+
+def conditional(scope_fn):
+    """Answer conditional GETs from the scope's data version.
+
+    The weak ETag is derived from the request URL, the data version of
+    the scope returned by ``scope_fn`` and today's date (several payloads
+    depend on ``datetime.now()``). A matching ``If-None-Match`` returns
+    304 before the view runs, so unchanged payloads are never rebuilt.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            scope = scope_fn()
+            etag = weak_etag(request.full_path, scope, get_data_version(scope), date.today())
+
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(current_app.ensure_sync(view)(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
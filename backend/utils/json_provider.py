@@ -0,0 +1,63 @@
+from flask.json.provider import DefaultJSONProvider
+from datetime import date, datetime
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, fall back to the stdlib json module
+    orjson = None
+
+
+class BiteBudgetJSONProvider(DefaultJSONProvider):
+    """JSON provider that uses orjson when it is installed.
+
+    Datetimes are always written as ISO 8601 strings (the same format the
+    models' ``to_dict()`` methods produce), so serializers can hand raw
+    ``datetime`` values from SQL rows straight to ``jsonify``.
+
+    orjson writes non-ASCII characters as raw UTF-8 rather than the
+    ``\\uXXXX`` escapes Flask's default (``ensure_ascii=True``) writes, so
+    "Jamón" goes out as ``"Jamón"``; both decode to the same string. Setting
+    ``app.json.ensure_ascii = True``, or passing ``ensure_ascii`` to
+    ``dumps``, routes encoding through the stdlib ``json`` module to get
+    the escapes back.
+    """
+
+    ensure_ascii = False
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, (datetime, date)):
+            return o.isoformat()
+        if isinstance(o, Decimal):
+            return float(o)
+        return DefaultJSONProvider.default(o)
+
+    def _orjson_options(self):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs or self.ensure_ascii:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._orjson_options()).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        if orjson is None or pretty or self.ensure_ascii:
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(
+            obj,
+            default=self.default,
+            option=self._orjson_options() | orjson.OPT_APPEND_NEWLINE
+        )
+        return self._app.response_class(body, mimetype=self.mimetype)
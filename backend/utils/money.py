@@ -0,0 +1,30 @@
+"""Money helpers.
+
+Amounts are stored as integer minor units (cents) so that SQL ``SUM()``
+is exact; the API keeps exposing them as decimal numbers.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+DEFAULT_CURRENCY = 'MXN'
+
+_CENT = Decimal('0.01')
+
+
+def to_cents(amount):
+    """Convert a decimal amount (number or numeric string) to integer cents."""
+    if amount is None:
+        return None
+    return int(Decimal(str(amount)).quantize(_CENT, rounding=ROUND_HALF_UP).scaleb(2))
+
+
+def from_cents(cents):
+    """Convert integer cents to a float for JSON responses."""
+    if cents is None:
+        return None
+    return int(cents) / 100
+
+
+def cents_to_decimal(cents):
+    if cents is None:
+        return None
+    return Decimal(int(cents)).scaleb(-2)
@@ -0,0 +1,257 @@
+"""In-process pub/sub hub behind the server-sent event streams.
+
+Events are appended to a small ring buffer per channel (``user:<id>``,
+``product:<normalized name>``) and subscribers are woken through one
+event each: a ``threading.Event`` for streams served by a WSGI thread, or
+an ``asyncio.Event`` for streams on the stream server's event loop
+(services.price_stream), where an idle stream costs a cursor and a
+parked coroutine rather than a thread. A reconnecting client replays
+what it missed from the ring buffers using its ``Last-Event-ID``.
+
+Event ids are ``<milliseconds>-<sequence>`` strings, ordered across all
+channels. With ``SSE_REDIS_URL`` set, publishes go through one Redis (or
+Redis-compatible) stream instead, and every process delivers the stream
+into its local hub, so API workers and the job worker see the same events
+with the same ids.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+def event_key(event_id):
+    milliseconds, _, sequence = str(event_id).partition('-')
+    try:
+        return int(milliseconds), int(sequence or 0)
+    except ValueError:
+        return 0, 0
+
+
+class Channel:
+    __slots__ = ('events', 'subscribers', 'last_active')
+
+    def __init__(self, replay_size):
+        self.events = deque(maxlen=replay_size)
+        self.subscribers = set()
+        self.last_active = time.monotonic()
+
+
+def format_event(event_id, event, data, dumps):
+    return f"id: {event_id}\nevent: {event}\ndata: {dumps(data)}\n\n"
+
+
+class Subscription:
+    def __init__(self, hub, channels, loop=None):
+        self.hub = hub
+        self.channels = list(dict.fromkeys(channels))
+        self.loop = loop
+        self.wakeup = asyncio.Event() if loop else threading.Event()
+
+    def events_after(self, last_id):
+        """Buffered events newer than ``last_id`` on this subscription's channels."""
+        return self.hub.events_after(self.channels, last_id)
+
+    def wait(self, timeout):
+        """Block until something is published (True) or ``timeout`` passes (False)."""
+        woken = self.wakeup.wait(timeout)
+        self.wakeup.clear()
+        return woken
+
+    async def wait_async(self, timeout):
+        """``wait`` for subscriptions made with a ``loop``."""
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+            woken = True
+        except asyncio.TimeoutError:
+            woken = False
+        self.wakeup.clear()
+        return woken
+
+    def notify(self):
+        if self.loop is None:
+            self.wakeup.set()
+        elif not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class PubSubHub:
+    def __init__(self, replay_size=100, replay_seconds=300):
+        self.replay_size = replay_size
+        self.replay_seconds = replay_seconds
+        self._lock = threading.Lock()
+        self._channels = {}
+        self._last_id = (0, 0)
+        self._next_sweep = 0
+        self._open_streams = 0
+        self.backplane = None
+
+    def configure(self, replay_size=None, replay_seconds=None, redis_url=None):
+        if replay_size:
+            self.replay_size = replay_size
+        if replay_seconds:
+            self.replay_seconds = replay_seconds
+        self.backplane = RedisBackplane(redis_url, self) if redis_url else None
+
+    def _next_id(self):
+        milliseconds = int(time.time() * 1000)
+        last_ms, last_sequence = self._last_id
+        self._last_id = (milliseconds, 0) if milliseconds > last_ms else (last_ms, last_sequence + 1)
+        return '%d-%d' % self._last_id
+
+    def last_event_id(self):
+        return '%d-%d' % self._last_id
+
+    def publish(self, channel, event, data):
+        if self.backplane:
+            self.backplane.publish(channel, event, data)
+        else:
+            with self._lock:
+                event_id = self._next_id()
+            self.deliver(channel, event_id, event, data)
+
+    def deliver(self, channel_name, event_id, event, data):
+        with self._lock:
+            self._last_id = max(self._last_id, event_key(event_id))
+            channel = self._channels.get(channel_name)
+            if channel is None:
+                channel = self._channels[channel_name] = Channel(self.replay_size)
+            channel.events.append((event_id, event, data))
+            channel.last_active = time.monotonic()
+            subscribers = list(channel.subscribers)
+            self._sweep()
+        for subscription in subscribers:
+            subscription.notify()
+
+    def subscribe(self, channels, loop=None):
+        """Subscribe to ``channels``; pass the running ``loop`` to wait with ``wait_async``."""
+        if self.backplane:
+            self.backplane.start()
+        subscription = Subscription(self, channels, loop)
+        with self._lock:
+            for channel_name in subscription.channels:
+                channel = self._channels.get(channel_name)
+                if channel is None:
+                    channel = self._channels[channel_name] = Channel(self.replay_size)
+                channel.subscribers.add(subscription)
+        return subscription
+
+    def open_stream(self, limit):
+        """Count a stream held by a WSGI thread; False once ``limit`` are open."""
+        with self._lock:
+            if self._open_streams >= limit:
+                return False
+            self._open_streams += 1
+            return True
+
+    def close_stream(self):
+        with self._lock:
+            self._open_streams -= 1
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel_name in subscription.channels:
+                channel = self._channels.get(channel_name)
+                if channel is not None:
+                    channel.subscribers.discard(subscription)
+                    channel.last_active = time.monotonic()
+
+    def events_after(self, channels, last_id):
+        after = event_key(last_id)
+        with self._lock:
+            events = [
+                entry
+                for channel_name in channels if channel_name in self._channels
+                for entry in self._channels[channel_name].events
+                if event_key(entry[0]) > after
+            ]
+        return sorted(events, key=lambda entry: event_key(entry[0]))
+
+    def _sweep(self):
+        """Drop channels nobody listens to once their replay window has passed."""
+        now = time.monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.replay_seconds / 4
+        idle = [
+            channel_name for channel_name, channel in self._channels.items()
+            if not channel.subscribers and now - channel.last_active > self.replay_seconds
+        ]
+        for channel_name in idle:
+            del self._channels[channel_name]
+
+
+class RedisBackplane:
+    """Fan events out across processes through one Redis stream."""
+
+    STREAM = 'bitebudget:events'
+    MAX_LENGTH = 10000
+
+    def __init__(self, url, hub):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('SSE_REDIS_URL is set but the redis package is not installed') from None
+
+        self.client = redis.Redis.from_url(url)
+        self.hub = hub
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def publish(self, channel, event, data):
+        self.client.xadd(
+            self.STREAM,
+            {'channel': channel, 'event': event, 'data': json.dumps(data, default=str)},
+            maxlen=self.MAX_LENGTH,
+            approximate=True
+        )
+
+    def start(self):
+        """Start this process's reader thread (once per process)."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._read, name='pubsub-backplane', daemon=True).start()
+
+    def _read(self):
+        # Backfill the replay window so Last-Event-ID works right after a restart
+        last_id = '%d-0' % int((time.time() - self.hub.replay_seconds) * 1000)
+        while True:
+            try:
+                for _, entries in self.client.xread({self.STREAM: last_id}, block=5000, count=500) or []:
+                    for entry_id, fields in entries:
+                        last_id = entry_id.decode()
+                        self.hub.deliver(
+                            fields[b'channel'].decode(),
+                            last_id,
+                            fields[b'event'].decode(),
+                            json.loads(fields[b'data'])
+                        )
+            except Exception:
+                time.sleep(1)
+
+
+hub = PubSubHub()
+
+
+def init_pubsub(app):
+    hub.configure(
+        replay_size=app.config['SSE_REPLAY_SIZE'],
+        replay_seconds=app.config['SSE_REPLAY_SECONDS'],
+        redis_url=app.config['SSE_REDIS_URL']
+    )
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+def product_channel(product_key):
+    return f'product:{product_key}'
@@ -0,0 +1,347 @@
+"""Optional per-user sharding of receipts and budgets.
+
+With ``SHARD_DATABASE_URLS`` set, the ``receipt``, ``receipt_item`` and
+``budget`` tables (and each user's data-version row) live in one of N
+shard databases, while users, products, jobs and the price index stay in
+the main database. Every user is pinned to one shard (``user.shard``), so
+all of a user's rows sit together and writes by users on different
+shards never wait on the same SQLite write lock.
+
+``ShardedSession`` (the class behind ``db.session``) picks the engine per
+statement: sharded tables go to the shard selected with ``using_shard`` /
+``using_user_shard``, or else to the shard of the request's JWT identity.
+Shards are registered as Flask-SQLAlchemy binds (``shard:<n>``); a shard
+URL equal to the main database URL reuses the main engine, which is how
+an existing database becomes shard 0.
+
+Statements must not join sharded and global tables, and a shard
+database has no users or stores for its rows to reference: foreign keys
+from sharded tables to global ones are only created in the main
+database (``shard_schema``), so on a separate shard they are not enforced. Jobs and commands
+that read every user's rows loop over ``shard_ids()``; ``move_user``
+copies a user's rows to another shard (``flask shard-move-user`` and
+``flask shard-rebalance``).
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import current_app, g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import select, func, delete, insert, inspect, text
+from sqlalchemy.sql.util import find_tables
+
+SHARDED_TABLES = frozenset({'receipt', 'receipt_item', 'budget'})
+
+_selected_shard = ContextVar('bitebudget_shard', default=None)
+_building_shard_schema = ContextVar('bitebudget_shard_schema', default=False)
+
+
+class ShardRoutingError(RuntimeError):
+    pass
+
+
+def configure_shards(app, urls):
+    """Register the shard databases as binds (before ``db.init_app``)."""
+    urls = [url.strip() for url in urls if url.strip()]
+    if not urls:
+        return
+    binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+    keys = []
+    for index, url in enumerate(urls):
+        if url == app.config['SQLALCHEMY_DATABASE_URI']:
+            keys.append(None)
+        else:
+            binds[f'shard:{index}'] = url
+            keys.append(f'shard:{index}')
+    app.extensions['shards'] = keys
+
+
+def _shard_keys():
+    return current_app.extensions.get('shards')
+
+
+def sharding_enabled():
+    return bool(_shard_keys())
+
+
+def shard_ids():
+    """Every shard number (just ``[0]`` when sharding is off)."""
+    return list(range(len(_shard_keys() or [None])))
+
+
+def shard_url(shard):
+    key = (_shard_keys() or [None])[shard]
+    return current_app.config['SQLALCHEMY_BINDS'][key] if key else current_app.config['SQLALCHEMY_DATABASE_URI']
+
+
+def shard_engine(shard):
+    from app import db
+    keys = _shard_keys() or [None]
+    if not 0 <= shard < len(keys):
+        raise ShardRoutingError(f'Unknown shard {shard} (have {len(keys)})')
+    return db.engines[keys[shard]]
+
+
+def user_shard(user_id):
+    """The shard a user's rows live on, cached for the rest of the request."""
+    if not sharding_enabled():
+        return 0
+    cache = g.setdefault('_user_shards', {}) if has_request_context() else {}
+    user_id = int(user_id)
+    if user_id not in cache:
+        from app import db
+        from models import User
+        with db.engine.connect() as conn:
+            shard = conn.execute(select(User.shard).where(User.id == user_id)).scalar()
+        if shard is None:
+            raise ShardRoutingError(f'No shard recorded for user {user_id}')
+        cache[user_id] = shard
+    return cache[user_id]
+
+
+def assign_shard():
+    """The shard for a new user: the one with the fewest users."""
+    if not sharding_enabled():
+        return 0
+    from app import db
+    from models import User
+    counts = dict(db.session.execute(select(User.shard, func.count(User.id)).group_by(User.shard)).all())
+    return min(shard_ids(), key=lambda shard: (counts.get(shard, 0), shard))
+
+
+@contextmanager
+def using_shard(shard):
+    token = _selected_shard.set(shard)
+    try:
+        yield shard
+    finally:
+        _selected_shard.reset(token)
+
+
+def using_user_shard(user_id):
+    return using_shard(user_shard(user_id))
+
+
+def current_shard():
+    shard = _selected_shard.get()
+    if shard is not None:
+        return shard
+    if has_request_context():
+        from flask_jwt_extended import get_jwt_identity
+        try:
+            identity = get_jwt_identity()
+        except RuntimeError:
+            identity = None
+        if identity is not None:
+            return user_shard(identity)
+    raise ShardRoutingError('No shard selected: use using_shard() outside authenticated requests')
+
+
+def scope_bind(scope):
+    """Engine holding the data-version row of ``scope`` (None: the main database)."""
+    if not sharding_enabled() or not scope.startswith('user:'):
+        return None
+    return shard_engine(user_shard(scope.split(':', 1)[1]))
+
+
+@contextmanager
+def shard_schema():
+    """Mark DDL run inside the block as building a separate shard database."""
+    token = _building_shard_schema.set(True)
+    try:
+        yield
+    finally:
+        _building_shard_schema.reset(token)
+
+
+def crosses_shards(constraint):
+    """Whether a foreign key points from a sharded table to a global one."""
+    return constraint.table.name in SHARDED_TABLES and constraint.referred_table.name not in SHARDED_TABLES
+
+
+def created_here(constraint):
+    """Whether ``constraint`` belongs in the database whose DDL is being built."""
+    return not (_building_shard_schema.get() and crosses_shards(constraint))
+
+
+def declare_shard_foreign_keys(metadata):
+    """Leave foreign keys from sharded tables to global ones out of shard databases."""
+    for table in metadata.tables.values():
+        for constraint in table.foreign_key_constraints:
+            if crosses_shards(constraint):
+                constraint.ddl_if(callable_=lambda ddl, target, bind, **kw: created_here(target))
+
+
+def _is_sharded(mapper, clause):
+    if mapper is not None:
+        return inspect(mapper).local_table.name in SHARDED_TABLES
+    if clause is not None:
+        return any(
+            getattr(table, 'name', None) in SHARDED_TABLES
+            for table in find_tables(clause, include_crud=True, include_joins=True)
+        )
+    return False
+
+
+class ShardedSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and sharding_enabled() and _is_sharded(mapper, clause):
+            return shard_engine(current_shard())
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _user_rows(conn, table, user_id):
+    return [dict(row) for row in conn.execute(select(table).where(table.c.user_id == user_id)).mappings()]
+
+
+def _insert_keeping_ids(conn, table, rows):
+    """Insert ``rows``, keeping each id unless the target already uses it.
+
+    Returns ``{old id: new id}`` for the rows that had to be renumbered.
+    """
+    ids = [row['id'] for row in rows]
+    taken = set()
+    for start in range(0, len(ids), 500):
+        taken.update(conn.execute(select(table.c.id).where(table.c.id.in_(ids[start:start + 500]))).scalars())
+
+    keep = [row for row in rows if row['id'] not in taken]
+    if keep:
+        conn.execute(insert(table), keep)
+    renumbered = {}
+    for row in rows:
+        if row['id'] in taken:
+            values = {key: value for key, value in row.items() if key != 'id'}
+            renumbered[row['id']] = conn.execute(insert(table).values(**values)).inserted_primary_key[0]
+    return renumbered
+
+
+def _copy_user(source, target, user_id):
+    """Copy a user's receipts, items, budgets and data version from ``source``
+    to ``target`` (two connections). Returns the number of rows copied."""
+    from models import Receipt, ReceiptItem, Budget, DataVersion, user_scope
+    receipts, items, budgets = Receipt.__table__, ReceiptItem.__table__, Budget.__table__
+    versions = DataVersion.__table__
+
+    receipt_rows = _user_rows(source, receipts, user_id)
+    item_rows = [dict(row) for row in source.execute(
+        select(items).join(receipts).where(receipts.c.user_id == user_id)
+    ).mappings()]
+    budget_rows = _user_rows(source, budgets, user_id)
+
+    renumbered = _insert_keeping_ids(target, receipts, receipt_rows)
+    for row in item_rows:
+        row['receipt_id'] = renumbered.get(row['receipt_id'], row['receipt_id'])
+    _insert_keeping_ids(target, items, item_rows)
+    _insert_keeping_ids(target, budgets, budget_rows)
+
+    # Bump the version past both copies so no cached response survives the move
+    scope = user_scope(user_id)
+    version = max(
+        source.execute(select(versions.c.version).where(versions.c.scope == scope)).scalar() or 0,
+        target.execute(select(versions.c.version).where(versions.c.scope == scope)).scalar() or 0
+    ) + 1
+    target.execute(delete(versions).where(versions.c.scope == scope))
+    target.execute(insert(versions).values(scope=scope, version=version))
+    return len(receipt_rows) + len(item_rows) + len(budget_rows)
+
+
+def _delete_user(conn, user_id):
+    from models import Receipt, ReceiptItem, Budget, DataVersion, user_scope
+    receipts = Receipt.__table__
+    conn.execute(delete(ReceiptItem.__table__).where(
+        ReceiptItem.__table__.c.receipt_id.in_(select(receipts.c.id).where(receipts.c.user_id == user_id))
+    ))
+    conn.execute(delete(receipts).where(receipts.c.user_id == user_id))
+    conn.execute(delete(Budget.__table__).where(Budget.__table__.c.user_id == user_id))
+    conn.execute(delete(DataVersion.__table__).where(DataVersion.__table__.c.scope == user_scope(user_id)))
+
+
+def move_user(user_id, target_shard):
+    """Move a user's rows to ``target_shard`` and repoint ``user.shard``.
+
+    The source shard is write-locked for the whole move. Rows are copied
+    (keeping ids that are free on the target, renumbering the rest), the
+    user is repointed in the main database, and then the source rows are
+    deleted. A crash before the repoint leaves the user on the source with
+    a stale copy on the target that the next move overwrites; a crash after
+    it leaves stale source rows that ``purge_strays`` removes. A write that
+    resolved the user's shard before the repoint and was waiting on the
+    lock still lands on the source, so move users while they are idle.
+    Returns the number of rows moved.
+    """
+    from app import db
+    from models import User
+
+    source_shard = user_shard(user_id)
+    if source_shard == target_shard:
+        return 0
+
+    source_engine, target_engine = shard_engine(source_shard), shard_engine(target_shard)
+    with source_engine.connect() as source:
+        if source.dialect.name == 'sqlite':
+            source.exec_driver_sql('BEGIN IMMEDIATE')
+        else:
+            source.begin()
+            source.execute(text('LOCK TABLE receipt, receipt_item, budget IN SHARE ROW EXCLUSIVE MODE'))
+        try:
+            with target_engine.begin() as target:
+                _delete_user(target, user_id)
+                moved = _copy_user(source, target, user_id)
+            with db.engine.begin() as main:
+                main.execute(User.__table__.update().where(User.__table__.c.id == user_id).values(shard=target_shard))
+            if has_request_context():
+                g.pop('_user_shards', None)
+            _delete_user(source, user_id)
+            source.commit()
+        except Exception:
+            source.rollback()
+            raise
+    return moved
+
+
+def purge_strays(shard):
+    """Delete rows on ``shard`` that belong to users pinned to another shard."""
+    from app import db
+    from models import Receipt, Budget, User
+
+    engine = shard_engine(shard)
+    with engine.connect() as conn:
+        owners = set(conn.execute(select(Receipt.__table__.c.user_id).distinct()).scalars())
+        owners |= set(conn.execute(select(Budget.__table__.c.user_id).distinct()).scalars())
+    if not owners:
+        return 0
+    with db.engine.connect() as main:
+        pinned = dict(main.execute(select(User.id, User.shard).where(User.id.in_(owners))).all())
+    strays = [user_id for user_id in owners if pinned.get(user_id, shard) != shard]
+    with engine.begin() as conn:
+        for user_id in strays:
+            _delete_user(conn, user_id)
+    return len(strays)
+
+
+def rebalance(log=print):
+    """Move users from the fullest shards to the emptiest until user counts
+    differ by at most one. Returns the number of users moved."""
+    from app import db
+    from models import User
+
+    shards = shard_ids()
+    members = {shard: [] for shard in shards}
+    for user_id, shard in db.session.execute(select(User.id, User.shard).order_by(User.id.desc())).all():
+        if shard not in members:
+            raise ShardRoutingError(f'User {user_id} is pinned to unknown shard {shard}')
+        members[shard].append(user_id)
+    db.session.rollback()
+
+    moved_users = 0
+    while True:
+        fullest = max(shards, key=lambda shard: len(members[shard]))
+        emptiest = min(shards, key=lambda shard: len(members[shard]))
+        if len(members[fullest]) - len(members[emptiest]) <= 1:
+            break
+        user_id = members[fullest].pop(0)
+        rows = move_user(user_id, emptiest)
+        members[emptiest].append(user_id)
+        moved_users += 1
+        log(f"Moved user {user_id} from shard {fullest} to shard {emptiest} ({rows} rows)")
+    return moved_users
@@ -0,0 +1,32 @@
+from flask import current_app, stream_with_context
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def json_list_response(key, rows, chunk_size=STREAM_CHUNK_SIZE):
+    """Stream ``{"<key>": [row, ...]}`` from an iterator of JSON-able rows.
+
+    Neither the list nor the encoded body is built in memory; rows are
+    encoded one at a time and sent in chunks of about ``chunk_size``
+    characters. The request context (and its database session) stays
+    open until the last row has been sent.
+    """
+    dumps = current_app.json.dumps
+
+    def generate():
+        buffer = [f'{{"{key}":[']
+        size = 0
+        separator = ''
+        for row in rows:
+            part = separator + dumps(row)
+            separator = ','
+            buffer.append(part)
+            size += len(part)
+            if size >= chunk_size:
+                yield ''.join(buffer)
+                buffer = []
+                size = 0
+        buffer.append(']}\n')
+        yield ''.join(buffer)
+
+    return current_app.response_class(stream_with_context(generate()), mimetype='application/json')
@@ -0,0 +1,19 @@
+import re
+import unicodedata
+
+_NON_WORD = re.compile(r'[^\w\s-]+')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_name(value):
+    """Canonical form of a product or store name for matching and grouping.
+
+    Case-folded, accents stripped, punctuation dropped and whitespace
+    collapsed: "  Plátano  Tabasco, 1kg " -> "platano tabasco 1kg".
+    """
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFKD', value)
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    value = _NON_WORD.sub(' ', value.casefold())
+    return _SPACES.sub(' ', value).strip()